@@ -0,0 +1,7 @@
+"""Shared code for the 02616 Large-scale Modelling exercises and projects.
+
+The week directories (``w01`` .. ``w08``) keep the stand-alone lab scripts,
+reusable building blocks live in this package.
+Run scripts from the repository root (e.g. ``python -m lsm.jacobi``) so
+that ``lsm`` is importable.
+"""
@@ -0,0 +1,402 @@
+"""Broadcast algorithms for numpy buffers, for mpi4py and `lsm.mp`.
+
+Sending the full array from the root to every other rank (``Isend`` fan-out)
+costs ``(P-1) * n`` bytes on the root's link. The algorithms here spread
+that cost:
+
+``binomial``
+    binomial tree, ``log2(P)`` rounds of the full message.
+    Best for small messages (latency bound).
+``scatter_allgather``
+    van de Geijn: binomial scatter of ``P`` chunks followed by a ring
+    allgather. Every link carries about ``2 n`` bytes, for medium/large
+    messages.
+``chain``
+    the message is cut into segments which are pipelined along the
+    chain ``root -> root+1 -> ...``. For very large messages, the time
+    approaches ``n / bandwidth``.
+
+`bcast` picks an algorithm from the message size, with thresholds per
+backend and communicator size. Run a calibration to tune them for a
+machine, they are stored in `TUNING_FILE`::
+
+    mpirun -np 8 python -m lsm.bcast --calibrate
+    python -m lsm.bcast --calibrate --backend pipe --np 8
+
+Both backends are used through a small *link* interface (`MPILink`,
+`PipeLink`), the algorithms are shared.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from pathlib import Path
+from time import perf_counter as time
+
+import numpy as np
+
+ALGORITHMS = ("binomial", "scatter_allgather", "chain")
+
+# Tag used for all point-to-point messages of the broadcasts (MPI backend)
+BCAST_TAG = 701
+
+# Where calibrated thresholds are stored
+TUNING_FILE = Path(os.environ.get("LSM_BCAST_TUNING",
+                                  Path.home() / ".config" / "lsm" / "bcast.json"))
+
+# Used when no calibration is available (bytes)
+DEFAULT_THRESHOLDS = {
+    # below: binomial tree
+    "short": 12 * 1024,
+    # above: pipelined chain, in between: scatter + allgather
+    "long": 4 * 1024 ** 2,
+    # segment size of the pipelined chain
+    "segment": 128 * 1024,
+}
+
+
+# -----------------------------------------------------------------------------
+# Links
+# -----------------------------------------------------------------------------
+
+class MPILink:
+    """Buffer communication through an mpi4py communicator."""
+
+    backend = "mpi"
+
+    def __init__(self, comm):
+        from mpi4py import MPI
+        self.MPI = MPI
+        self.comm = comm
+        self.rank = comm.Get_rank()
+        self.size = comm.Get_size()
+
+    def send(self, buf, dest):
+        self.comm.Send(buf, dest=dest, tag=BCAST_TAG)
+
+    def isend(self, buf, dest):
+        return self.comm.Isend(buf, dest=dest, tag=BCAST_TAG)
+
+    def recv(self, buf, source):
+        self.comm.Recv(buf, source=source, tag=BCAST_TAG)
+
+    def sendrecv(self, sendbuf, dest, recvbuf, source):
+        self.comm.Sendrecv(sendbuf, dest=dest, sendtag=BCAST_TAG,
+                           recvbuf=recvbuf, source=source, recvtag=BCAST_TAG)
+
+    def waitall(self, reqs):
+        self.MPI.Request.Waitall(reqs)
+
+    def barrier(self):
+        self.comm.Barrier()
+
+    def allreduce_max(self, value):
+        return self.comm.allreduce(value, op=self.MPI.MAX)
+
+
+class PipeLink:
+    """Buffer communication through a `lsm.mp.Communicator`."""
+
+    backend = "pipe"
+
+    def __init__(self, comm):
+        self.comm = comm
+        self.rank = comm.rank
+        self.size = comm.size
+
+    def send(self, buf, dest):
+        self.comm.send(buf, dest)
+
+    def isend(self, buf, dest):
+        # the shared-memory transport buffers the message in the arena
+        self.send(buf, dest)
+
+    def recv(self, buf, source):
+        conn = self.comm.conns[source]
+        if hasattr(conn, "release"):
+            # ShmConnection, copy straight from the shared memory
+            data = conn.recv(out=buf)
+        else:
+            data = conn.recv()
+        if data is not buf:
+            buf[...] = data
+
+    def sendrecv(self, sendbuf, dest, recvbuf, source):
+        # even ranks send first, so a ring of large messages can't deadlock
+        if self.rank % 2 == 0:
+            self.send(sendbuf, dest)
+            self.recv(recvbuf, source)
+        else:
+            self.recv(recvbuf, source)
+            self.send(sendbuf, dest)
+
+    def waitall(self, reqs):
+        pass
+
+    def barrier(self):
+        self.comm.barrier()
+
+    def allreduce_max(self, value):
+        return self.comm.allreduce(value, op=max)
+
+
+def as_link(comm):
+    """Wrap an mpi4py or `lsm.mp` communicator in a link"""
+    if isinstance(comm, (MPILink, PipeLink)):
+        return comm
+    if hasattr(comm, "Sendrecv"):
+        return MPILink(comm)
+    return PipeLink(comm)
+
+
+# -----------------------------------------------------------------------------
+# Algorithms
+# -----------------------------------------------------------------------------
+
+def bcast_binomial(link, buf: np.ndarray, root: int = 0):
+    """Binomial tree broadcast of `buf`"""
+    size = link.size
+    vrank = (link.rank - root) % size
+
+    mask = 1
+    while mask < size:
+        if vrank & mask:
+            link.recv(buf, (vrank - mask + root) % size)
+            break
+        mask <<= 1
+
+    mask >>= 1
+    reqs = []
+    while mask > 0:
+        if vrank + mask < size:
+            reqs.append(link.isend(buf, (vrank + mask + root) % size))
+        mask >>= 1
+    link.waitall(reqs)
+
+
+def bcast_scatter_allgather(link, buf: np.ndarray, root: int = 0):
+    """van de Geijn broadcast: binomial scatter + ring allgather"""
+    size = link.size
+    vrank = (link.rank - root) % size
+    real = lambda v: (v + root) % size
+
+    flat = buf.reshape(-1)
+    # chunk ``c`` belongs to relative rank ``c``
+    bounds = [c * flat.size // size for c in range(size + 1)]
+    chunks = lambda first, last: flat[bounds[first]:bounds[min(last, size)]]
+
+    # scatter: receive the chunks of our sub-tree ``[vrank, vrank + mask)``
+    mask = 1
+    while mask < size:
+        if vrank & mask:
+            link.recv(chunks(vrank, vrank + mask), real(vrank - mask))
+            break
+        mask <<= 1
+
+    mask >>= 1
+    while mask > 0:
+        if vrank + mask < size:
+            link.send(chunks(vrank + mask, vrank + 2 * mask), real(vrank + mask))
+        mask >>= 1
+
+    # ring allgather, in step s we pass on the chunk received in step s-1
+    right, left = real(vrank + 1), real(vrank - 1)
+    for step in range(size - 1):
+        send_c = (vrank - step) % size
+        recv_c = (vrank - step - 1) % size
+        link.sendrecv(chunks(send_c, send_c + 1), right,
+                      chunks(recv_c, recv_c + 1), left)
+
+
+def bcast_chain(link, buf: np.ndarray, root: int = 0,
+                segment: int = DEFAULT_THRESHOLDS["segment"]):
+    """Pipelined chain broadcast in segments of `segment` bytes"""
+    size = link.size
+    vrank = (link.rank - root) % size
+    prev_rank, next_rank = (vrank - 1 + root) % size, (vrank + 1 + root) % size
+
+    flat = buf.reshape(-1)
+    step = max(1, segment // flat.itemsize)
+    reqs = []
+    for start in range(0, flat.size, step):
+        seg = flat[start:start + step]
+        if vrank > 0:
+            link.recv(seg, prev_rank)
+        if vrank < size - 1:
+            # forward while receiving the next segment
+            reqs.append(link.isend(seg, next_rank))
+    link.waitall(reqs)
+
+
+# -----------------------------------------------------------------------------
+# Selection
+# -----------------------------------------------------------------------------
+
+def load_thresholds(backend: str, size: int, path: Path = TUNING_FILE) -> dict:
+    """Thresholds for `backend` at `size` ranks.
+
+    Uses the calibration of the closest communicator size, or
+    `DEFAULT_THRESHOLDS` if nothing has been calibrated.
+    """
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    try:
+        tuned = json.loads(Path(path).read_text()).get(backend, {})
+    except (OSError, ValueError):
+        tuned = {}
+    if tuned:
+        closest = min(tuned, key=lambda s: abs(np.log2(int(s) / size)))
+        thresholds.update(tuned[closest])
+    return thresholds
+
+
+def save_thresholds(backend: str, size: int, thresholds: dict, path: Path = TUNING_FILE):
+    """Store `thresholds` for `backend` at `size` ranks in `path`"""
+    path = Path(path)
+    try:
+        tuned = json.loads(path.read_text())
+    except (OSError, ValueError):
+        tuned = {}
+    tuned.setdefault(backend, {})[str(size)] = thresholds
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(tuned, indent=2, sort_keys=True) + "\n")
+
+
+_thresholds_cache: dict[tuple[str, int], dict] = {}
+
+
+def select(nbytes: int, size: int, thresholds: dict) -> str:
+    """Name of the algorithm to use for `nbytes` on `size` ranks"""
+    if size <= 2 or nbytes < thresholds["short"]:
+        return "binomial"
+    if nbytes < thresholds["long"]:
+        return "scatter_allgather"
+    return "chain"
+
+
+def bcast(comm, buf: np.ndarray, root: int = 0, algorithm: str | None = None,
+          segment: int | None = None):
+    """Broadcast the contiguous array `buf` from `root`, in place.
+
+    Parameters
+    ----------
+    comm :
+        mpi4py communicator, `lsm.mp.Communicator` or a link.
+    algorithm :
+        one of `ALGORITHMS`, selected from the message size if None.
+    segment :
+        segment size (bytes) of the ``chain`` algorithm.
+    """
+    if not buf.flags.c_contiguous:
+        raise ValueError("bcast requires a C-contiguous buffer")
+    link = as_link(comm)
+
+    key = (link.backend, link.size)
+    if key not in _thresholds_cache:
+        _thresholds_cache[key] = load_thresholds(*key)
+    thresholds = _thresholds_cache[key]
+
+    if algorithm is None:
+        algorithm = select(buf.nbytes, link.size, thresholds)
+    if algorithm == "binomial":
+        bcast_binomial(link, buf, root)
+    elif algorithm == "scatter_allgather":
+        bcast_scatter_allgather(link, buf, root)
+    elif algorithm == "chain":
+        bcast_chain(link, buf, root, segment or thresholds["segment"])
+    else:
+        raise ValueError(f"Unknown broadcast algorithm: {algorithm}")
+
+
+# -----------------------------------------------------------------------------
+# Calibration
+# -----------------------------------------------------------------------------
+
+def time_bcast(link, buf, algorithm, repeats: int = 5, segment: int | None = None) -> float:
+    """Median (over `repeats`) of the slowest rank's broadcast time"""
+    bcast(link, buf, algorithm=algorithm, segment=segment)  # warm-up
+    times = []
+    for _ in range(repeats):
+        link.barrier()
+        t0 = time()
+        bcast(link, buf, algorithm=algorithm, segment=segment)
+        times.append(link.allreduce_max(time() - t0))
+    return float(np.median(times))
+
+
+def calibrate(comm, min_power: int = 10, max_power: int = 26, repeats: int = 5,
+              segments=(32 * 1024, 128 * 1024, 512 * 1024),
+              save: bool = True, verbose: bool = True) -> dict:
+    """Time all algorithms for message sizes ``2**min_power .. 2**max_power`` bytes.
+
+    The thresholds are placed where the fastest algorithm changes, and the
+    chain segment size is tuned on the largest message.
+    """
+    link = as_link(comm)
+    sizes = [2 ** p for p in range(min_power, max_power + 1)]
+    buf = np.zeros(sizes[-1] // 8)
+
+    segment = min(segments, key=lambda seg: time_bcast(
+        link, buf, "chain", repeats, segment=seg))
+
+    timings = []
+    for nbytes in sizes:
+        view = buf[:nbytes // 8]
+        times = {name: time_bcast(link, view, name, repeats, segment=segment)
+                 for name in ALGORITHMS}
+        timings.append(times)
+        if verbose and link.rank == 0:
+            line = "  ".join(f"{name}={t * 1e6:10.1f}us" for name, t in times.items())
+            print(f"{nbytes:10d} B  {line}  -> {min(times, key=times.get)}", flush=True)
+
+    # Place both thresholds such that the selection is slowed down the least
+    # (relative to the fastest algorithm, summed over all sizes).
+    # This is less sensitive to noise than taking the first size where
+    # another algorithm wins.
+    candidates = sizes + [2 * sizes[-1]]
+
+    def slowdown(short, long):
+        return sum(times[select(n, link.size, {"short": short, "long": long})]
+                   / min(times.values())
+                   for n, times in zip(sizes, timings))
+
+    short, long = min(((short, long) for short in candidates
+                       for long in candidates if long >= short),
+                      key=lambda pair: slowdown(*pair))
+    thresholds = {"short": short, "long": long, "segment": segment}
+
+    if link.rank == 0:
+        if verbose:
+            print(f"{link.backend} @ {link.size} ranks: {thresholds}")
+        if save:
+            save_thresholds(link.backend, link.size, thresholds)
+    _thresholds_cache.pop((link.backend, link.size), None)
+    return thresholds
+
+
+def _calibrate_pipe(comm, args):
+    return calibrate(comm, args.min_power, args.max_power, args.repeats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--calibrate", action="store_true",
+                        help="tune the thresholds and store them in TUNING_FILE")
+    parser.add_argument("--backend", choices=("mpi", "pipe"), default="mpi")
+    parser.add_argument("--np", type=int, default=4,
+                        help="number of processes for the pipe backend")
+    parser.add_argument("--min-power", type=int, default=10)
+    parser.add_argument("--max-power", type=int, default=24)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    if not args.calibrate:
+        print(json.dumps({backend: load_thresholds(backend, args.np)
+                          for backend in ("mpi", "pipe")}, indent=2))
+    elif args.backend == "mpi":
+        from mpi4py import MPI
+        calibrate(MPI.COMM_WORLD, args.min_power, args.max_power, args.repeats)
+    else:
+        from lsm.mp import launch
+        launch(args.np, _calibrate_pipe, args)
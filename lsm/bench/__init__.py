@@ -0,0 +1,28 @@
+"""Communication micro-benchmarks: ``python -m lsm.bench``.
+
+One timing loop (`measure`) for all transports (`TRANSPORTS`: pipe, shm,
+object, buffer, persistent, datatype, hierarchical) and patterns
+(`PATTERNS`: pingpong, latency, window, bidirectional, bcast, allreduce,
+gather), so that the curves are comparable: same message sizes, warm-up,
+timers and units (``1 MB = 1e6 B``).
+"""
+
+from .measure import (Measurement, best_windows, crossover, latency_sizes, measure,
+                      message_sizes, summarize, sweep)
+from .patterns import PATTERNS, Pattern
+from .transports import TRANSPORTS, Transport
+
+__all__ = [
+    "Measurement",
+    "PATTERNS",
+    "Pattern",
+    "TRANSPORTS",
+    "Transport",
+    "best_windows",
+    "crossover",
+    "latency_sizes",
+    "measure",
+    "message_sizes",
+    "summarize",
+    "sweep",
+]
@@ -0,0 +1,208 @@
+"""Command line of the benchmarks::
+
+    mpirun -np 2 python -m lsm.bench -t buffer object datatype -p pingpong window
+    python -m lsm.bench -t pipe shm -p pingpong --np 2
+    mpirun -np 8 python -m lsm.bench -t buffer -p bcast allreduce --json bench.json
+    mpirun -np 64 python -m lsm.bench -t buffer hierarchical -p allreduce gather
+    mpirun -np 2 python -m lsm.bench --latency -t object buffer
+    mpirun -np 2 python -m lsm.bench -p window --window 1 2 4 8 16 32 64
+
+``--latency`` compares with ``osu_latency``: one-way latencies of 0 B to
+64 KB messages over thousands of round trips, with a histogram.
+Several ``--window`` depths are compared in a table by message size, with
+the size after which the bandwidth dips (the eager/rendezvous crossover).
+
+The mpi4py transports run under ``mpirun``, the `lsm.mp` ones start
+``--np`` processes themselves; the two can't be mixed in one run.
+"""
+
+import argparse
+import json
+import platform
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from .measure import (HISTOGRAM_EDGES, best_windows, crossover, latency_sizes,
+                      message_sizes, sweep)
+from .patterns import PATTERNS, WINDOWED
+from .transports import TRANSPORTS
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m lsm.bench",
+        description="Communication micro-benchmarks of mpi4py and lsm.mp transports")
+    parser.add_argument("-t", "--transport", nargs="+", choices=TRANSPORTS,
+                        default=["buffer"], help="transports to measure")
+    parser.add_argument("-p", "--pattern", nargs="+", choices=PATTERNS,
+                        default=["pingpong"], help="communication patterns to measure")
+    parser.add_argument("--min-power", type=int, default=10,
+                        help="smallest message, 2**MIN_POWER bytes")
+    parser.add_argument("--max-power", type=int,
+                        help="largest message, 2**MAX_POWER bytes (default: 24)")
+    parser.add_argument("--latency", action="store_true",
+                        help="latency pattern, 0 B to 2**MAX_POWER (default 64 KB) "
+                             "messages, 10000 repeats")
+    parser.add_argument("--repeats", type=int,
+                        help="timed repetitions per message size (default: 20)")
+    parser.add_argument("--warmup", type=int,
+                        help="untimed repetitions per message size (default: 2)")
+    parser.add_argument("--window", type=int, nargs="+", default=[16],
+                        help="messages in flight of the window/bidirectional patterns, "
+                             "several depths are compared by message size")
+    parser.add_argument("--np", type=int, default=2,
+                        help="number of processes of the pipe/shm transports")
+    parser.add_argument("--json", metavar="FILE",
+                        help="also write the results to FILE")
+    args = parser.parse_args(argv)
+    backends = {TRANSPORTS[name].backend for name in args.transport}
+    if len(backends) > 1:
+        parser.error("mpi4py (object, buffer, persistent, datatype, hierarchical) and "
+                     "lsm.mp (pipe, shm) transports can't be mixed")
+    args.backend = backends.pop()
+    if args.latency:
+        args.pattern = ["latency"]
+        defaults = {"max_power": 16, "repeats": 10000, "warmup": 100}
+    else:
+        defaults = {"max_power": 24, "repeats": 20, "warmup": 2}
+    for name, value in defaults.items():
+        if getattr(args, name) is None:
+            setattr(args, name, value)
+    return args
+
+
+# Percentiles of the bandwidth and latency tables
+BANDWIDTH_COLUMNS = (10, 50, 90)
+LATENCY_COLUMNS = (50, 99)
+
+
+def report_header(t, pattern, window):
+    print(f"# transport={t.name} pattern={pattern.name} ranks={t.size} "
+          f"window={window} timer={t.timer_name}")
+    if pattern.name == "latency":
+        columns = "".join(f"{f'p{q}[us]':>10s}" for q in LATENCY_COLUMNS)
+        print("# histogram bins [us]: "
+              + " ".join(f"{e * 1e6:g}" for e in HISTOGRAM_EDGES[1:-1]))
+        print(f"#{'bytes':>7s}{'min[us]':>10s}{columns}{'max[us]':>10s}  histogram",
+              flush=True)
+        return
+    columns = "".join(f"{f'p{q}[us]':>11s}" for q in BANDWIDTH_COLUMNS)
+    print(f"#{'bytes':>10s}{'min[us]':>11s}{columns}{'max[us]':>11s}{'MB/s':>12s}",
+          flush=True)
+
+
+def report_line(m):
+    stats = m.stats
+    times = "".join(f"{stats[f'p{q}'] * 1e6:11.2f}" for q in BANDWIDTH_COLUMNS)
+    print(f"{m.nbytes:11d}{stats['min'] * 1e6:11.2f}{times}{stats['max'] * 1e6:11.2f}"
+          f"{m.bandwidth / 1e6:12.2f}", flush=True)
+
+
+def report_latency(m):
+    stats = m.stats
+    times = "".join(f"{stats[f'p{q}'] * 1e6:10.2f}" for q in LATENCY_COLUMNS)
+    counts = " ".join(f"{c:d}" for c in m.histogram)
+    print(f"{m.nbytes:8d}{stats['min'] * 1e6:10.2f}{times}{stats['max'] * 1e6:10.2f}"
+          f"  {counts}", flush=True)
+
+
+def report_windows(t, pattern, sweeps):
+    """Bandwidth of all window depths by message size, and where it dips"""
+    windows = sorted(sweeps)
+    print(f"# transport={t.name} pattern={pattern.name} bandwidth [MB/s] by window")
+    print(f"#{'bytes':>10s}" + "".join(f"{f'w={w}':>11s}" for w in windows) + "  best")
+    rows = zip(*(sweeps[w] for w in windows))
+    for ms, best in zip(rows, best_windows(sweeps)):
+        print(f"{ms[0].nbytes:11d}" + "".join(f"{m.bandwidth / 1e6:11.1f}" for m in ms)
+              + f"  {best}")
+    for w in windows:
+        size = crossover(sweeps[w])
+        dip = f"drops after {size} B" if size is not None else "never drops"
+        print(f"# window={w}: bandwidth {dip}")
+    print(flush=True)
+
+
+def run(comm, args, transports):
+    """Measure all `transports` x patterns on `comm`.
+
+    Returns the runs (as JSON-able dicts) on rank 0, None elsewhere.
+    """
+    if args.latency:
+        sizes = latency_sizes(args.max_power)
+    else:
+        sizes = message_sizes(args.min_power, args.max_power)
+    runs = []
+    for name in transports:
+        for pattern in (PATTERNS[p] for p in args.pattern):
+            t = TRANSPORTS[name](comm)
+            root = t.rank == 0
+            if pattern.collective and pattern.name not in t.collectives:
+                if root:
+                    print(f"# transport={name} has no {pattern.name}, skipped\n")
+                continue
+            if not pattern.collective and t.size < 2:
+                raise SystemExit(f"{pattern.name} requires at least 2 ranks")
+            windows = args.window if pattern.name in WINDOWED else [1]
+            report = report_latency if pattern.name == "latency" else report_line
+            sweeps = {}
+            for window in windows:
+                if root:
+                    report_header(t, pattern, window)
+                results = sweep(t, pattern, sizes, args.repeats, args.warmup, window,
+                                report=report if root else None)
+                sweeps[window] = results
+                if root:
+                    print()
+                    runs.append({"transport": name, "pattern": pattern.name,
+                                 "ranks": t.size, "window": window,
+                                 "warmup": args.warmup, "timer": t.timer_name,
+                                 "crossover": crossover(results),
+                                 "results": [m.to_dict() for m in results]})
+            if root and len(windows) > 1:
+                report_windows(t, pattern, sweeps)
+    return runs if comm.Get_rank() == 0 else None
+
+
+def _run_mp(comm, args, name):
+    return run(comm, args, [name])
+
+
+def metadata(args):
+    meta = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "argv": sys.argv[1:],
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "repeats": args.repeats,
+    }
+    if args.backend == "mpi":
+        import mpi4py
+        from mpi4py import MPI
+        meta["mpi4py"] = mpi4py.__version__
+        meta["mpi"] = MPI.Get_library_version().splitlines()[0].strip(" \0")
+        meta["wtick"] = MPI.Wtick()
+    return meta
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.backend == "mpi":
+        from mpi4py import MPI
+        runs = run(MPI.COMM_WORLD, args, args.transport)
+    else:
+        from ..mp import launch
+        runs = []
+        for name in args.transport:
+            runs += launch(args.np, _run_mp, args, name, transport=name)[0]
+
+    if runs is not None and args.json:
+        with open(args.json, "w") as f:
+            json.dump({"meta": metadata(args), "runs": runs}, f, indent=1)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
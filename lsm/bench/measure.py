@@ -0,0 +1,142 @@
+"""Timing loop and statistics shared by all transports and patterns.
+
+Every message size gets the same treatment: `warmup` untimed repetitions,
+then `repeats` repetitions, each started by a barrier and timed with the
+timer of the transport. The statistics are over the repetitions, the
+bandwidth is computed from the median time (bytes per second,
+``1 MB = 1e6 B``).
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from .patterns import Pattern
+from .transports import Transport
+
+# Percentiles reported next to min/max
+PERCENTILES = (10, 50, 90, 99)
+
+# Bin edges (seconds) of the latency histograms, the same for all sizes and
+# transports so that they can be compared
+HISTOGRAM_EDGES = np.array([0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, np.inf]) * 1e-6
+
+
+def message_sizes(min_power: int, max_power: int) -> list[int]:
+    """Message sizes ``2**min_power .. 2**max_power`` bytes"""
+    return [2 ** p for p in range(min_power, max_power + 1)]
+
+
+def latency_sizes(max_power: int = 16) -> list[int]:
+    """0 and ``2**0 .. 2**max_power`` bytes, as ``osu_latency``"""
+    return [0] + message_sizes(0, max_power)
+
+
+def summarize(times: np.ndarray) -> dict[str, float]:
+    """min, percentiles (``p50`` is the median), max and mean of `times`"""
+    stats = {"min": float(times.min())}
+    for q, value in zip(PERCENTILES, np.percentile(times, PERCENTILES)):
+        stats[f"p{q}"] = float(value)
+    stats["max"] = float(times.max())
+    stats["mean"] = float(times.mean())
+    return stats
+
+
+@dataclass
+class Measurement:
+    """Times of the repetitions of one message size."""
+
+    nbytes: int
+    # bytes moved per repetition
+    volume: int
+    times: np.ndarray = field(repr=False)
+
+    @property
+    def stats(self) -> dict[str, float]:
+        return summarize(self.times)
+
+    @property
+    def histogram(self) -> np.ndarray:
+        """Counts of the times in the bins of `HISTOGRAM_EDGES`"""
+        return np.histogram(self.times, HISTOGRAM_EDGES)[0]
+
+    @property
+    def bandwidth(self) -> float:
+        """Bytes per second at the median time"""
+        median = float(np.median(self.times))
+        return self.volume / median if median > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {"bytes": self.nbytes, "volume": self.volume,
+                "repeats": len(self.times), "time": self.stats,
+                "histogram": self.histogram.tolist(), "bandwidth": self.bandwidth}
+
+
+def measure(t: Transport, pattern: Pattern, nbytes: int, repeats: int = 20,
+            warmup: int = 2, window: int = 1) -> Measurement:
+    """Time `repeats` repetitions of `pattern` with `nbytes` messages.
+
+    All ranks must call this. For collectives, a repetition takes as long
+    as on the slowest rank. The times go into a preallocated array.
+    """
+    nbytes = t.prepare(nbytes)
+    for _ in range(warmup):
+        pattern.step(t, window)
+
+    times = np.empty(repeats)
+    timer, step = t.timer, pattern.step
+    t.barrier()
+    for i in range(repeats):
+        if pattern.sync:
+            t.barrier()
+        t0 = timer()
+        step(t, window)
+        times[i] = timer() - t0
+    if pattern.collective:
+        times = t.reduce_max(times)
+    if pattern.trips > 1:
+        times /= pattern.trips
+    return Measurement(nbytes, pattern.volume(nbytes, window), times)
+
+
+def crossover(results: list[Measurement]) -> int | None:
+    """Message size after which the bandwidth drops the most.
+
+    The bandwidth grows with the message size until the switch from the
+    eager to the rendezvous protocol adds a handshake to every message,
+    which shows up as a dip. Returns the last size before the largest drop
+    (over sizes in increasing order), None if the bandwidth never drops.
+    """
+    bandwidths = [m.bandwidth for m in results]
+    drops = [(after / before, m.nbytes) for before, after, m
+             in zip(bandwidths, bandwidths[1:], results) if before > 0]
+    if not drops or min(drops)[0] >= 1.0:
+        return None
+    return min(drops)[1]
+
+
+def best_windows(sweeps: dict[int, list[Measurement]], fraction: float = 0.9) -> list[int]:
+    """Per message size, the smallest window reaching `fraction` of the best
+    bandwidth of all windows in `sweeps` (``{window: results}``)."""
+    windows = sorted(sweeps)
+    best = []
+    for ms in zip(*(sweeps[w] for w in windows)):
+        top = max(m.bandwidth for m in ms)
+        best.append(next(w for w, m in zip(windows, ms) if m.bandwidth >= fraction * top))
+    return best
+
+
+def sweep(t: Transport, pattern: Pattern, sizes: list[int], repeats: int = 20,
+          warmup: int = 2, window: int = 1, report=None) -> list[Measurement]:
+    """`measure` all message `sizes`, calling ``report(measurement)`` for
+    each one as it completes."""
+    results = []
+    for nbytes in sizes:
+        m = measure(t, pattern, nbytes, repeats, warmup, window)
+        results.append(m)
+        if report is not None:
+            report(m)
+    t.free()
+    return results
@@ -0,0 +1,79 @@
+"""Communication patterns, one repetition of each.
+
+Point-to-point patterns run between ranks 0 and 1 (other ranks only take
+part in the barriers), collectives on all ranks.
+
+``pingpong``
+    rank 0 sends, rank 1 sends the message back; ``2 n`` bytes per
+    repetition (half the time is the one-way latency).
+``latency``
+    the ping-pong as ``osu_latency``: no barrier between the repetitions,
+    the times are the one-way latencies (half the round trips).
+``window``
+    rank 0 sends `window` messages back to back, rank 1 receives each one
+    into its own slot and acknowledges the window with an empty message;
+    ``window n`` bytes.
+``bidirectional``
+    both ranks send `window` messages to each other at the same time;
+    ``2 window n`` bytes.
+``bcast``, ``allreduce``, ``gather``
+    the collective of an `n` byte buffer (``allreduce`` with a bitwise or),
+    counted as `n` bytes.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Callable
+
+from .transports import Transport
+
+
+@dataclass(frozen=True)
+class Pattern:
+    name: str
+    # one repetition: ``step(transport, window)``
+    step: Callable[[Transport, int], None]
+    # bytes moved per repetition: ``volume(nbytes, window)``
+    volume: Callable[[int, int], int]
+    # times are the slowest rank's (collectives) or rank 0's
+    collective: bool = False
+    # messages in sequence per repetition, the times are per message
+    trips: int = 1
+    # barrier before every repetition, or only before the first one
+    sync: bool = True
+
+
+def pingpong(t: Transport, window: int):
+    if t.rank == 0:
+        t.send(1)
+        t.recv(1)
+    elif t.rank == 1:
+        t.recv(0)
+        t.send(0)
+
+
+def windowed(t: Transport, window: int):
+    if t.rank == 0:
+        t.send_window(1, window)
+    elif t.rank == 1:
+        t.recv_window(0, window)
+
+
+def bidirectional(t: Transport, window: int):
+    if t.rank < 2:
+        t.exchange(1 - t.rank, window)
+
+
+# patterns using the window depth
+WINDOWED = ("window", "bidirectional")
+
+PATTERNS = {p.name: p for p in (
+    Pattern("pingpong", pingpong, lambda n, w: 2 * n),
+    Pattern("latency", pingpong, lambda n, w: n, trips=2, sync=False),
+    Pattern("window", windowed, lambda n, w: w * n),
+    Pattern("bidirectional", bidirectional, lambda n, w: 2 * w * n),
+    Pattern("bcast", lambda t, w: t.bcast(), lambda n, w: n, collective=True),
+    Pattern("allreduce", lambda t, w: t.allreduce(), lambda n, w: n, collective=True),
+    Pattern("gather", lambda t, w: t.gather(), lambda n, w: n, collective=True),
+)}
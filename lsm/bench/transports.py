@@ -0,0 +1,464 @@
+"""Transports: how a message of ``nbytes`` moves between two ranks.
+
+A transport wraps a communicator and owns the send/receive buffers of the
+current message size (`Transport.prepare`). The patterns only call its
+methods, so all transports are measured by exactly the same code:
+
+``pipe``
+    `lsm.mp` communicator on `multiprocessing.Pipe`, arrays are pickled.
+``shm``
+    `lsm.mp` communicator on `lsm.mp.shm_pipe`, arrays are copied through
+    shared memory.
+``object``
+    mpi4py lower-case ``send``/``recv``, the array is pickled.
+``buffer``
+    mpi4py ``Send``/``Recv`` straight from the numpy buffer.
+``persistent``
+    as ``buffer``, with requests bound to the buffers once
+    (``Send_init``/``Recv_init``) and restarted with ``Startall``.
+``datatype``
+    mpi4py ``Send``/``Recv`` of every other double of a twice as large
+    array, described by a ``Create_vector`` datatype (no packing on the
+    Python side).
+``hierarchical``
+    as ``buffer``, the collectives in node and node-leader steps
+    (`lsm.hierarchical.HierarchicalComm`).
+
+The mpi4py transports run under ``mpirun`` on ``MPI.COMM_WORLD`` and are
+timed with `MPI.Wtime`, the `lsm.mp` ones are started with `lsm.mp.launch`
+and timed with `time.perf_counter`.
+"""
+
+from __future__ import annotations
+
+from time import perf_counter
+
+import numpy as np
+
+from ..bcast import PipeLink
+
+# Tags of the payload and of the acknowledgement closing a window
+DATA_TAG, ACK_TAG = 801, 802
+
+
+class Transport:
+    """Interface of a transport, see the module documentation.
+
+    Parameters
+    ----------
+    comm :
+        mpi4py communicator or `lsm.mp.Communicator`.
+    """
+
+    name = ""
+    # "mpi": run under mpirun, "mp": started with `lsm.mp.launch`
+    backend = ""
+    # name of the timer, for the reports
+    timer_name = ""
+    # collective patterns the transport can run
+    collectives = ("bcast", "allreduce", "gather")
+
+    def __init__(self, comm):
+        self.comm = comm
+        self.rank = comm.Get_rank()
+        self.size = comm.Get_size()
+        self.nbytes = 0
+        self.sendbuf = self.recvbuf = np.empty(0, dtype=np.uint8)
+
+    def timer(self) -> float:
+        raise NotImplementedError
+
+    def prepare(self, nbytes: int) -> int:
+        """Allocate the buffers of an `nbytes` message.
+
+        Returns the number of bytes actually sent per message.
+        """
+        self.nbytes = nbytes
+        self.sendbuf = np.ones(nbytes, dtype=np.uint8)
+        self.recvbuf = np.empty(nbytes, dtype=np.uint8)
+        return nbytes
+
+    # point-to-point
+    def send(self, dest: int):
+        raise NotImplementedError
+
+    def recv(self, source: int):
+        raise NotImplementedError
+
+    def send_window(self, dest: int, window: int):
+        """Send `window` messages back to back, wait for the acknowledgement"""
+        raise NotImplementedError
+
+    def recv_window(self, source: int, window: int):
+        """Receive `window` messages, then acknowledge"""
+        raise NotImplementedError
+
+    def exchange(self, partner: int, window: int):
+        """Send and receive `window` messages to/from `partner` at the same time"""
+        raise NotImplementedError
+
+    # collectives
+    def bcast(self, root: int = 0):
+        raise NotImplementedError
+
+    def allreduce(self):
+        raise NotImplementedError
+
+    def gather(self, root: int = 0):
+        raise NotImplementedError
+
+    # synchronisation of the measurement
+    def barrier(self):
+        raise NotImplementedError
+
+    def reduce_max(self, values: np.ndarray) -> np.ndarray:
+        """Element-wise maximum of `values` over all ranks"""
+        raise NotImplementedError
+
+    def free(self):
+        """Release the resources of the transport"""
+
+
+# -----------------------------------------------------------------------------
+# mpi4py
+# -----------------------------------------------------------------------------
+
+class BufferTransport(Transport):
+    """mpi4py ``Send``/``Recv`` of numpy buffers."""
+
+    name = "buffer"
+    backend = "mpi"
+    timer_name = "MPI.Wtime"
+
+    def __init__(self, comm):
+        super().__init__(comm)
+        from mpi4py import MPI
+        self.MPI = MPI
+        self.ack = np.empty(0, dtype=np.uint8)
+        # receive buffers of a window, see `slots`
+        self.window_slots: np.ndarray | None = None
+
+    def timer(self) -> float:
+        return self.MPI.Wtime()
+
+    def sendspec(self):
+        """Buffer argument of the sends"""
+        return self.sendbuf
+
+    def recvspec(self, buf: np.ndarray | None = None):
+        """Buffer argument of the receives (into `buf`, or `recvbuf`)"""
+        return self.recvbuf if buf is None else buf
+
+    def slots(self, window: int) -> list:
+        """Receive buffer arguments of a window, one slot per request.
+
+        Messages in flight at the same time must not land in the same
+        memory, so each receive of a window gets its own copy of `recvbuf`.
+        """
+        if window == 1:
+            return [self.recvspec()]
+        if self.window_slots is None or len(self.window_slots) != window:
+            self.window_slots = np.empty((window,) + self.recvbuf.shape, self.recvbuf.dtype)
+        return [self.recvspec(slot) for slot in self.window_slots]
+
+    def send(self, dest: int):
+        self.comm.Send(self.sendspec(), dest, DATA_TAG)
+
+    def recv(self, source: int):
+        self.comm.Recv(self.recvspec(), source, DATA_TAG)
+
+    def send_window(self, dest: int, window: int):
+        comm, buf = self.comm, self.sendspec()
+        self.MPI.Request.Waitall([comm.Isend(buf, dest, DATA_TAG) for _ in range(window)])
+        comm.Recv(self.ack, dest, ACK_TAG)
+
+    def recv_window(self, source: int, window: int):
+        comm = self.comm
+        self.MPI.Request.Waitall([comm.Irecv(buf, source, DATA_TAG)
+                                  for buf in self.slots(window)])
+        comm.Send(self.ack, source, ACK_TAG)
+
+    def exchange(self, partner: int, window: int):
+        comm, sendbuf = self.comm, self.sendspec()
+        reqs = [comm.Irecv(buf, partner, DATA_TAG) for buf in self.slots(window)]
+        reqs += [comm.Isend(sendbuf, partner, DATA_TAG) for _ in range(window)]
+        self.MPI.Request.Waitall(reqs)
+
+    def prepare(self, nbytes: int) -> int:
+        nbytes = super().prepare(nbytes)
+        self.gathered = np.empty(self.size * nbytes, dtype=np.uint8)
+        self.window_slots = None
+        return nbytes
+
+    def bcast(self, root: int = 0):
+        self.comm.Bcast(self.sendspec(), root)
+
+    def allreduce(self):
+        self.comm.Allreduce(self.sendbuf, self.recvbuf, op=self.MPI.BOR)
+
+    def gather(self, root: int = 0):
+        self.comm.Gather(self.sendspec(), self.gathered, root)
+
+    def barrier(self):
+        self.comm.Barrier()
+
+    def reduce_max(self, values: np.ndarray) -> np.ndarray:
+        values = np.array(values, dtype=np.float64)
+        self.comm.Allreduce(self.MPI.IN_PLACE, values, op=self.MPI.MAX)
+        return values
+
+
+class PersistentTransport(BufferTransport):
+    """Persistent ``Send_init``/``Recv_init`` channels on the buffers.
+
+    The requests of a peer and window are created the first time they are
+    used and restarted afterwards, so the timed repetitions only do
+    ``Startall``/``Waitall``. Point-to-point patterns only.
+    """
+
+    name = "persistent"
+    collectives = ()
+
+    def __init__(self, comm):
+        super().__init__(comm)
+        # requests by (kind, peer, count)
+        self.channels: dict[tuple[str, int, int], list] = {}
+
+    def prepare(self, nbytes: int) -> int:
+        # the buffers change, so do the requests
+        self.free()
+        return super().prepare(nbytes)
+
+    def channel(self, kind: str, peer: int, count: int = 1) -> list:
+        """`count` persistent sends to (``kind="send"``) or receives from `peer`"""
+        key = (kind, peer, count)
+        reqs = self.channels.get(key)
+        if reqs is None:
+            if kind == "send":
+                reqs = [self.comm.Send_init(self.sendspec(), peer, DATA_TAG)
+                        for _ in range(count)]
+            else:
+                reqs = [self.comm.Recv_init(buf, peer, DATA_TAG)
+                        for buf in self.slots(count)]
+            self.channels[key] = reqs
+        return reqs
+
+    def run(self, reqs: list):
+        if len(reqs) == 1:
+            reqs[0].Start()
+            reqs[0].Wait()
+        else:
+            self.MPI.Prequest.Startall(reqs)
+            self.MPI.Request.Waitall(reqs)
+
+    def send(self, dest: int):
+        self.run(self.channel("send", dest))
+
+    def recv(self, source: int):
+        self.run(self.channel("recv", source))
+
+    def send_window(self, dest: int, window: int):
+        self.run(self.channel("send", dest, window))
+        self.comm.Recv(self.ack, dest, ACK_TAG)
+
+    def recv_window(self, source: int, window: int):
+        self.run(self.channel("recv", source, window))
+        self.comm.Send(self.ack, source, ACK_TAG)
+
+    def exchange(self, partner: int, window: int):
+        self.run(self.channel("recv", partner, window) + self.channel("send", partner, window))
+
+    def free(self):
+        for reqs in self.channels.values():
+            for req in reqs:
+                req.Free()
+        self.channels.clear()
+
+
+class ObjectTransport(BufferTransport):
+    """mpi4py lower-case ``send``/``recv``, the array is pickled."""
+
+    name = "object"
+
+    def send(self, dest: int):
+        self.comm.send(self.sendbuf, dest, DATA_TAG)
+
+    def recv(self, source: int):
+        self.recvbuf = self.comm.recv(source=source, tag=DATA_TAG)
+
+    def send_window(self, dest: int, window: int):
+        comm = self.comm
+        self.MPI.Request.waitall([comm.isend(self.sendbuf, dest, DATA_TAG)
+                                  for _ in range(window)])
+        comm.recv(source=dest, tag=ACK_TAG)
+
+    def recv_window(self, source: int, window: int):
+        # ``irecv`` needs a preallocated buffer for large pickles
+        for _ in range(window):
+            self.recv(source)
+        self.comm.send(None, source, ACK_TAG)
+
+    def exchange(self, partner: int, window: int):
+        reqs = [self.comm.isend(self.sendbuf, partner, DATA_TAG) for _ in range(window)]
+        for _ in range(window):
+            self.recv(partner)
+        self.MPI.Request.waitall(reqs)
+
+    def bcast(self, root: int = 0):
+        self.recvbuf = self.comm.bcast(self.sendbuf, root)
+
+    def allreduce(self):
+        self.recvbuf = self.comm.allreduce(self.sendbuf, op=self.MPI.BOR)
+
+    def gather(self, root: int = 0):
+        self.comm.gather(self.sendbuf, root)
+
+
+class DatatypeTransport(BufferTransport):
+    """mpi4py ``Send``/``Recv`` of a strided view with a vector datatype.
+
+    The payload is every other double of the buffers, as the strided
+    components of ``w08/bandwidth_custom_types.py``. Reductions on derived
+    datatypes aren't supported by MPI, so there is no ``allreduce``.
+    """
+
+    name = "datatype"
+    collectives = ("bcast", "gather")
+
+    def __init__(self, comm):
+        super().__init__(comm)
+        self.vector = None
+
+    def prepare(self, nbytes: int) -> int:
+        MPI = self.MPI
+        count = max(1, -(-nbytes // 8))
+        self.nbytes = 8 * count
+        self.free()
+        self.vector = MPI.DOUBLE.Create_vector(count, 1, 2).Commit()
+        self.sendbuf = np.ones(2 * count)
+        self.recvbuf = np.empty(2 * count)
+        self.gathered = np.empty(self.size * count)
+        self.window_slots = None
+        return self.nbytes
+
+    def sendspec(self):
+        return (self.sendbuf, 1, self.vector)
+
+    def recvspec(self, buf: np.ndarray | None = None):
+        return (self.recvbuf if buf is None else buf, 1, self.vector)
+
+    def gather(self, root: int = 0):
+        # the type signatures match: the strided doubles arrive contiguous
+        self.comm.Gather(self.sendspec(), (self.gathered, self.MPI.DOUBLE), root)
+
+    def free(self):
+        if self.vector is not None:
+            self.vector.Free()
+            self.vector = None
+
+
+class HierarchicalTransport(BufferTransport):
+    """mpi4py buffers, collectives of `lsm.hierarchical.HierarchicalComm`.
+
+    Compare with ``buffer`` on several nodes; on a single node both run
+    the same flat collectives.
+    """
+
+    name = "hierarchical"
+
+    def __init__(self, comm):
+        super().__init__(comm)
+        self.hier = None
+
+    def prepare(self, nbytes: int) -> int:
+        if self.hier is None:
+            from ..hierarchical import HierarchicalComm
+            self.hier = HierarchicalComm(self.comm)
+        return super().prepare(nbytes)
+
+    def bcast(self, root: int = 0):
+        self.hier.Bcast(self.sendbuf, root)
+
+    def allreduce(self):
+        self.hier.Allreduce(self.sendbuf, self.recvbuf, op=self.MPI.BOR)
+
+    def gather(self, root: int = 0):
+        self.hier.Gather(self.sendbuf, self.gathered, root)
+
+    def free(self):
+        if self.hier is not None:
+            self.hier.free()
+            self.hier = None
+
+
+# -----------------------------------------------------------------------------
+# lsm.mp
+# -----------------------------------------------------------------------------
+
+class PipeTransport(Transport):
+    """`lsm.mp.Communicator` on `multiprocessing.Pipe`.
+
+    A pipe only holds a bounded number of bytes, two large sends in
+    opposite directions would block each other. ``exchange`` therefore
+    takes turns (lower rank first), it measures both directions but not
+    full-duplex transfers.
+    """
+
+    name = "pipe"
+    backend = "mp"
+    timer_name = "perf_counter"
+
+    def __init__(self, comm):
+        super().__init__(comm)
+        self.link = PipeLink(comm)
+
+    def timer(self) -> float:
+        return perf_counter()
+
+    def send(self, dest: int):
+        self.link.send(self.sendbuf, dest)
+
+    def recv(self, source: int):
+        self.link.recv(self.recvbuf, source)
+
+    def send_window(self, dest: int, window: int):
+        for _ in range(window):
+            self.send(dest)
+        self.comm.recv(dest)
+
+    def recv_window(self, source: int, window: int):
+        for _ in range(window):
+            self.recv(source)
+        self.comm.send(None, source)
+
+    def exchange(self, partner: int, window: int):
+        for _ in range(window):
+            self.link.sendrecv(self.sendbuf, partner, self.recvbuf, partner)
+
+    def bcast(self, root: int = 0):
+        self.comm.Bcast(self.sendbuf, root)
+
+    def allreduce(self):
+        self.recvbuf = self.comm.allreduce(self.sendbuf, op=np.bitwise_or)
+
+    def gather(self, root: int = 0):
+        self.comm.gather(self.sendbuf, root)
+
+    def barrier(self):
+        self.comm.barrier()
+
+    def reduce_max(self, values: np.ndarray) -> np.ndarray:
+        return self.comm.allreduce(np.asarray(values, dtype=np.float64), op=np.maximum)
+
+
+class ShmTransport(PipeTransport):
+    """`lsm.mp.Communicator` on `lsm.mp.shm_pipe`."""
+
+    name = "shm"
+
+
+TRANSPORTS = {
+    cls.name: cls for cls in (PipeTransport, ShmTransport, ObjectTransport,
+                              BufferTransport, PersistentTransport, DatatypeTransport,
+                              HierarchicalTransport)
+}
@@ -0,0 +1,283 @@
+"""MPI datatypes describing numpy views, built and freed automatically.
+
+Instead of hand-building a derived datatype for every strided selection
+(as ``w08/sample2.py``), `buffer_spec` takes the view and returns an mpi4py
+buffer argument which sends/receives exactly its elements, without
+packing::
+
+    comm.Send(buffer_spec(grid[1:-1, 1]), dest)            # a column
+    comm.Recv(buffer_spec(xyz, np.s_[:, (0, 2)]), source)  # x and z
+    comm.Send(buffer_spec(u[10:20, 5:15]), dest)           # a sub-block
+
+The datatype is chosen from the memory layout of the view (after dropping
+length-one axes and merging axes which are contiguous with each other):
+
+- contiguous memory: no derived datatype, the view itself is the buffer,
+- one strided axis: ``Create_vector`` (``Create_hvector`` if the stride
+  isn't a multiple of the item size),
+- a C-ordered sub-block of a larger array: ``Create_subarray``,
+- an index list (``xyz[:, (0, 2)]``, which numpy would copy): ``Create_indexed``
+  on that axis,
+- anything else: nested ``Create_hvector``.
+
+Datatypes only depend on the layout, not on the position of the view, so
+they are memoised in an LRU cache (`CACHE`) keyed by shape, strides, dtype
+and index list; e.g. the west and east ghost columns share one type.
+Types are freed when they are evicted and at exit. Don't hold on to a
+datatype beyond the next call, `CACHE` may evict it; calling `buffer_spec`
+again is a dictionary lookup.
+"""
+
+from __future__ import annotations
+
+import atexit
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+import numpy as np
+from mpi4py import MPI
+
+# Number of datatypes kept in `CACHE`
+DEFAULT_MAXSIZE = 64
+
+Layout = tuple[tuple[int, ...], tuple[int, ...]]
+
+
+class TypeCache:
+    """LRU cache of committed datatypes, freed on eviction.
+
+    Parameters
+    ----------
+    maxsize :
+        number of datatypes to keep.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.types: OrderedDict[Hashable, MPI.Datatype] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, build: Callable[[], MPI.Datatype]) -> MPI.Datatype:
+        """The datatype of `key`, created with ``build()`` if not cached"""
+        dtype = self.types.get(key)
+        if dtype is not None:
+            self.hits += 1
+            self.types.move_to_end(key)
+            return dtype
+
+        self.misses += 1
+        dtype = self.types[key] = build()
+        while len(self.types) > self.maxsize:
+            _free(self.types.popitem(last=False)[1])
+        return dtype
+
+    def clear(self):
+        """Free all cached datatypes"""
+        while self.types:
+            _free(self.types.popitem()[1])
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+
+def _free(dtype: MPI.Datatype):
+    if not dtype.is_predefined and not MPI.Is_finalized():
+        dtype.Free()
+
+
+CACHE = TypeCache()
+# before mpi4py finalizes MPI
+atexit.register(CACHE.clear)
+
+
+def basic_datatype(dtype: np.dtype) -> MPI.Datatype:
+    """The MPI datatype of one item of `dtype`.
+
+    Predefined for the basic numpy types, a new datatype (free it) for
+    structured ones.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.fields is None and dtype.subdtype is None:
+        return MPI.Datatype.fromcode(dtype.char)
+    from mpi4py.util.dtlib import from_numpy_dtype
+    return from_numpy_dtype(dtype)
+
+
+def simplify(shape, strides) -> Layout:
+    """Drop length-one axes and merge axes which are contiguous with the next"""
+    axes = [(n, s) for n, s in zip(shape, strides) if n != 1]
+    merged: list[tuple[int, int]] = []
+    for n, s in reversed(axes):
+        if merged and s == merged[-1][0] * merged[-1][1]:
+            inner_n, inner_s = merged.pop()
+            merged.append((n * inner_n, inner_s))
+        else:
+            merged.append((n, s))
+    merged.reverse()
+    return tuple(n for n, _ in merged), tuple(s for _, s in merged)
+
+
+def _subarray_sizes(shape, strides, itemsize: int) -> list[int] | None:
+    """Sizes of the C-ordered array of which the layout is a sub-block at
+    the origin, None if there is none"""
+    if strides[-1] != itemsize:
+        return None
+    sizes = [shape[0]]
+    for outer, inner, n in zip(strides, strides[1:], shape[1:]):
+        if outer % inner or outer // inner < n:
+            return None
+        sizes.append(outer // inner)
+    return sizes
+
+
+def _strided(base: MPI.Datatype, itemsize: int, shape, strides) -> MPI.Datatype:
+    """Uncommitted datatype of the (simplified) strided layout of `base` items,
+    `base` itself if the layout is a single item"""
+    if not shape:
+        return base
+    if len(shape) == 1:
+        n, s = shape[0], strides[0]
+        if s == itemsize:
+            return base.Create_contiguous(n)
+        if s % itemsize == 0:
+            return base.Create_vector(n, 1, s // itemsize)
+        return base.Create_hvector(n, 1, s)
+
+    sizes = _subarray_sizes(shape, strides, itemsize)
+    if sizes is not None:
+        return base.Create_subarray(sizes, list(shape), [0] * len(shape))
+
+    dtype = _strided(base, itemsize, shape[-1:], strides[-1:])
+    for n, s in zip(reversed(shape[:-1]), reversed(strides[:-1])):
+        outer = dtype.Create_hvector(n, 1, s)
+        if dtype != base:
+            dtype.Free()
+        dtype = outer
+    return dtype
+
+
+def _indexed(base: MPI.Datatype, itemsize: int, positions, stride: int) -> MPI.Datatype:
+    """Uncommitted datatype of the items at `positions` along an axis with `stride`"""
+    if stride % itemsize:
+        return base.Create_hindexed([1] * len(positions), [p * stride for p in positions])
+    step = stride // itemsize
+    # runs of consecutive positions are blocks
+    blocks: list[list[int]] = []
+    for p in positions:
+        if blocks and step == 1 and p == blocks[-1][0] + blocks[-1][1]:
+            blocks[-1][1] += 1
+        else:
+            blocks.append([p, 1])
+    return base.Create_indexed([n for _, n in blocks], [p * step for p, _ in blocks])
+
+
+def create_datatype(dtype: np.dtype, shape, strides, axis: int | None = None,
+                    positions=None) -> MPI.Datatype:
+    """New committed datatype of a strided layout of `dtype` items.
+
+    `shape` and `strides` (bytes, non-negative) describe the layout from
+    its first item. With `axis`, only the items at `positions` along that
+    axis are selected (``shape[axis]`` is ignored). Free it when done.
+    """
+    dtype = np.dtype(dtype)
+    item = basic_datatype(dtype)
+    itemsize = dtype.itemsize
+    if axis is None:
+        result = _strided(item, itemsize, *simplify(shape, strides))
+    else:
+        # the axes after `axis` make one element of the index list
+        inner_shape, inner_strides = simplify(shape[axis + 1:], strides[axis + 1:])
+        inner = _strided(item, itemsize, inner_shape, inner_strides)
+        if inner == item:
+            selected = _indexed(item, itemsize, positions, strides[axis])
+        else:
+            selected = inner.Create_hindexed([1] * len(positions),
+                                             [p * strides[axis] for p in positions])
+            inner.Free()
+        outer_shape, outer_strides = simplify(shape[:axis], strides[:axis])
+        result = selected
+        for n, s in zip(reversed(outer_shape), reversed(outer_strides)):
+            result = selected.Create_hvector(n, 1, s)
+            selected.Free()
+            selected = result
+
+    if result == item:
+        # a single item
+        result = item.Dup()
+    result.Commit()
+    if not item.is_predefined:
+        item.Free()
+    return result
+
+
+def _split_index(array: np.ndarray, index) -> tuple[np.ndarray, int | None, tuple[int, ...]]:
+    """Apply the basic part of `index`, returns ``(view, axis, positions)``
+    of at most one list of integers in `index`"""
+    if index is None:
+        return array, None, ()
+    if not isinstance(index, tuple):
+        index = (index,)
+    lists = [i for i, entry in enumerate(index)
+             if isinstance(entry, (list, tuple, np.ndarray))]
+    if not lists:
+        return array[index], None, ()
+    if len(lists) > 1:
+        raise ValueError("only one index list is supported")
+
+    k = lists[0]
+    # axes of the view in front of the index list
+    consumed = sum(entry is not None and entry is not Ellipsis for entry in index)
+    axis = 0
+    for entry in index[:k]:
+        if entry is Ellipsis:
+            axis += array.ndim - consumed
+        elif not isinstance(entry, (int, np.integer)):
+            axis += 1
+    view = array[index[:k] + (slice(None),) + index[k + 1:]]
+    n = view.shape[axis]
+    positions = tuple(int(p) % n for p in index[k])
+    if not positions or sorted(set(positions)) != list(positions):
+        raise ValueError("the index list must be increasing")
+    return view, axis, positions
+
+
+def _build(view: np.ndarray, axis: int | None, positions) -> MPI.Datatype:
+    if any(s < 0 or (s == 0 and n > 1) for n, s in zip(view.shape, view.strides)):
+        raise ValueError("negative or zero (broadcast) strides are not supported")
+    return create_datatype(view.dtype, view.shape, view.strides, axis, positions)
+
+
+def _datatype(view: np.ndarray, axis: int | None, positions, cache: TypeCache) -> MPI.Datatype:
+    key = (view.shape, view.strides, view.dtype, axis, positions)
+    return cache.get(key, lambda: _build(view, axis, positions))
+
+
+def datatype(array: np.ndarray, index=None, cache: TypeCache = CACHE) -> MPI.Datatype:
+    """Cached committed datatype of ``array[index]``, relative to its first item.
+
+    `index` may hold one list of increasing integers (``np.s_[:, (0, 2)]``),
+    which selects those positions along its axis without a copy.
+    """
+    return _datatype(*_split_index(array, index), cache)
+
+
+def buffer_spec(array: np.ndarray, index=None, cache: TypeCache = CACHE):
+    """mpi4py buffer argument for the items of ``array[index]``.
+
+    Contiguous views are returned as they are, otherwise a
+    ``(memory, 1, datatype)`` triple with the cached `datatype`. The
+    memory doesn't hold a reference to `array`, which must stay alive
+    until the communication completes.
+    """
+    view, axis, positions = _split_index(array, index)
+    if axis is None and (view.flags.c_contiguous or view.size <= 1):
+        return view
+    if view.size == 0:
+        return np.empty(0, view.dtype)
+    dtype = _datatype(view, axis, positions, cache)
+    # from the first to the end of the last item
+    nbytes = view.itemsize
+    for i, (n, s) in enumerate(zip(view.shape, view.strides)):
+        nbytes += (positions[-1] if i == axis else n - 1) * s
+    return (MPI.buffer.fromaddress(view.ctypes.data, nbytes), 1, dtype)
@@ -0,0 +1,172 @@
+"""Node-aware (hierarchical) collectives for mpi4py communicators.
+
+A flat collective over ``P`` ranks on ``N`` nodes may cross the network
+once per rank. `HierarchicalComm` splits the communicator into the ranks
+of each node (``Split_type(COMM_TYPE_SHARED)``) and a communicator of the
+node leaders (rank 0 of each node), and runs the collectives in steps:
+
+``allreduce``
+    reduce on the node, allreduce of the leaders, broadcast on the node,
+``bcast``
+    broadcast on the node of the root, of the leaders, on the other nodes,
+``gather``
+    gather on the node, gather of the leaders, reordered by rank at the root,
+
+so that only one message per node crosses the network::
+
+    hc = HierarchicalComm(comm)
+    total = hc.allreduce(local, op=MPI.SUM)
+    hc.Allreduce(sendbuf, recvbuf, op=MPI.SUM)
+    hc.free()
+
+The reduction operators must be commutative: the operands are combined in
+another order than by the flat collective, so floating point sums may
+differ in the last digits. On a single node, or with one rank per node,
+the flat collectives of `comm` are used.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+from mpi4py import MPI
+
+
+class HierarchicalComm:
+    """Collectives of `comm` in node and leader steps, see the module documentation.
+
+    Creating it is collective over `comm`. The buffer collectives (upper
+    case) take contiguous numpy arrays, the lower case ones any picklable
+    object, as their `MPI.Comm` counterparts.
+    """
+
+    def __init__(self, comm: MPI.Intracomm):
+        self.comm = comm
+        self.rank = comm.Get_rank()
+        self.size = comm.Get_size()
+        # ordered by rank, so the ranks of a node keep their order
+        self.node = comm.Split_type(MPI.COMM_TYPE_SHARED, key=self.rank)
+        self.is_leader = self.node.Get_rank() == 0
+        self.leaders = comm.Split(0 if self.is_leader else MPI.UNDEFINED, key=self.rank)
+        self.node_index = self.node.bcast(self.leaders.Get_rank() if self.is_leader else None)
+        # (node index, rank in the node) of every rank
+        self.layout: list[tuple[int, int]] = comm.allgather(
+            (self.node_index, self.node.Get_rank()))
+        self.nnodes = max(index for index, _ in self.layout) + 1
+        # ranks of the nodes, in node rank order
+        self.members: list[list[int]] = [[] for _ in range(self.nnodes)]
+        for rank, (index, _) in enumerate(self.layout):
+            self.members[index].append(rank)
+        # nothing to gain on a single node or with one rank per node
+        self.flat = self.nnodes in (1, self.size)
+
+    # -------------------------------------------------------------------------
+    # allreduce
+
+    def Allreduce(self, sendbuf, recvbuf: np.ndarray, op: MPI.Op = MPI.SUM):
+        """Reduce `sendbuf` (or `MPI.IN_PLACE`) of all ranks into `recvbuf`"""
+        if self.flat:
+            self.comm.Allreduce(sendbuf, recvbuf, op)
+            return
+        if sendbuf is MPI.IN_PLACE and not self.is_leader:
+            sendbuf = recvbuf
+        self.node.Reduce(sendbuf, recvbuf if self.is_leader else None, op, root=0)
+        if self.is_leader:
+            self.leaders.Allreduce(MPI.IN_PLACE, recvbuf, op)
+        self.node.Bcast(recvbuf, root=0)
+
+    def allreduce(self, value, op: MPI.Op = MPI.SUM):
+        """Reduction of `value` of all ranks"""
+        if self.flat:
+            return self.comm.allreduce(value, op)
+        value = self.node.reduce(value, op, root=0)
+        if self.is_leader:
+            value = self.leaders.allreduce(value, op)
+        return self.node.bcast(value, root=0)
+
+    # -------------------------------------------------------------------------
+    # bcast
+
+    def Bcast(self, buf: np.ndarray, root: int = 0):
+        """Broadcast `buf` of `root`, in place"""
+        if self.flat:
+            self.comm.Bcast(buf, root)
+            return
+        root_node, root_rank = self.layout[root]
+        if self.node_index == root_node:
+            self.node.Bcast(buf, root_rank)
+        if self.is_leader:
+            self.leaders.Bcast(buf, root_node)
+        if self.node_index != root_node:
+            self.node.Bcast(buf, 0)
+
+    def bcast(self, obj, root: int = 0):
+        """`obj` of `root` on all ranks"""
+        if self.flat:
+            return self.comm.bcast(obj, root)
+        root_node, root_rank = self.layout[root]
+        if self.node_index == root_node:
+            obj = self.node.bcast(obj, root_rank)
+        if self.is_leader:
+            obj = self.leaders.bcast(obj, root_node)
+        if self.node_index != root_node:
+            obj = self.node.bcast(obj, 0)
+        return obj
+
+    # -------------------------------------------------------------------------
+    # gather
+
+    def Gather(self, sendbuf: np.ndarray, recvbuf: np.ndarray | None, root: int = 0):
+        """`sendbuf` of all ranks, one after the other by rank, in `recvbuf` of `root`"""
+        if self.flat:
+            self.comm.Gather(sendbuf, recvbuf, root)
+            return
+        root_node, root_rank = self.layout[root]
+        count = sendbuf.size
+        nodebuf = None
+        if self.is_leader:
+            nodebuf = np.empty(self.node.Get_size() * count, sendbuf.dtype)
+        self.node.Gather(sendbuf, nodebuf, root=0)
+
+        if self.is_leader:
+            # by node, and by rank within the nodes
+            gathered = None
+            if self.node_index == root_node:
+                gathered = np.empty(self.size * count, sendbuf.dtype)
+            counts = [len(ranks) * count for ranks in self.members]
+            self.leaders.Gatherv(nodebuf, (gathered, counts), root=root_node)
+            if gathered is not None:
+                order = [rank for ranks in self.members for rank in ranks]
+                result = np.empty_like(gathered).reshape(self.size, count)
+                result[order] = gathered.reshape(self.size, count)
+                if root == self.rank:
+                    recvbuf.reshape(-1)[...] = result.reshape(-1)
+                else:
+                    self.node.Send(result, root_rank)
+        elif root == self.rank:
+            self.node.Recv(recvbuf, 0)
+
+    def gather(self, obj, root: int = 0) -> list | None:
+        """List of `obj` of all ranks on `root`, None elsewhere"""
+        if self.flat:
+            return self.comm.gather(obj, root)
+        root_node, root_rank = self.layout[root]
+        objs = self.node.gather(obj, root=0)
+        result = None
+        if self.is_leader:
+            nodes = self.leaders.gather(objs, root=root_node)
+            if nodes is not None:
+                result = [None] * self.size
+                for ranks, objs in zip(self.members, nodes):
+                    for rank, item in zip(ranks, objs):
+                        result[rank] = item
+                if root != self.rank:
+                    self.node.send(result, root_rank)
+                    result = None
+        elif root == self.rank:
+            result = self.node.recv(source=0)
+        return result
+
+    def free(self):
+        if self.leaders != MPI.COMM_NULL:
+            self.leaders.Free()
+        self.node.Free()
@@ -0,0 +1,47 @@
+"""mpi4py + numpy port of the ``w02/labs/Jacobi`` solver.
+
+Run it as the C code, ``mpirun -np 8 python -m lsm.jacobi nx ny [max_iter]``.
+"""
+
+from .balance import BalancedResult, solve_balanced
+from .checkpoint import read_checkpoint, read_header, write_checkpoint
+from .columns import COLUMNS, Columns, make_columns
+from .decomp import Decomposition, decompose, split
+from .halo import HALO_EXCHANGES, HaloExchange
+from .multigrid import Multigrid, alignment, solve_multigrid
+from .placement import PLACEMENTS, decompose_placed, halo_bytes, locate
+from .snapshot import Snapshots, gather_snapshot, write_snapshot
+from .solver import Result, initialise, optimal_omega, solve, solve_redblack
+from .writer import AsyncWriter
+
+__all__ = [
+    "AsyncWriter",
+    "BalancedResult",
+    "COLUMNS",
+    "Columns",
+    "Decomposition",
+    "HALO_EXCHANGES",
+    "HaloExchange",
+    "Multigrid",
+    "PLACEMENTS",
+    "Result",
+    "Snapshots",
+    "alignment",
+    "decompose",
+    "decompose_placed",
+    "gather_snapshot",
+    "halo_bytes",
+    "initialise",
+    "locate",
+    "make_columns",
+    "optimal_omega",
+    "read_checkpoint",
+    "read_header",
+    "solve",
+    "solve_balanced",
+    "solve_multigrid",
+    "solve_redblack",
+    "split",
+    "write_checkpoint",
+    "write_snapshot",
+]
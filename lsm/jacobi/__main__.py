@@ -0,0 +1,287 @@
+"""Command line of the Jacobi solver, same arguments as ``jacobi-mpi-block``::
+
+    mpirun -np 8 python -m lsm.jacobi nx ny [max_iter] [options]
+
+As for the C code, set ``JACOBI_BENCH=1`` to report the bytes moved per
+iteration on stderr (and where the halo bytes go). ``mpirun -np 4 python -m
+lsm.jacobi --calibrate-columns`` measures the column strategies of ``--columns
+auto``, ``--compare-placement`` the halo bytes within and between the nodes
+of the rank placements.
+"""
+
+import argparse
+import os
+import sys
+
+from mpi4py import MPI
+
+from .balance import BALANCE_PERIOD, IMBALANCE_THRESHOLD, solve_balanced
+from .columns import STRATEGIES
+from .columns import calibrate as calibrate_columns
+from .decomp import LAYOUTS
+from .halo import HALO_EXCHANGES
+from .multigrid import SMOOTHERS, alignment, solve_multigrid
+from .placement import PLACEMENTS, compare, decompose_placed, halo_bytes
+from .snapshot import MODES as SNAPSHOT_MODES
+from .snapshot import WRITERS as SNAPSHOT_WRITERS
+from .snapshot import Snapshots
+from .solver import (CONVERGENCE_ACCURACY, MAX_ITERATIONS, REPORT_NORM_PERIOD, optimal_omega,
+                     solve, solve_redblack)
+from .writer import MODES as WRITER_MODES
+from .writer import AsyncWriter
+
+METHODS = ("jacobi", "gauss-seidel", "sor", "multigrid")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m lsm.jacobi",
+        description="Jacobi solver with 1D/2D domain decomposition")
+    parser.add_argument("nx", type=int, nargs="?", help="global size in X")
+    parser.add_argument("ny", type=int, nargs="?", help="global size in Y")
+    parser.add_argument("max_iter", type=int, nargs="?",
+                        help="number of iterations (also disables the norm reports)")
+    parser.add_argument("--method", choices=METHODS, default="jacobi",
+                        help="Jacobi, red-black Gauss-Seidel/SOR, or multigrid V-cycles")
+    parser.add_argument("--omega", type=float,
+                        help="SOR relaxation factor (default: optimal for the grid size)")
+    parser.add_argument("--smoother", choices=SMOOTHERS, default=SMOOTHERS[0],
+                        help="smoother of the multigrid levels")
+    parser.add_argument("--decomp", choices=LAYOUTS, default="1d",
+                        help="1d row slabs (as the C code) or 2d blocks")
+    parser.add_argument("--placement", choices=PLACEMENTS,
+                        help="order of the blocks on the ranks: by rank (default), "
+                             "reordered by Create_cart or a weighted dist graph, or "
+                             "sorted by node and socket")
+    parser.add_argument("--reorder", action="store_true",
+                        help="let MPI reorder the ranks of the Cartesian communicator "
+                             "to match the node layout (--placement cart)")
+    parser.add_argument("--compare-placement", action="store_true",
+                        help="report the intra-/inter-node halo bytes of all "
+                             "placements instead of solving")
+    parser.add_argument("--halo", choices=sorted(HALO_EXCHANGES),
+                        help="halo exchange implementation "
+                             "(default: blocking, nonblocking with --overlap)")
+    parser.add_argument("--columns", choices=STRATEGIES + ("auto",), default="auto",
+                        help="how the ghost columns of 2d layouts are sent: packed, "
+                             "vector or subarray datatypes, or the fastest one measured "
+                             "by --calibrate-columns")
+    parser.add_argument("--calibrate-columns", action="store_true",
+                        help="time the column strategies instead of solving, "
+                             "and store the fastest for --columns auto")
+    parser.add_argument("--overlap", action="store_true",
+                        help="overlap the halo exchange with the interior update")
+    parser.add_argument("--copy", action="store_true",
+                        help="copy the new grid back instead of swapping the buffers")
+    parser.add_argument("--fused", action="store_true",
+                        help="compute the residual in the same sweep as the update")
+    parser.add_argument("--check-every", type=int, metavar="N",
+                        help="check the convergence every N iterations with a "
+                             "non-blocking allreduce (implies --fused)")
+    parser.add_argument("--hierarchical", action="store_true",
+                        help="sum the residual on each node first, then across the nodes")
+    parser.add_argument("--balance", type=int, nargs="?", const=BALANCE_PERIOD, metavar="K",
+                        help="time the sweeps and move rows between the 1d slabs every K "
+                             f"(default {BALANCE_PERIOD}) iterations when they are imbalanced")
+    parser.add_argument("--imbalance", type=float, default=IMBALANCE_THRESHOLD,
+                        help="excess of the slowest sweep over the mean that triggers "
+                             "moving rows with --balance")
+    parser.add_argument("--checkpoint", metavar="FILE",
+                        help="write the grid to FILE (MPI-IO, global layout) every "
+                             "--checkpoint-every iterations and at max_iter")
+    parser.add_argument("--checkpoint-every", type=int, default=1000, metavar="N",
+                        help="iterations between checkpoints (default: 1000)")
+    parser.add_argument("--restart", action="store_true",
+                        help="continue from the --checkpoint FILE if it exists, "
+                             "on any number of ranks")
+    parser.add_argument("--snapshot", metavar="FILE",
+                        help="write downsampled .npy images of the grid to FILE_<iteration>.npy "
+                             "(or a pattern with {iteration})")
+    parser.add_argument("--snapshot-every", type=int, default=1000, metavar="N",
+                        help="iterations between snapshots (default: 1000)")
+    parser.add_argument("--snapshot-factor", type=int, default=8, metavar="F",
+                        help="downsampling factor of the snapshots (default: 8)")
+    parser.add_argument("--snapshot-mode", choices=SNAPSHOT_MODES, default="mean",
+                        help="every F-th point, or means of F x F blocks")
+    parser.add_argument("--snapshot-writer", choices=SNAPSHOT_WRITERS, default="gatherv",
+                        help="assemble the image on rank 0, or write it with MPI-IO "
+                             "(mean blocks then align the decomposition to F)")
+    parser.add_argument("--async-io", choices=WRITER_MODES,
+                        help="write the checkpoints and mpiio snapshots in the background: "
+                             "from a writer thread, with Iwrite_at_all, or synchronously "
+                             "to compare; reports the hidden and exposed write time")
+    parser.add_argument("--io-depth", type=int, default=2, metavar="N",
+                        help="staging buffers of --async-io, i.e. writes in flight "
+                             "(default: 2)")
+    parser.add_argument("-t", "--tile", type=parse_tile, metavar="[ROWSx]COLS",
+                        help="update the grid in tiles of ROWS x COLS points (0: no tiling)")
+    args = parser.parse_args(argv)
+    if args.calibrate_columns:
+        return args
+    if args.ny is None:
+        parser.error("the global sizes nx and ny are required")
+    if args.placement is None:
+        args.placement = "cart" if args.reorder else "rank"
+    elif args.reorder and args.placement != "cart":
+        parser.error("--reorder is --placement cart")
+    if args.check_every is not None and args.check_every < 1:
+        parser.error("--check-every must be at least 1")
+    if args.method != "jacobi":
+        for flag in ("overlap", "copy", "fused", "check_every"):
+            if getattr(args, flag):
+                parser.error(f"--{flag.replace('_', '-')} only applies to --method jacobi")
+    if args.omega is not None:
+        if args.method != "sor":
+            parser.error("--omega only applies to --method sor")
+        if not 0 < args.omega < 2:
+            parser.error("--omega must be between 0 and 2 (exclusive)")
+    if args.method == "multigrid" and args.tile:
+        parser.error("--tile doesn't apply to --method multigrid")
+    if args.restart and not args.checkpoint:
+        parser.error("--restart requires --checkpoint FILE")
+    for flag in ("checkpoint", "snapshot"):
+        if getattr(args, flag) and (args.method != "jacobi" or args.balance is not None):
+            parser.error(f"--{flag} only applies to --method jacobi without --balance")
+    for flag in ("snapshot_every", "snapshot_factor"):
+        if getattr(args, flag) < 1:
+            parser.error(f"--{flag.replace('_', '-')} must be at least 1")
+    if args.async_io and not (args.checkpoint or args.snapshot):
+        parser.error("--async-io requires --checkpoint or --snapshot")
+    if args.io_depth < 1:
+        parser.error("--io-depth must be at least 1")
+    if args.balance is not None:
+        if args.balance < 1:
+            parser.error("--balance K must be at least 1")
+        if args.method != "jacobi" or args.decomp != "1d":
+            parser.error("--balance only applies to --method jacobi --decomp 1d")
+        for flag in ("overlap", "copy", "fused", "check_every", "tile"):
+            if getattr(args, flag):
+                parser.error(f"--{flag.replace('_', '-')} doesn't apply to --balance")
+    return args
+
+
+def parse_tile(text):
+    """``[ROWSx]COLS`` as the ``-t`` option of the C code"""
+    sizes = [int(n) for n in text.split("x")]
+    if len(sizes) == 1:
+        sizes.insert(0, 0)
+    if len(sizes) != 2 or min(sizes) < 0:
+        raise argparse.ArgumentTypeError(f"invalid tile size {text!r}")
+    return tuple(sizes)
+
+
+def report_traffic(result):
+    """Same line as ``report_traffic`` in ``jacobi-mpi-block.c`` (on stderr)"""
+    t = result.traffic
+    bandwidth = t["total"] * result.iterations / result.time if result.iterations else 0.0
+    print(f"#bytes/iter sweep={t['sweep']:.3e} copy={t['copy']:.3e} halo={t['halo']:.3e} "
+          f"total={t['total']:.3e} bandwidth={bandwidth:.3e} B/s", file=sys.stderr)
+
+
+def report_placement(placement, sent):
+    """Halo bytes per iteration within a socket, a node and between nodes (on stderr)"""
+    print(f"#halo bytes/iter placement={placement} intra-socket={sent['socket']:.3e} "
+          f"intra-node={sent['node']:.3e} inter-node={sent['network']:.3e}", file=sys.stderr)
+
+
+def report_balance(result):
+    """Rows, compute and wait time of every rank"""
+    print(f"\n#{'rank':>5s}{'rows':>8s}{'compute[s]':>12s}{'wait[s]':>12s}")
+    for rank, (rows, compute, wait) in enumerate(zip(result.rows, result.compute,
+                                                     result.wait)):
+        print(f"{rank:6d}{rows:8d}{compute:12.3e}{wait:12.3e}")
+    print(f"# rebalanced {len(result.rebalanced)} times, slowest compute "
+          f"{max(result.compute):.3e} s, most wait {max(result.wait):.3e} s")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    if args.calibrate_columns:
+        calibrate_columns(comm)
+        return
+
+    align = 1
+    if args.method == "multigrid":
+        # so the local blocks can be coarsened
+        align = alignment(comm.Get_size(), args.nx, args.ny, args.decomp)
+    snapshots = None
+    if args.snapshot:
+        snapshots = Snapshots(args.snapshot, args.snapshot_every, args.snapshot_factor,
+                              args.snapshot_mode, args.snapshot_writer)
+        if args.snapshot_writer == "mpiio" and args.snapshot_mode == "mean":
+            # so that no block of the image straddles two ranks
+            align = args.snapshot_factor
+    if args.compare_placement:
+        compare(comm, args.nx, args.ny, args.decomp, align)
+        return
+
+    max_iter = MAX_ITERATIONS
+    report_period = REPORT_NORM_PERIOD
+    if args.max_iter is not None:
+        max_iter = args.max_iter
+        report_period = max_iter + 1
+
+    if rank == 0:
+        print(f"Solving to accuracy of {CONVERGENCE_ACCURACY:.0e}, global system size is "
+              f"x={args.nx} y={args.ny} (at most {max_iter} iterations)")
+
+    halo = args.halo or ("nonblocking" if args.overlap else "blocking")
+
+    dec = decompose_placed(comm, args.nx, args.ny, args.decomp, args.placement, align=align)
+    bench = os.environ.get("JACOBI_BENCH")
+    sent = halo_bytes(dec) if bench else None
+    writer = None
+    if args.async_io:
+        # staging buffers for the largest block: the local grid of the
+        # checkpoints, the local coarse block of the snapshots
+        capacity = dec.lnx * dec.lny if args.checkpoint else 0
+        if snapshots is not None and snapshots.writer == "mpiio":
+            capacity = max(capacity, snapshots.block_size(dec))
+        writer = AsyncWriter(dec.comm, args.io_depth, capacity, args.async_io)
+    if args.balance is not None:
+        result = solve_balanced(dec, max_iter, report_period, halo=halo,
+                                columns=args.columns, period=args.balance,
+                                threshold=args.imbalance, hierarchical=args.hierarchical)
+    elif args.method == "jacobi":
+        result = solve(dec, max_iter, report_period, halo=halo, columns=args.columns,
+                       overlap=args.overlap, copy=args.copy, fused=args.fused,
+                       check_every=args.check_every, tile=args.tile,
+                       hierarchical=args.hierarchical, checkpoint=args.checkpoint,
+                       checkpoint_every=args.checkpoint_every, restart=args.restart,
+                       snapshots=snapshots, writer=writer)
+    elif args.method == "multigrid":
+        result = solve_multigrid(dec, max_iter, report_period, halo=halo,
+                                 columns=args.columns, smoother=args.smoother,
+                                 hierarchical=args.hierarchical)
+    else:
+        omega = 1.0
+        if args.method == "sor":
+            omega = args.omega
+            if omega is None:
+                omega = optimal_omega(args.nx, args.ny)
+        result = solve_redblack(dec, max_iter, report_period, halo=halo,
+                                columns=args.columns, omega=omega, tile=args.tile,
+                                hierarchical=args.hierarchical)
+
+    io = None
+    if writer is not None:
+        io = writer.report()
+        writer.close()
+    if rank == 0:
+        print(f"\nTerminated on {result.iterations} iterations, "
+              f"Relative Norm={result.norm:e}, Total time={result.time:e} seconds")
+        if bench and result.traffic:
+            report_traffic(result)
+        if bench:
+            report_placement(args.placement, sent)
+        if args.balance is not None:
+            report_balance(result)
+        if io is not None:
+            print(io)
+    dec.comm.Free()
+
+
+if __name__ == "__main__":
+    main()
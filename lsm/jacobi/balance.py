@@ -0,0 +1,235 @@
+"""Runtime load balancing of the 1D slab decomposition.
+
+`split` gives every rank the same number of rows, as the C code, which
+assumes that all cores are equally fast; on a mix of machine models
+(``XeonGold6226R`` and ``XeonE5_2650v4`` nodes) the fast ranks then wait
+for the slow ones at every exchange. `solve_balanced` runs the Jacobi
+iteration of `solve`, timing the sweeps (compute) and the exchange and
+reduction (wait) of every rank with `MPI.Wtime`. Every `period`
+iterations, if the slowest sweep is more than `threshold` above the mean
+(`imbalance`) in this period, in the previous one and over both, the rows
+are redistributed in proportion to the rows per second measured over both
+(`target_rows`), and the slabs are moved between neighbours with
+``Sendrecv`` (`migrate`). The rows are only moved if the imbalance
+predicted for them (`predicted_imbalance`) is at least `REBALANCE_GAIN`
+below the measured one, so that the timing noise of a single period (a
+rank descheduled for a while) doesn't shuffle the rows of a homogeneous
+run.
+
+A boundary moves by at most half of the slab it eats into (`limit_moves`),
+so rows only ever go to a neighbour; a large imbalance is corrected over
+a few periods.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field, replace
+from math import sqrt
+
+import numpy as np
+from mpi4py import MPI
+
+from ..hierarchical import HierarchicalComm
+from .decomp import Decomposition
+from .halo import HALO_EXCHANGES
+from .kernels import interior, jacobi_sweep, residual_sq
+from .solver import (CONVERGENCE_ACCURACY, MAX_ITERATIONS, REPORT_NORM_PERIOD, Result,
+                     initialise, traffic)
+
+# Iterations between the balance checks
+BALANCE_PERIOD = 100
+# Relative excess of the slowest sweep over the mean which triggers a rebalancing
+IMBALANCE_THRESHOLD = 0.1
+# Reduction of the imbalance a redistribution must be predicted to bring
+REBALANCE_GAIN = 0.05
+
+
+@dataclass
+class BalancedResult(Result):
+    # rows, compute and wait time of all ranks, by rank
+    rows: list[int] = field(default_factory=list)
+    compute: list[float] = field(default_factory=list)
+    wait: list[float] = field(default_factory=list)
+    # iterations at which the rows were redistributed
+    rebalanced: list[int] = field(default_factory=list)
+
+
+def imbalance(times) -> float:
+    """Excess of the slowest time over the mean, relative to the mean"""
+    times = np.asarray(times, dtype=float)
+    mean = times.mean()
+    return float(times.max() / mean - 1.0) if mean > 0 else 0.0
+
+
+def target_rows(rows, times) -> np.ndarray:
+    """Rows in proportion to the measured rows per second, at least one
+    each and as many as `rows` in total"""
+    rows = np.asarray(rows)
+    total = int(rows.sum())
+    rates = rows / np.maximum(np.asarray(times, dtype=float), 1e-12)
+    share = rates / rates.sum() * total
+    target = np.maximum(np.floor(share).astype(int), 1)
+    # largest remainders
+    while target.sum() < total:
+        target[np.argmax(share - target)] += 1
+    while target.sum() > total:
+        excess = np.where(target > 1, target - share, -np.inf)
+        target[np.argmax(excess)] -= 1
+    return target
+
+
+def predicted_imbalance(rows, times, new_rows) -> float:
+    """`imbalance` of `new_rows` at the time per row measured for `rows`"""
+    per_row = np.asarray(times, dtype=float) / np.asarray(rows)
+    return imbalance(np.asarray(new_rows) * per_row)
+
+
+def limit_moves(rows, target) -> np.ndarray:
+    """`target` with each boundary moving by at most half of the slab it
+    moves into, so that every slab keeps a row and rows only go to a
+    neighbour"""
+    rows = np.asarray(rows)
+    bounds = np.cumsum(rows)[:-1]
+    moves = np.cumsum(target)[:-1] - bounds
+    # boundary i is between slab i (north) and slab i + 1 (south)
+    moves = np.clip(moves, -((rows[:-1] - 1) // 2), (rows[1:] - 1) // 2)
+    return np.diff(np.concatenate(([0], bounds + moves, [rows.sum()])))
+
+
+def uneven(dec: Decomposition, rows) -> Decomposition:
+    """`dec` (1D) with `rows` rows per rank"""
+    start = int(np.sum(rows[:dec.coords[0]]))
+    return replace(dec, x0=start, lnx=int(rows[dec.coords[0]]))
+
+
+def migrate(u: np.ndarray, dec: Decomposition, v: np.ndarray, new: Decomposition):
+    """Move the interior rows of `u` on `dec` into `v` on `new`.
+
+    The rows this rank keeps are copied, the others are exchanged with the
+    north and south neighbours in one ``Sendrecv`` per direction. Whole
+    rows are sent, with the boundary columns.
+    """
+    comm = dec.comm
+    old_lo, old_hi = dec.x0, dec.x0 + dec.lnx
+    new_lo, new_hi = new.x0, new.x0 + new.lnx
+    lo, hi = max(old_lo, new_lo), min(old_hi, new_hi)
+    v[1 + lo - new_lo:1 + hi - new_lo] = u[1 + lo - old_lo:1 + hi - old_lo]
+
+    def rows(a, first, last):
+        """Interior rows `first` (local) up to `last` of `a`, none if ``last <= first``"""
+        return a[1 + first:1 + max(first, last)]
+
+    # north: the first rows go to the north neighbour, the south one's come in
+    comm.Sendrecv(rows(u, 0, new_lo - old_lo), dec.north,
+                  recvbuf=rows(v, old_hi - new_lo, new_hi - new_lo), source=dec.south)
+    # south: the last rows go to the south neighbour, the north one's come in
+    comm.Sendrecv(rows(u, new_hi - old_lo, old_hi - old_lo), dec.south,
+                  recvbuf=rows(v, 0, old_lo - new_lo), source=dec.north)
+
+
+def solve_balanced(dec: Decomposition, max_iter: int = MAX_ITERATIONS,
+                   report_period: int = REPORT_NORM_PERIOD, halo: str = "blocking",
+                   columns: str = "auto", period: int = BALANCE_PERIOD,
+                   threshold: float = IMBALANCE_THRESHOLD, hierarchical: bool = False,
+                   verbose: bool = True) -> BalancedResult:
+    """The Jacobi iteration of `solve`, rebalancing the rows of the 1D `dec`.
+
+    The compute time is the residual and the sweep, the wait time the halo
+    exchange and the reduction of the residual, in which the fast ranks
+    wait for the slow ones. Every `period` iterations, the compute times
+    of the period are compared; the rows are moved if their `imbalance`
+    is above `threshold` in two periods in a row and over both, and the
+    new rows are predicted to lower it by `REBALANCE_GAIN`. There is no
+    check at the last iteration.
+    """
+    if period < 1:
+        raise ValueError("the balance period must be at least 1")
+    if dec.dims[1] != 1:
+        raise ValueError("load balancing requires the 1D decomposition")
+    comm = dec.comm
+    size = comm.Get_size()
+    report = verbose and comm.Get_rank() == 0
+    reducer = HierarchicalComm(comm) if hierarchical else comm
+
+    def allreduce(value: float) -> float:
+        return reducer.allreduce(value, op=MPI.SUM)
+
+    exchange = HALO_EXCHANGES[halo](dec, columns)
+    u = exchange.allocate(initialise(dec))
+    unew = exchange.allocate(u.copy())
+    work = np.empty((dec.lnx, dec.lny))
+    box = interior(u.shape)
+
+    bnorm = sqrt(allreduce(residual_sq(u, work)))
+
+    compute = wait = period_compute = 0.0
+    # compute times of the previous period, if it was imbalanced
+    previous = None
+    rebalanced = []
+    norm = 1.0
+    start_time = MPI.Wtime()
+    for k in range(max_iter):
+        t0 = MPI.Wtime()
+        exchange.exchange(u)
+        t1 = MPI.Wtime()
+        rsq = residual_sq(u, work, box)
+        t2 = MPI.Wtime()
+        norm = sqrt(allreduce(rsq)) / bnorm
+        t3 = MPI.Wtime()
+        if norm < CONVERGENCE_ACCURACY:
+            compute += t2 - t1
+            wait += (t1 - t0) + (t3 - t2)
+            break
+        if k % report_period == 0 and report:
+            print(f"Iteration= {k} Relative Norm={norm:e}")
+
+        jacobi_sweep(u, unew, box)
+        u, unew = unew, u
+        t4 = MPI.Wtime()
+        compute += (t2 - t1) + (t4 - t3)
+        wait += (t1 - t0) + (t3 - t2)
+        period_compute += (t2 - t1) + (t4 - t3)
+
+        if (k + 1) % period == 0 and k + 1 < max_iter and size > 1:
+            times = np.array(comm.allgather(period_compute))
+            period_compute = 0.0
+            if imbalance(times) <= threshold:
+                previous = None
+                continue
+            if previous is None:
+                # a single slow period may be noise
+                previous = times
+                continue
+            times, previous = times + previous, times
+            if imbalance(times) <= threshold:
+                continue
+            rows = np.array(comm.allgather(dec.lnx))
+            new_rows = limit_moves(rows, target_rows(rows, times))
+            if predicted_imbalance(rows, times, new_rows) > imbalance(times) - REBALANCE_GAIN:
+                continue
+            # the ghost cells are refreshed by the next exchange
+            new = uneven(dec, new_rows)
+            new_exchange = HALO_EXCHANGES[halo](new, columns)
+            v = new_exchange.allocate(initialise(new))
+            migrate(u, dec, v, new)
+            exchange.free()
+            dec, exchange, u = new, new_exchange, v
+            unew = exchange.allocate(u.copy())
+            work = np.empty((dec.lnx, dec.lny))
+            box = interior(u.shape)
+            rebalanced.append(k + 1)
+            # the times of the old rows don't predict the new ones
+            previous = None
+            if report:
+                print(f"# rebalanced at iteration {k + 1}: imbalance={imbalance(times):.2f} "
+                      f"rows={' '.join(str(n) for n in new_rows)}")
+    else:
+        k = max_iter
+
+    elapsed = MPI.Wtime() - start_time
+    exchange.free()
+    if hierarchical:
+        reducer.free()
+    return BalancedResult(k, norm, elapsed, traffic(dec),
+                          rows=comm.allgather(dec.lnx), compute=comm.allgather(compute),
+                          wait=comm.allgather(wait), rebalanced=rebalanced)
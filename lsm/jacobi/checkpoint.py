@@ -0,0 +1,174 @@
+"""Checkpoint/restart of the distributed grid with collective MPI-IO.
+
+A checkpoint is one file: a `HEADER` (`HEADER_SIZE` bytes) holding the
+global size, the iteration and the norms, followed by the ``nx * ny``
+interior points of the global grid in row-major order (native doubles).
+The layout doesn't depend on the decomposition, so a run can be
+restarted on any number of ranks, or the grid read with NumPy::
+
+    grid = np.memmap(path, np.float64, "r", HEADER_SIZE, (nx, ny))
+
+Every rank writes its own block (`write_array`): ``File.Open`` of the
+file, ``Set_view`` with a subarray filetype of the block in the global
+array, and one collective ``Write_at_all`` straight from the interior of
+the local grid (a datatype of `lsm.datatypes`, no copy). Nothing goes
+through rank 0, which only writes the header. The file is written under
+a temporary name and renamed when complete, so a job killed while
+writing keeps its previous checkpoint.
+"""
+
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from mpi4py import MPI
+
+from ..datatypes import buffer_spec
+from .decomp import Decomposition
+
+MAGIC = b"LSMJACOB"
+HEADER = np.dtype([("magic", "S8"), ("nx", "<i8"), ("ny", "<i8"),
+                   ("iteration", "<i8"), ("norm", "<f8"), ("bnorm", "<f8")])
+# The grid starts at this offset (bytes)
+HEADER_SIZE = 64
+
+
+@dataclass
+class Checkpoint:
+    """The header of a checkpoint file"""
+    nx: int
+    ny: int
+    iteration: int
+    norm: float
+    bnorm: float
+
+
+def _filetype(shape, start, block: np.ndarray) -> MPI.Datatype:
+    """Subarray of `block` at `start` of the global array of `shape`"""
+    if block.size == 0:
+        # ranks without data take part with an empty buffer, but MPI
+        # doesn't allow empty subarrays
+        return MPI.DOUBLE.Create_subarray(list(shape), [1] * len(shape),
+                                          [0] * len(shape)).Commit()
+    return MPI.DOUBLE.Create_subarray(list(shape), list(block.shape), list(start)).Commit()
+
+
+@dataclass
+class BlockWrite:
+    """The part of one rank of a global row-major array of doubles:
+    `block` at `start` of the array of `shape`, which begins at byte
+    `offset` of the file, after `header` (written by rank 0)."""
+    shape: tuple[int, ...]
+    start: tuple[int, ...]
+    block: np.ndarray
+    header: bytes = b""
+    offset: int = 0
+
+
+def open_view(comm: MPI.Intracomm, path, write: BlockWrite) -> tuple[MPI.File, MPI.Datatype]:
+    """Open `path` for `write`: sized, with the header, and the view of the
+    block set (collective). Close the file and free the filetype."""
+    filetype = _filetype(write.shape, write.start, write.block)
+    fh = MPI.File.Open(comm, str(path), MPI.MODE_WRONLY | MPI.MODE_CREATE)
+    fh.Set_size(write.offset + int(np.prod(write.shape)) * MPI.DOUBLE.Get_size())
+    if comm.Get_rank() == 0 and write.header:
+        fh.Write_at(0, np.frombuffer(write.header, np.uint8))
+    fh.Set_view(write.offset, MPI.DOUBLE, filetype)
+    return fh, filetype
+
+
+def temporary(path) -> Path:
+    """The name a file is written under before `replace`"""
+    path = Path(path)
+    return path.with_name(path.name + ".tmp")
+
+
+def replace(comm: MPI.Intracomm, path):
+    """Rename the complete `temporary` file to `path` (collective)"""
+    if comm.Get_rank() == 0:
+        os.replace(temporary(path), path)
+    # nobody opens the next temporary file before it is renamed
+    comm.Barrier()
+
+
+def write_array(path, comm: MPI.Intracomm, shape, start, block: np.ndarray,
+                header: bytes = b"", offset: int = 0):
+    """Collectively write the global row-major array of `shape` doubles.
+
+    Every rank writes `block` (any view) at `start` of the global array,
+    the array begins at byte `offset` of the file; rank 0 writes `header`
+    in front of it. The file is replaced when complete.
+    """
+    fh, filetype = open_view(comm, temporary(path),
+                             BlockWrite(shape, start, block, header, offset))
+    try:
+        fh.Write_at_all(0, buffer_spec(block))
+    finally:
+        fh.Close()
+        filetype.Free()
+    replace(comm, path)
+
+
+def read_array(path, comm: MPI.Intracomm, shape, start, block: np.ndarray, offset: int = 0):
+    """Collectively read `block` at `start` of the global array of `write_array`"""
+    filetype = _filetype(shape, start, block)
+    fh = MPI.File.Open(comm, str(path), MPI.MODE_RDONLY)
+    try:
+        fh.Set_view(offset, MPI.DOUBLE, filetype)
+        fh.Read_at_all(0, buffer_spec(block))
+    finally:
+        fh.Close()
+        filetype.Free()
+
+
+def read_header(path) -> Checkpoint:
+    """The header of the checkpoint file `path`"""
+    header = np.fromfile(path, HEADER, count=1)
+    if len(header) != 1 or header["magic"][0] != MAGIC:
+        raise ValueError(f"{path} is not a Jacobi checkpoint")
+    h = header[0]
+    return Checkpoint(int(h["nx"]), int(h["ny"]), int(h["iteration"]),
+                      float(h["norm"]), float(h["bnorm"]))
+
+
+def checkpoint_block(dec: Decomposition, u: np.ndarray, iteration: int, norm: float,
+                     bnorm: float) -> BlockWrite:
+    """The part of this rank of the checkpoint of the local grid `u`"""
+    header = np.zeros(1, HEADER)
+    header[0] = (MAGIC, dec.nx, dec.ny, iteration, norm, bnorm)
+    return BlockWrite((dec.nx, dec.ny), (dec.x0, dec.y0), u[1:-1, 1:-1],
+                      header.tobytes(), HEADER_SIZE)
+
+
+def write_checkpoint(path, dec: Decomposition, u: np.ndarray, iteration: int,
+                     norm: float, bnorm: float):
+    """Write the interior of the local grids `u` of `dec` (collective)"""
+    w = checkpoint_block(dec, u, iteration, norm, bnorm)
+    write_array(path, dec.comm, w.shape, w.start, w.block, w.header, w.offset)
+
+
+def read_checkpoint(path, dec: Decomposition, u: np.ndarray) -> Checkpoint:
+    """Read the interior of the local grid `u` of `dec` (collective).
+
+    `dec` may have another number of ranks than the run that wrote it, but
+    the same global size.
+    """
+    # rank 0 reads the header, so that all ranks agree on it
+    checkpoint = None
+    if dec.comm.Get_rank() == 0:
+        try:
+            checkpoint = read_header(path)
+        except (OSError, ValueError) as e:
+            checkpoint = e
+    checkpoint = dec.comm.bcast(checkpoint, root=0)
+    if isinstance(checkpoint, Exception):
+        raise checkpoint
+    if (checkpoint.nx, checkpoint.ny) != (dec.nx, dec.ny):
+        raise ValueError(f"{path} holds a {checkpoint.nx}x{checkpoint.ny} grid, "
+                         f"not {dec.nx}x{dec.ny}")
+    read_array(path, dec.comm, (dec.nx, dec.ny), (dec.x0, dec.y0), u[1:-1, 1:-1],
+               HEADER_SIZE)
+    return checkpoint
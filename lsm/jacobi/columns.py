@@ -0,0 +1,275 @@
+"""Strategies for the strided ghost-column messages of 2D decompositions.
+
+Rows of the local grid are contiguous, but the items of a column are
+``lny + 2`` doubles apart. A `Columns` strategy provides the buffers of
+the column messages of the halo exchanges:
+
+``pack``
+    numpy copies into preallocated contiguous buffers (`Columns.pack`
+    before sending, `Columns.unpack` after receiving), as
+    ``sendrecv_copy_xz`` of ``w08/bandwidth_custom_types.py``.
+``vector``
+    ``Create_vector(lnx, 1, lny + 2)`` types (from `lsm.datatypes`), MPI
+    reads and writes the columns of the grid itself.
+``subarray``
+    one ``Create_subarray`` type per column of the local array, which is
+    sent and received as a whole.
+
+Which one is fastest depends on the column length and the interconnect:
+packing costs a copy, a datatype may be packed by MPI anyway or sent as
+many small pieces. ``auto`` uses the strategy measured to be the fastest
+for the size of the column. Run a calibration to measure them on a
+machine, it is stored in `TUNING_FILE`::
+
+    mpirun -np 4 python -m lsm.jacobi --calibrate-columns
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+from mpi4py import MPI
+
+from ..datatypes import TypeCache, buffer_spec
+from .decomp import Decomposition, decompose
+
+# Column of the local array next to the neighbour of a side, that is sent,
+# and the ghost column receiving from it
+EDGE = {"west": 1, "east": -2}
+GHOST = {"west": 0, "east": -1}
+
+# Where the calibration is stored
+TUNING_FILE = Path(os.environ.get("LSM_COLUMNS_TUNING",
+                                  Path.home() / ".config" / "lsm" / "columns.json"))
+
+# Used when nothing has been calibrated: fastest strategy by column size
+# (bytes), as measured on shared memory
+DEFAULT_SELECTION = {1024: "subarray", 64 * 1024: "pack"}
+
+
+class Columns:
+    """Packing of the column messages into preallocated buffers.
+
+    `send` and `recv` return the buffer argument of the message to or from
+    the neighbour on a side (``"west"``, ``"east"``) of the local array `u`.
+    """
+
+    name = "pack"
+
+    def __init__(self, dec: Decomposition):
+        self.dec = dec
+        self.sides = [side for side in EDGE if getattr(dec, side) != MPI.PROC_NULL]
+        # both sides, messages to `MPI.PROC_NULL` need a buffer too
+        self.send_bufs = {side: np.empty(dec.lnx) for side in EDGE}
+        self.recv_bufs = {side: np.empty(dec.lnx) for side in EDGE}
+
+    def send(self, u: np.ndarray, side: str):
+        return self.send_bufs[side]
+
+    def recv(self, u: np.ndarray, side: str):
+        return self.recv_bufs[side]
+
+    def pack(self, u: np.ndarray):
+        """Copy the first/last interior column into the send buffers"""
+        for side in self.sides:
+            self.send_bufs[side][:] = u[1:-1, EDGE[side]]
+
+    def unpack(self, u: np.ndarray):
+        """Copy the receive buffers into the ghost columns"""
+        for side in self.sides:
+            u[1:-1, GHOST[side]] = self.recv_bufs[side]
+
+    def free(self):
+        """Release the resources of the strategy"""
+
+
+class VectorColumns(Columns):
+    """The columns of `u` described by vector datatypes, no copies.
+
+    The buffer arguments are made once per array (each of the two grids of
+    the iteration), with datatypes of a cache of its own, freed by `free`.
+    """
+
+    name = "vector"
+
+    def __init__(self, dec: Decomposition):
+        self.dec = dec
+        self.sides = [side for side in EDGE if getattr(dec, side) != MPI.PROC_NULL]
+        self.cache = TypeCache()
+        # the array and its buffer arguments by column, by `id` of the array
+        # (which is cheaper than its address, and can't be reused while held)
+        self.specs: dict[int, tuple[np.ndarray, dict[int, tuple]]] = {}
+
+    def spec(self, u: np.ndarray, column: int):
+        entry = self.specs.get(id(u))
+        if entry is None or entry[0] is not u:
+            entry = self.specs[id(u)] = (u, {
+                c: buffer_spec(u[1:-1, c], cache=self.cache)
+                for c in (*EDGE.values(), *GHOST.values())})
+        return entry[1][column]
+
+    def send(self, u: np.ndarray, side: str):
+        return self.spec(u, EDGE[side])
+
+    def recv(self, u: np.ndarray, side: str):
+        return self.spec(u, GHOST[side])
+
+    def pack(self, u: np.ndarray):
+        pass
+
+    def unpack(self, u: np.ndarray):
+        pass
+
+    def free(self):
+        self.specs.clear()
+        self.cache.clear()
+
+
+class SubarrayColumns(Columns):
+    """The columns of `u` described by subarray datatypes of the whole array.
+
+    The offset of the column is part of the datatype, so there are four
+    of them (edge and ghost column of both sides), freed by `free`.
+    """
+
+    name = "subarray"
+
+    def __init__(self, dec: Decomposition):
+        self.dec = dec
+        self.sides = [side for side in EDGE if getattr(dec, side) != MPI.PROC_NULL]
+        shape = list(dec.shape)
+        self.types: dict[int, MPI.Datatype] = {}
+        for side in EDGE:
+            for column in (EDGE[side], GHOST[side]):
+                self.types[column] = MPI.DOUBLE.Create_subarray(
+                    shape, [dec.lnx, 1], [1, column % shape[1]]).Commit()
+
+    def send(self, u: np.ndarray, side: str):
+        return (u, 1, self.types[EDGE[side]])
+
+    def recv(self, u: np.ndarray, side: str):
+        return (u, 1, self.types[GHOST[side]])
+
+    def pack(self, u: np.ndarray):
+        pass
+
+    def unpack(self, u: np.ndarray):
+        pass
+
+    def free(self):
+        for dtype in self.types.values():
+            dtype.Free()
+        self.types.clear()
+
+
+COLUMNS = {cls.name: cls for cls in (Columns, VectorColumns, SubarrayColumns)}
+STRATEGIES = tuple(COLUMNS)
+
+
+# -----------------------------------------------------------------------------
+# Selection
+# -----------------------------------------------------------------------------
+
+def load_selection(size: int, path: Path = TUNING_FILE) -> dict[int, str]:
+    """Fastest strategy by column size (bytes) at `size` ranks.
+
+    Uses the calibration of the closest number of ranks, or
+    `DEFAULT_SELECTION` if nothing has been calibrated.
+    """
+    try:
+        tuned = json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        tuned = {}
+    if not tuned:
+        return dict(DEFAULT_SELECTION)
+    closest = min(tuned, key=lambda s: abs(np.log2(int(s) / size)))
+    return {int(nbytes): name for nbytes, name in tuned[closest].items()}
+
+
+def save_selection(size: int, selection: dict[int, str], path: Path = TUNING_FILE):
+    """Store the `selection` measured at `size` ranks in `path`"""
+    path = Path(path)
+    try:
+        tuned = json.loads(path.read_text())
+    except (OSError, ValueError):
+        tuned = {}
+    tuned[str(size)] = {str(nbytes): name for nbytes, name in sorted(selection.items())}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(tuned, indent=2, sort_keys=True) + "\n")
+
+
+_selection_cache: dict[int, dict[int, str]] = {}
+
+
+def select(nbytes: int, selection: dict[int, str]) -> str:
+    """The strategy of the measured size closest to `nbytes` (log scale)"""
+    closest = min(selection, key=lambda n: abs(np.log2(max(n, 1) / max(nbytes, 1))))
+    return selection[closest]
+
+
+def make_columns(dec: Decomposition, strategy: str = "auto") -> Columns:
+    """The `strategy` (one of `STRATEGIES` or ``auto``) for the columns of `dec`"""
+    if strategy == "auto":
+        size = dec.comm.Get_size()
+        if size not in _selection_cache:
+            _selection_cache[size] = load_selection(size)
+        strategy = select(dec.lnx * MPI.DOUBLE.Get_size(), _selection_cache[size])
+    if strategy not in COLUMNS:
+        raise ValueError(f"Unknown column strategy: {strategy}")
+    return COLUMNS[strategy](dec)
+
+
+# -----------------------------------------------------------------------------
+# Calibration
+# -----------------------------------------------------------------------------
+
+def time_columns(dec: Decomposition, strategy: str, repeats: int = 20) -> float:
+    """Median (over `repeats`) of the slowest rank's non-blocking halo exchange"""
+    from .halo import NonblockingHaloExchange
+
+    comm = dec.comm
+    exchange = NonblockingHaloExchange(dec, strategy)
+    u = np.zeros(dec.shape)
+    exchange.exchange(u)  # warm-up
+    times = np.empty(repeats)
+    for i in range(repeats):
+        comm.Barrier()
+        t0 = MPI.Wtime()
+        exchange.exchange(u)
+        times[i] = MPI.Wtime() - t0
+    exchange.free()
+    comm.Allreduce(MPI.IN_PLACE, times, op=MPI.MAX)
+    return float(np.median(times))
+
+
+def calibrate(comm, min_power: int = 3, max_power: int = 24, repeats: int = 20,
+              columns: int = 4, save: bool = True, verbose: bool = True) -> dict[int, str]:
+    """Time the strategies for columns of ``2**min_power .. 2**max_power`` bytes.
+
+    The ranks are laid out in a row (``dims = (1, P)``), each with
+    `columns` interior columns, so that only columns are exchanged.
+    """
+    size = comm.Get_size()
+    if size < 2:
+        raise ValueError("calibrating the column exchange requires at least 2 ranks")
+    itemsize = MPI.DOUBLE.Get_size()
+    selection = {}
+    for p in range(min_power, max_power + 1):
+        lnx = max(1, 2 ** p // itemsize)
+        dec = decompose(comm, lnx, columns * size, dims=(1, size))
+        times = {name: time_columns(dec, name, repeats) for name in STRATEGIES}
+        dec.comm.Free()
+        nbytes = lnx * itemsize
+        selection[nbytes] = min(times, key=times.get)
+        if verbose and comm.Get_rank() == 0:
+            line = "  ".join(f"{name}={t * 1e6:10.1f}us" for name, t in times.items())
+            print(f"{nbytes:10d} B  {line}  -> {selection[nbytes]}", flush=True)
+
+    if comm.Get_rank() == 0 and save:
+        save_selection(size, selection)
+    _selection_cache.pop(size, None)
+    return selection
+
@@ -0,0 +1,90 @@
+"""Domain decomposition of the global ``nx * ny`` grid on a Cartesian communicator.
+
+Axis 0 (``x``, rows) runs from the TOP boundary (north) to the BOTTOM
+boundary (south), axis 1 (``y``, columns) from LEFT (west) to RIGHT (east),
+just as in ``w02/labs/Jacobi/jacobi-mpi-block.c``.
+
+The 1D layout is the slab decomposition of the C code, ``dims = (P, 1)``,
+so rank ``r`` holds the ``r``-th block of rows.
+The 2D layout splits both axes, with ``dims`` from `MPI.Compute_dims`.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+from mpi4py import MPI
+
+LAYOUTS = ("1d", "2d")
+
+
+def split(n: int, parts: int, index: int, align: int = 1) -> tuple[int, int]:
+    """Return ``(start, count)`` of block `index` when splitting `n` in `parts`.
+
+    As in the C code, the first ``n % parts`` blocks get one extra element.
+    With `align`, the blocks are split in units of `align` elements, so
+    they start at multiples of `align` (the last one may be shorter).
+    """
+    units = -(-n // align)
+    base, rem = divmod(units, parts)
+    start = (index * base + min(index, rem)) * align
+    return start, min((base + (index < rem)) * align, n - start)
+
+
+def layout_dims(size: int, layout: str) -> list[int]:
+    """The Cartesian ``dims`` of `layout` on `size` ranks"""
+    if layout == "1d":
+        return [size, 1]
+    if layout == "2d":
+        return MPI.Compute_dims(size, 2)
+    raise ValueError(f"Unknown layout: {layout}")
+
+
+@dataclass
+class Decomposition:
+    """The local block of a rank, with a ghost layer of width one."""
+    comm: MPI.Cartcomm
+    nx: int
+    ny: int
+    dims: tuple[int, int]
+    coords: tuple[int, int]
+    # global index of the first interior row/column, and number of them
+    x0: int
+    lnx: int
+    y0: int
+    lny: int
+    # neighbouring ranks, `MPI.PROC_NULL` at the global boundary
+    north: int
+    south: int
+    west: int
+    east: int
+
+    @property
+    def rank(self) -> int:
+        return self.comm.Get_rank()
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        """Shape of the local array, including ghost cells"""
+        return self.lnx + 2, self.lny + 2
+
+
+def decompose(comm: MPI.Comm, nx: int, ny: int, layout: str = "1d",
+              reorder: bool = False, align: int = 1,
+              dims: tuple[int, int] | None = None) -> Decomposition:
+    """Decompose the ``nx * ny`` interior grid over the ranks of `comm`.
+
+    `align` is passed on to `split`. `dims` overrides the ``dims`` of `layout`.
+    """
+    dims = list(dims) if dims is not None else layout_dims(comm.Get_size(), layout)
+    if dims[0] > -(-nx // align) or dims[1] > -(-ny // align):
+        raise ValueError(f"Cannot split a {nx}x{ny} grid on {dims[0]}x{dims[1]} ranks")
+
+    cart = comm.Create_cart(dims, periods=[False, False], reorder=reorder)
+    coords = cart.Get_coords(cart.Get_rank())
+    north, south = cart.Shift(0, 1)
+    west, east = cart.Shift(1, 1)
+    x0, lnx = split(nx, dims[0], coords[0], align)
+    y0, lny = split(ny, dims[1], coords[1], align)
+    return Decomposition(cart, nx, ny, tuple(dims), tuple(coords),
+                         x0, lnx, y0, lny, north, south, west, east)
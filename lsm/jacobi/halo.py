@@ -0,0 +1,453 @@
+"""Halo (ghost cell) exchanges of the local grid.
+
+Every exchange fills the ghost rows ``u[0]``, ``u[-1]`` and the ghost
+columns ``u[:, 0]``, ``u[:, -1]`` of the local array from the neighbouring
+ranks. Ghost cells on the global boundary hold the boundary conditions
+and are never touched.
+
+Rows are contiguous and sent straight from the array, columns are
+strided and sent with one of the strategies of `lsm.jacobi.columns`
+(packing or derived datatypes).
+"""
+
+from __future__ import annotations
+
+from dataclasses import replace
+
+import numpy as np
+from mpi4py import MPI
+
+from .columns import make_columns
+from .decomp import Decomposition
+
+# Tag of a message by the direction it travels
+TAG_NORTH, TAG_SOUTH, TAG_WEST, TAG_EAST = 11, 12, 13, 14
+
+
+class HaloExchange:
+    """Blocking exchange with `MPI.Comm.Sendrecv`.
+
+    Unlike the C code (``Recv`` from ``rank-1`` *before* ``Send``), the
+    pairwise ``Sendrecv`` doesn't serialise the exchange along the ranks.
+    """
+
+    name = "blocking"
+
+    def __init__(self, dec: Decomposition, columns: str = "auto"):
+        self.dec = dec
+        self.comm = dec.comm
+        # only 2D layouts have columns to exchange
+        self.has_columns = dec.west != MPI.PROC_NULL or dec.east != MPI.PROC_NULL
+        if self.has_columns:
+            self.columns = make_columns(dec, columns)
+
+    def exchange(self, u: np.ndarray):
+        """Fill the ghost cells of `u`."""
+        dec, comm = self.dec, self.comm
+        comm.Sendrecv(u[1, 1:-1], dec.north, TAG_NORTH,
+                      u[-1, 1:-1], dec.south, TAG_NORTH)
+        comm.Sendrecv(u[-2, 1:-1], dec.south, TAG_SOUTH,
+                      u[0, 1:-1], dec.north, TAG_SOUTH)
+
+        if self.has_columns:
+            cols = self.columns
+            cols.pack(u)
+            comm.Sendrecv(cols.send(u, "west"), dec.west, TAG_WEST,
+                          cols.recv(u, "east"), dec.east, TAG_WEST)
+            comm.Sendrecv(cols.send(u, "east"), dec.east, TAG_EAST,
+                          cols.recv(u, "west"), dec.west, TAG_EAST)
+            cols.unpack(u)
+
+    def start(self, u: np.ndarray):
+        """Start filling the ghost cells of `u`, see `finish`.
+
+        Exchanges which can't overlap do all of the work here.
+        """
+        self.exchange(u)
+
+    def finish(self, u: np.ndarray):
+        """Wait until the ghost cells of `u` are filled"""
+
+    def allocate(self, u: np.ndarray) -> np.ndarray:
+        """The array to iterate on with the values of `u`.
+
+        `u` itself, or a copy in memory of the exchange; all grids which
+        are exchanged must come from here.
+        """
+        return u
+
+    def free(self):
+        """Release the resources of the exchange"""
+        if self.has_columns:
+            self.columns.free()
+
+
+class NonblockingHaloExchange(HaloExchange):
+    """Exchange with `Irecv`/`Isend`, which can overlap with computations.
+
+    Between `start` and `finish` the ghost cells of `u` are being written,
+    and the first/last interior rows and columns must not change.
+    """
+
+    name = "nonblocking"
+
+    def __init__(self, dec: Decomposition, columns: str = "auto"):
+        super().__init__(dec, columns)
+        self.reqs: list[MPI.Request] = []
+
+    def start(self, u: np.ndarray):
+        dec, comm = self.dec, self.comm
+        # post receives first, so the messages can go straight into `u`
+        reqs = [
+            comm.Irecv(u[-1, 1:-1], dec.south, TAG_NORTH),
+            comm.Irecv(u[0, 1:-1], dec.north, TAG_SOUTH),
+        ]
+        if self.has_columns:
+            cols = self.columns
+            reqs.append(comm.Irecv(cols.recv(u, "east"), dec.east, TAG_WEST))
+            reqs.append(comm.Irecv(cols.recv(u, "west"), dec.west, TAG_EAST))
+
+        reqs.append(comm.Isend(u[1, 1:-1], dec.north, TAG_NORTH))
+        reqs.append(comm.Isend(u[-2, 1:-1], dec.south, TAG_SOUTH))
+        if self.has_columns:
+            cols.pack(u)
+            reqs.append(comm.Isend(cols.send(u, "west"), dec.west, TAG_WEST))
+            reqs.append(comm.Isend(cols.send(u, "east"), dec.east, TAG_EAST))
+        self.reqs = reqs
+
+    def finish(self, u: np.ndarray):
+        MPI.Request.Waitall(self.reqs)
+        self.reqs = []
+        if self.has_columns:
+            self.columns.unpack(u)
+
+    def exchange(self, u: np.ndarray):
+        self.start(u)
+        self.finish(u)
+
+
+class PersistentHaloExchange(NonblockingHaloExchange):
+    """Exchange with persistent requests (`Send_init`/`Recv_init`).
+
+    The requests are bound to the rows and columns of `u` (or the column
+    buffers) once and restarted with `Prequest.Startall` in every exchange, which
+    saves the setup of the eight requests per exchange. They are created
+    the first time an array is exchanged, so each of the two grids of the
+    iteration gets its own set; `free` releases them.
+    """
+
+    name = "persistent"
+
+    def __init__(self, dec: Decomposition, columns: str = "auto"):
+        super().__init__(dec, columns)
+        # requests by the address of the array they are bound to
+        self.channels: dict[int, list[MPI.Prequest]] = {}
+
+    def channel(self, u: np.ndarray) -> list[MPI.Prequest]:
+        """The persistent requests of `u`"""
+        reqs = self.channels.get(u.ctypes.data)
+        if reqs is not None:
+            return reqs
+
+        dec, comm = self.dec, self.comm
+        reqs = [
+            comm.Recv_init(u[-1, 1:-1], dec.south, TAG_NORTH),
+            comm.Recv_init(u[0, 1:-1], dec.north, TAG_SOUTH),
+        ]
+        if self.has_columns:
+            cols = self.columns
+            reqs.append(comm.Recv_init(cols.recv(u, "east"), dec.east, TAG_WEST))
+            reqs.append(comm.Recv_init(cols.recv(u, "west"), dec.west, TAG_EAST))
+
+        reqs.append(comm.Send_init(u[1, 1:-1], dec.north, TAG_NORTH))
+        reqs.append(comm.Send_init(u[-2, 1:-1], dec.south, TAG_SOUTH))
+        if self.has_columns:
+            reqs.append(comm.Send_init(cols.send(u, "west"), dec.west, TAG_WEST))
+            reqs.append(comm.Send_init(cols.send(u, "east"), dec.east, TAG_EAST))
+        self.channels[u.ctypes.data] = reqs
+        return reqs
+
+    def start(self, u: np.ndarray):
+        reqs = self.channel(u)
+        if self.has_columns:
+            self.columns.pack(u)
+        MPI.Prequest.Startall(reqs)
+        self.reqs = reqs
+
+    def free(self):
+        for reqs in self.channels.values():
+            for req in reqs:
+                req.Free()
+        self.channels.clear()
+        super().free()
+
+
+class NeighborHaloExchange(HaloExchange):
+    """The whole exchange in one `Neighbor_alltoallw` on the Cartesian communicator.
+
+    The neighbours of a Cartesian topology are ordered north, south, west,
+    east (``-1``/``+1`` along each dimension, as `MPI.Cartcomm.Shift`), and
+    `MPI.PROC_NULL` ones are skipped by MPI. Each of the eight rows and
+    columns is a subarray datatype of the local array, so the messages go
+    straight from and into `u`. Use it with ``reorder=True`` in
+    `decompose`, so that MPI can place neighbours on the same node.
+    """
+
+    name = "neighbor"
+
+    def __init__(self, dec: Decomposition, columns: str = "auto"):
+        # `columns` doesn't apply, all messages are subarrays
+        self.dec = dec
+        self.comm = dec.comm
+        self.has_columns = False
+        shape = [dec.lnx + 2, dec.lny + 2]
+        rows, cols = [1, dec.lny], [dec.lnx, 1]
+
+        def subarray(subsizes, start):
+            return MPI.DOUBLE.Create_subarray(shape, subsizes, start).Commit()
+
+        # by neighbour: north, south, west, east
+        self.sendtypes = [subarray(rows, [1, 1]), subarray(rows, [dec.lnx, 1]),
+                          subarray(cols, [1, 1]), subarray(cols, [1, dec.lny])]
+        self.recvtypes = [subarray(rows, [0, 1]), subarray(rows, [dec.lnx + 1, 1]),
+                          subarray(cols, [1, 0]), subarray(cols, [1, dec.lny + 1])]
+        self.counts = ([1] * 4, [0] * 4)
+
+    def buffers(self, u: np.ndarray):
+        """The send and receive buffer arguments of `u`"""
+        return [u, self.counts, self.sendtypes], [u, self.counts, self.recvtypes]
+
+    def exchange(self, u: np.ndarray):
+        self.comm.Neighbor_alltoallw(*self.buffers(u))
+
+    def free(self):
+        for dtype in self.sendtypes + self.recvtypes:
+            dtype.Free()
+        self.sendtypes, self.recvtypes = [], []
+
+
+class INeighborHaloExchange(NeighborHaloExchange):
+    """`NeighborHaloExchange` with `Ineighbor_alltoallw`, which can overlap
+    with computations (see `NonblockingHaloExchange`)."""
+
+    name = "ineighbor"
+
+    def __init__(self, dec: Decomposition, columns: str = "auto"):
+        super().__init__(dec, columns)
+        self.req = MPI.REQUEST_NULL
+
+    def start(self, u: np.ndarray):
+        self.req = self.comm.Ineighbor_alltoallw(*self.buffers(u))
+
+    def finish(self, u: np.ndarray):
+        self.req.Wait()
+
+    def exchange(self, u: np.ndarray):
+        self.start(u)
+        self.finish(u)
+
+
+class FenceHaloExchange(HaloExchange):
+    """One-sided exchange: `MPI.Win.Put` into the ghost cells of the neighbours.
+
+    Every grid is exposed in a window (created the first time it is
+    exchanged, a collective call) and each rank puts its first/last
+    interior rows and columns straight into the ghost cells of its
+    neighbours, within an access epoch opened by `start` and closed by
+    `finish`, here with `MPI.Win.Fence`. The layout of the neighbours'
+    arrays (their block sizes) is gathered once, the target columns are
+    vector datatypes of that layout. The origin columns go through the
+    `columns` strategy.
+    """
+
+    name = "fence"
+
+    def __init__(self, dec: Decomposition, columns: str = "auto"):
+        super().__init__(dec, columns)
+        # windows by the address of the array they expose
+        self.windows: dict[int, MPI.Win] = {}
+        self.win = MPI.WIN_NULL
+        north, south, west, east = dec.comm.neighbor_allgather((dec.lnx, dec.lny))
+        # where the messages go (target displacement, count, datatype)
+        self.targets: dict[str, tuple[int, int, MPI.Datatype]] = {}
+        if north is not None:
+            lnx, lny = north
+            self.targets["north"] = ((lnx + 1) * (lny + 2) + 1, dec.lny, MPI.DOUBLE)
+        if south is not None:
+            self.targets["south"] = (1, dec.lny, MPI.DOUBLE)
+        self.types = []
+        for side, shape, column in (("west", west, -1), ("east", east, 0)):
+            if shape is not None:
+                lny = shape[1]
+                dtype = MPI.DOUBLE.Create_vector(dec.lnx, 1, lny + 2).Commit()
+                self.types.append(dtype)
+                self.targets[side] = (lny + 2 + column % (lny + 2), 1, dtype)
+
+    def window(self, u: np.ndarray) -> MPI.Win:
+        """The window exposing `u`"""
+        win = self.windows.get(u.ctypes.data)
+        if win is None:
+            win = self.windows[u.ctypes.data] = MPI.Win.Create(
+                u, u.itemsize, comm=self.comm)
+        return win
+
+    def put(self, u: np.ndarray):
+        """Put the edges of `u` into the ghost cells of the neighbours"""
+        dec, win, targets = self.dec, self.win, self.targets
+        if "north" in targets:
+            win.Put(u[1, 1:-1], dec.north, targets["north"])
+        if "south" in targets:
+            win.Put(u[-2, 1:-1], dec.south, targets["south"])
+        if self.has_columns:
+            self.columns.pack(u)
+            for side in ("west", "east"):
+                if side in targets:
+                    win.Put(self.columns.send(u, side), getattr(dec, side), targets[side])
+
+    def start(self, u: np.ndarray):
+        # a single rank has nothing to exchange (and on more, all ranks
+        # have neighbours)
+        if not self.targets:
+            return
+        self.win = self.window(u)
+        self.win.Fence(MPI.MODE_NOPRECEDE)
+        self.put(u)
+
+    def finish(self, u: np.ndarray):
+        if self.targets:
+            self.win.Fence(MPI.MODE_NOSUCCEED)
+
+    def exchange(self, u: np.ndarray):
+        self.start(u)
+        self.finish(u)
+
+    def free(self):
+        for win in self.windows.values():
+            win.Free()
+        self.windows.clear()
+        for dtype in self.types:
+            dtype.Free()
+        self.types.clear()
+        super().free()
+
+
+class PSCWHaloExchange(FenceHaloExchange):
+    """`FenceHaloExchange` with general active target synchronisation.
+
+    Instead of a fence of all ranks, each rank exposes its window to its
+    neighbours only (`MPI.Win.Post`/`MPI.Win.Wait`) and accesses theirs
+    (`MPI.Win.Start`/`MPI.Win.Complete`).
+    """
+
+    name = "pscw"
+
+    def __init__(self, dec: Decomposition, columns: str = "auto"):
+        super().__init__(dec, columns)
+        neighbors = sorted({dec.north, dec.south, dec.west, dec.east} - {MPI.PROC_NULL})
+        group = self.comm.Get_group()
+        self.group = group.Incl(neighbors)
+        group.Free()
+
+    def start(self, u: np.ndarray):
+        if not self.targets:
+            return
+        self.win = win = self.window(u)
+        win.Post(self.group)
+        win.Start(self.group)
+        self.put(u)
+
+    def finish(self, u: np.ndarray):
+        if self.targets:
+            self.win.Complete()
+            self.win.Wait()
+
+    def free(self):
+        self.group.Free()
+        super().free()
+
+
+class SharedHaloExchange(HaloExchange):
+    """Hybrid exchange: ranks on the same node read each other's grids.
+
+    The ranks of a node (`MPI.Comm.Split_type` with `MPI.COMM_TYPE_SHARED`)
+    `allocate` their grids in shared memory (`MPI.Win.Allocate_shared`),
+    so the ghost cells of an on-node neighbour are copied straight out
+    of its grid, without messages. A barrier of the node before the
+    copies waits until the neighbours have written their edges, one
+    after (in `finish`) until they have read ours. Only the neighbours
+    on other nodes get messages, with a `NonblockingHaloExchange`.
+    """
+
+    name = "shared"
+
+    def __init__(self, dec: Decomposition, columns: str = "auto"):
+        self.dec = dec
+        self.comm = comm = dec.comm
+        self.has_columns = False
+        self.node = comm.Split_type(MPI.COMM_TYPE_SHARED)
+
+        sides = ("north", "south", "west", "east")
+        group, node_group = comm.Get_group(), self.node.Get_group()
+        ranks = MPI.Group.Translate_ranks(group, [getattr(dec, s) for s in sides], node_group)
+        group.Free()
+        node_group.Free()
+        shapes = comm.neighbor_allgather(dec.shape)
+        # rank in `node` and block shape of the on-node neighbours
+        self.peers = {side: (rank, shape) for side, rank, shape in zip(sides, ranks, shapes)
+                      if rank not in (MPI.UNDEFINED, MPI.PROC_NULL)}
+        self.remote = NonblockingHaloExchange(
+            replace(dec, **{side: MPI.PROC_NULL for side in self.peers}), columns)
+        # windows and views of the neighbours' grids, by address of the grid
+        self.windows: dict[int, tuple[MPI.Win, dict[str, np.ndarray]]] = {}
+
+    def allocate(self, u: np.ndarray) -> np.ndarray:
+        """A copy of `u` in a shared window of the node (a collective call)"""
+        win = MPI.Win.Allocate_shared(u.nbytes, u.itemsize, comm=self.node)
+        win.Lock_all(MPI.MODE_NOCHECK)
+        shared = np.ndarray(u.shape, u.dtype, buffer=win.tomemory())
+        shared[...] = u
+        views = {side: np.ndarray(shape, u.dtype, buffer=win.Shared_query(rank)[0])
+                 for side, (rank, shape) in self.peers.items()}
+        self.windows[shared.ctypes.data] = (win, views)
+        return shared
+
+    def start(self, u: np.ndarray):
+        entry = self.windows.get(u.ctypes.data)
+        if entry is None:
+            raise ValueError("the shared exchange needs grids from allocate()")
+        win, views = entry
+        self.remote.start(u)
+        win.Sync()
+        self.node.Barrier()
+        win.Sync()
+        if "north" in views:
+            u[0, 1:-1] = views["north"][-2, 1:-1]
+        if "south" in views:
+            u[-1, 1:-1] = views["south"][1, 1:-1]
+        if "west" in views:
+            u[1:-1, 0] = views["west"][1:-1, -2]
+        if "east" in views:
+            u[1:-1, -1] = views["east"][1:-1, 1]
+
+    def finish(self, u: np.ndarray):
+        self.remote.finish(u)
+        self.node.Barrier()
+
+    def exchange(self, u: np.ndarray):
+        self.start(u)
+        self.finish(u)
+
+    def free(self):
+        self.remote.free()
+        for win, _ in self.windows.values():
+            win.Unlock_all()
+            win.Free()
+        self.windows.clear()
+        self.node.Free()
+
+
+HALO_EXCHANGES = {
+    cls.name: cls for cls in (HaloExchange, NonblockingHaloExchange, PersistentHaloExchange,
+                              NeighborHaloExchange, INeighborHaloExchange, FenceHaloExchange,
+                              PSCWHaloExchange, SharedHaloExchange)
+}
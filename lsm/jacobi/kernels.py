@@ -0,0 +1,153 @@
+"""Vectorised five-point stencil kernels on the local grid (with ghost cells).
+
+All kernels work on slices of the whole interior at once, no Python loops.
+`work` arrays (at least the shape of the box) avoid temporaries.
+Kernels with a right-hand side `f` (same shape as `u`) solve
+``4 u_ij - (sum of the four neighbours) = f_ij``, by default ``f = 0``.
+
+A `Box` ``(i0, i1, j0, j1)`` restricts a kernel to the points
+``u[i0:i1, j0:j1]`` (array indices, i.e. including the ghost offset),
+by default the whole interior is used.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+Box = tuple[int, int, int, int]
+
+
+def interior(shape: tuple[int, int]) -> Box:
+    """The box of all interior points"""
+    return 1, shape[0] - 1, 1, shape[1] - 1
+
+
+def split_boxes(shape: tuple[int, int]) -> tuple[Box | None, list[Box]]:
+    """Split the interior in an *inner* box, which doesn't read any ghost
+    cell, and the edge strips next to the ghost cells.
+
+    The inner box is None if the local grid is too thin to have one.
+    """
+    n, m = shape
+    inner = (2, n - 2, 2, m - 2)
+    if n - 2 <= 2 or m - 2 <= 2:
+        # everything touches a ghost cell
+        return None, [interior(shape)]
+
+    edges = [
+        (1, 2, 1, m - 1),          # first row
+        (n - 2, n - 1, 1, m - 1),  # last row
+        (2, n - 2, 1, 2),          # first column
+        (2, n - 2, m - 2, m - 1),  # last column
+    ]
+    return inner, edges
+
+
+def tile_boxes(box: Box, tile: tuple[int, int] | None) -> list[Box]:
+    """Split `box` in tiles of at most ``tile = (rows, cols)`` points.
+
+    Running a kernel tile by tile keeps the rows of a tile (and the
+    temporaries of the vectorised operations) in cache, as the ``-t``
+    option of ``jacobi-mpi-block``. A size of 0 (or no `tile`) doesn't
+    split that direction.
+    """
+    if not tile:
+        return [box]
+    i0, i1, j0, j1 = box
+    ti = tile[0] or i1 - i0
+    tj = tile[1] or j1 - j0
+    return [(i, min(i + ti, i1), j, min(j + tj, j1))
+            for i in range(i0, i1, ti) for j in range(j0, j1, tj)]
+
+
+def residual_sq(u: np.ndarray, work: np.ndarray | None = None,
+                box: Box | None = None) -> float:
+    """Local sum of ``(4 u_ij - u_i,j-1 - u_i,j+1 - u_i-1,j - u_i+1,j)**2``"""
+    i0, i1, j0, j1 = box or interior(u.shape)
+    if work is not None:
+        work = work[:i1 - i0, :j1 - j0]
+    r = np.multiply(u[i0:i1, j0:j1], 4, out=work)
+    r -= u[i0:i1, j0 - 1:j1 - 1]
+    r -= u[i0:i1, j0 + 1:j1 + 1]
+    r -= u[i0 - 1:i1 - 1, j0:j1]
+    r -= u[i0 + 1:i1 + 1, j0:j1]
+    return float(np.einsum("ij,ij->", r, r))
+
+
+def residual(u: np.ndarray, r: np.ndarray, f: np.ndarray | None = None,
+             box: Box | None = None):
+    """``r = f - (4 u_ij - sum of the four neighbours)`` on the interior"""
+    i0, i1, j0, j1 = box or interior(u.shape)
+    out = np.multiply(u[i0:i1, j0:j1], -4, out=r[i0:i1, j0:j1])
+    out += u[i0:i1, j0 - 1:j1 - 1]
+    out += u[i0:i1, j0 + 1:j1 + 1]
+    out += u[i0 - 1:i1 - 1, j0:j1]
+    out += u[i0 + 1:i1 + 1, j0:j1]
+    if f is not None:
+        out += f[i0:i1, j0:j1]
+
+
+def jacobi_sweep(u: np.ndarray, unew: np.ndarray, box: Box | None = None,
+                 f: np.ndarray | None = None, omega: float = 1.0):
+    """``unew = 0.25 * (sum of the four neighbours)`` on the interior.
+
+    Weighted with ``unew = (1 - omega) u + omega unew`` if `omega` isn't 1.
+    """
+    i0, i1, j0, j1 = box or interior(u.shape)
+    out = unew[i0:i1, j0:j1]
+    np.add(u[i0:i1, j0 - 1:j1 - 1], u[i0:i1, j0 + 1:j1 + 1], out=out)
+    out += u[i0 - 1:i1 - 1, j0:j1]
+    out += u[i0 + 1:i1 + 1, j0:j1]
+    if f is not None:
+        out += f[i0:i1, j0:j1]
+    out *= 0.25 * omega
+    if omega != 1.0:
+        out += (1.0 - omega) * u[i0:i1, j0:j1]
+
+
+def jacobi_sweep_residual(u: np.ndarray, unew: np.ndarray, work: np.ndarray | None = None,
+                          box: Box | None = None) -> float:
+    """`jacobi_sweep` which also returns `residual_sq` of `u`.
+
+    The residual of a point is ``4 u_ij - (sum of the four neighbours)
+    = 4 (u_ij - unew_ij)``, so it comes from the updated points instead
+    of a second pass over the neighbours.
+    """
+    i0, i1, j0, j1 = box or interior(u.shape)
+    jacobi_sweep(u, unew, box)
+    if work is not None:
+        work = work[:i1 - i0, :j1 - j0]
+    r = np.subtract(u[i0:i1, j0:j1], unew[i0:i1, j0:j1], out=work)
+    return 16.0 * float(np.einsum("ij,ij->", r, r))
+
+
+def redblack_sweep(u: np.ndarray, colour: int, parity: int = 0, omega: float = 1.0,
+                   work: np.ndarray | None = None, box: Box | None = None,
+                   f: np.ndarray | None = None):
+    """In place SOR update of the points of one `colour` (0 red, 1 black).
+
+    A point ``u[i, j]`` is red if ``(i + j + parity) % 2 == 0``, `parity`
+    makes the colouring global across the ranks. All neighbours of a point
+    have the other colour, so the update is vectorised over the strided
+    views of the colour::
+
+        u_ij = (1 - omega) u_ij + omega/4 (sum of the four neighbours + f_ij)
+
+    ``omega=1`` is Gauss-Seidel.
+    """
+    i0, i1, j0, j1 = box or interior(u.shape)
+    for i in (i0, i0 + 1):
+        j = j0 + (colour + parity + i + j0) % 2
+        if i >= i1 or j >= j1:
+            continue
+        rows, cols = slice(i, i1, 2), slice(j, j1, 2)
+        c = u[rows, cols]
+        out = work[:c.shape[0], :c.shape[1]] if work is not None else None
+        s = np.add(u[rows, j - 1:j1 - 1:2], u[rows, j + 1:j1 + 1:2], out=out)
+        s += u[i - 1:i1 - 1:2, cols]
+        s += u[i + 1:i1 + 1:2, cols]
+        if f is not None:
+            s += f[rows, cols]
+        s *= 0.25 * omega
+        c *= 1.0 - omega
+        c += s
@@ -0,0 +1,400 @@
+"""Geometric multigrid V-cycle for the Laplace problem of ``jacobi-mpi-block.c``.
+
+The finest level is the grid of `solve`, with the boundary values in the
+ghost cells, and one V-cycle is one iteration of the solver. The coarser
+levels are cell centred, a coarse point aggregates 2x2 fine points (the
+last one 3 points along an axis of odd size):
+
+- the residual is restricted by ``4 *`` the mean of the aggregate (the
+  unscaled five-point operator of the coarse grid has 4 times the
+  spacing squared),
+- the correction is prolongated bilinearly,
+- the correction vanishes on the global boundary, its ghost cells there
+  are extrapolated linearly from the outermost point, whose distance to
+  the boundary each level keeps track of.
+
+Each rank coarsens its own block, which works as long as the blocks start
+at even indices: `alignment` chooses the ``align`` of `decompose` for
+that. Once the blocks can't be coarsened (or get too small), the residual
+is gathered on rank 0, which is split off into a communicator of its own
+(coarse-grid agglomeration) and runs the rest of the V-cycle alone,
+then the correction is scattered back.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field, replace
+from math import sqrt
+
+import numpy as np
+from mpi4py import MPI
+
+from ..hierarchical import HierarchicalComm
+from .decomp import Decomposition, decompose, layout_dims
+from .halo import HALO_EXCHANGES, HaloExchange
+from .kernels import jacobi_sweep, redblack_sweep, residual, residual_sq
+from .solver import (CONVERGENCE_ACCURACY, MAX_ITERATIONS, REPORT_NORM_PERIOD, Result,
+                     initialise)
+
+SMOOTHERS = ("redblack", "jacobi")
+# weight of the Jacobi smoother
+JACOBI_OMEGA = 0.8
+# every rank gets at least this many blocks of `alignment` points, which
+# bounds the load imbalance of the aligned decomposition
+MIN_BLOCKS = 16
+# agglomerate when a coarse local block would be smaller than this
+MIN_LOCAL = 4
+# coarsen while both global sizes are at least this, smooth the coarsest
+# level this often
+MIN_COARSEN = 4
+COARSEST_SWEEPS = 20
+
+# distances of the (north, south, west, east) boundary from the outermost
+# points of a level, in points of the finest grid
+Bounds = tuple[float, float, float, float]
+
+
+def alignment(size: int, nx: int, ny: int, layout: str = "1d") -> int:
+    """The ``align`` argument of `decompose` for `Multigrid`.
+
+    The largest power of two which still gives every rank `MIN_BLOCKS`
+    blocks along the split axes, the local blocks can then be coarsened
+    ``log2(align)`` times before the grid is agglomerated.
+    """
+    if size == 1:
+        return 1
+    dims = layout_dims(size, layout)
+    n = min(nd // pd for nd, pd in zip((nx, ny), dims) if pd > 1)
+    align = 1
+    while n // (2 * align) >= MIN_BLOCKS:
+        align *= 2
+    return align
+
+
+def coarsen(dec: Decomposition) -> Decomposition:
+    """The decomposition of the next coarser level, on the same ranks.
+
+    The blocks must start at even indices, and only the last block along
+    an axis of odd size has an odd size (its last aggregate has 3 points).
+    """
+    return replace(dec, nx=dec.nx // 2, ny=dec.ny // 2, x0=dec.x0 // 2, lnx=dec.lnx // 2,
+                   y0=dec.y0 // 2, lny=dec.lny // 2)
+
+
+def coarsen_bounds(dec: Decomposition, spacing: int, bounds: Bounds) -> Bounds:
+    """`Bounds` of the next coarser level of `dec`.
+
+    The outermost aggregate is centred ``spacing / 2`` further inside, or
+    ``spacing`` for the 3 point aggregate at the end of an odd size.
+    """
+    north, south, west, east = bounds
+    half = spacing / 2
+    return (north + half, south + (spacing if dec.nx % 2 else half),
+            west + half, east + (spacing if dec.ny % 2 else half))
+
+
+def restrict(r: np.ndarray, f: np.ndarray):
+    """``f = 4 * mean`` of the aggregates of `r` (interior points only)"""
+    ri, fi = r[1:-1, 1:-1], f[1:-1, 1:-1]
+    n, m = ri.shape
+    nc, mc = fi.shape
+    fi[...] = ri[0:2 * nc:2, 0:2 * mc:2]
+    fi += ri[1:2 * nc:2, 0:2 * mc:2]
+    fi += ri[0:2 * nc:2, 1:2 * mc:2]
+    fi += ri[1:2 * nc:2, 1:2 * mc:2]
+    # the 3 point aggregates at the end of odd sizes
+    if n % 2:
+        fi[-1] += ri[-1, 0:2 * mc:2] + ri[-1, 1:2 * mc:2]
+    if m % 2:
+        fi[:, -1] += ri[0:2 * nc:2, -1] + ri[1:2 * nc:2, -1]
+    if n % 2 and m % 2:
+        fi[-1, -1] += ri[-1, -1]
+    if n % 2:
+        fi[-1] *= 2 / 3
+    if m % 2:
+        fi[:, -1] *= 2 / 3
+
+
+def _interpolate(line: np.ndarray, out: np.ndarray):
+    """Add the linear interpolation of the coarse `line` (with ghost cells)
+    to the fine `out`, along the last axis."""
+    k = line.shape[-1] - 2
+    out[..., 0:2 * k:2] += 0.75 * line[..., 1:k + 1] + 0.25 * line[..., 0:k]
+    out[..., 1:2 * k:2] += 0.75 * line[..., 1:k + 1] + 0.25 * line[..., 2:k + 2]
+    if out.shape[-1] % 2:
+        # the last point of a 3 point aggregate, between it and the ghost cell
+        out[..., -1] += 0.5 * (line[..., k] + line[..., k + 1])
+
+
+def prolongate(e: np.ndarray, u: np.ndarray):
+    """Add the bilinear interpolation of the coarse correction `e` to `u`.
+
+    A fine point gets 9/16 of its coarse point, 3/16 of the two nearest
+    neighbours of that and 1/16 of the diagonal one, so the ghost cells
+    of `e` (corners included) must be filled.
+    """
+    ui = u[1:-1, 1:-1]
+    nc, mc = e.shape[0] - 2, e.shape[1] - 2
+    for di in (0, 1):
+        for dj in (0, 1):
+            target = ui[di:2 * nc:2, dj:2 * mc:2]
+            # coarse point and its nearest neighbours, in `e` indices
+            ci, cj = slice(1, 1 + nc), slice(1, 1 + mc)
+            ni = slice(2 * di, 2 * di + nc)
+            nj = slice(2 * dj, 2 * dj + mc)
+            target += 0.5625 * e[ci, cj]
+            target += 0.1875 * (e[ni, cj] + e[ci, nj])
+            target += 0.0625 * e[ni, nj]
+    # last row/column of odd sizes
+    if ui.shape[0] % 2:
+        _interpolate(0.5 * (e[nc] + e[nc + 1]), ui[-1])
+    if ui.shape[1] % 2:
+        _interpolate(0.5 * (e[:, mc] + e[:, mc + 1]), ui[:, -1])
+
+
+@dataclass
+class Level:
+    """A grid of the hierarchy, `spacing` is in points of the finest grid."""
+    dec: Decomposition
+    spacing: int
+    bounds: Bounds
+    exchange: HaloExchange
+    u: np.ndarray
+    # right-hand side, None (zero) on the finest level
+    f: np.ndarray | None = field(init=False)
+    # the residual, also the work array of the smoothers
+    r: np.ndarray = field(init=False)
+    # the second buffer of the Jacobi smoother
+    unew: np.ndarray | None = field(init=False, default=None)
+    parity: int = field(init=False)
+
+    def __post_init__(self):
+        dec = self.dec
+        self.u = self.exchange.allocate(self.u)
+        self.f = np.zeros(dec.shape) if self.spacing > 1 else None
+        self.r = np.zeros(dec.shape)
+        self.parity = (dec.x0 + dec.y0) % 2
+
+    def fill_ghosts(self, u: np.ndarray):
+        """Halo exchange, and the boundary condition of a correction.
+
+        The correction is zero at distance ``d`` (`bounds`) of the
+        outermost point, and the ghost cell is `spacing` away from it.
+        The finest level keeps the boundary values instead.
+        """
+        dec = self.dec
+        self.exchange.exchange(u)
+        if self.spacing == 1:
+            return
+        north, south, west, east = [(d - self.spacing) / d for d in self.bounds]
+        if dec.north == MPI.PROC_NULL:
+            u[0, 1:-1] = north * u[1, 1:-1]
+        if dec.south == MPI.PROC_NULL:
+            u[-1, 1:-1] = south * u[-2, 1:-1]
+        if dec.west == MPI.PROC_NULL:
+            u[1:-1, 0] = west * u[1:-1, 1]
+        if dec.east == MPI.PROC_NULL:
+            u[1:-1, -1] = east * u[1:-1, -2]
+
+    def fill_corners(self, u: np.ndarray):
+        """Extrapolate the corner ghost cells (only used by `prolongate`)"""
+        for i, di in ((0, 1), (-1, -1)):
+            for j, dj in ((0, 1), (-1, -1)):
+                u[i, j] = u[i, j + dj] + u[i + di, j] - u[i + di, j + dj]
+
+    def smooth(self, smoother: str, sweeps: int):
+        for _ in range(sweeps):
+            if smoother == "jacobi":
+                if self.unew is None:
+                    self.unew = self.exchange.allocate(self.u.copy())
+                self.fill_ghosts(self.u)
+                jacobi_sweep(self.u, self.unew, f=self.f, omega=JACOBI_OMEGA)
+                self.u, self.unew = self.unew, self.u
+            else:
+                for colour in (0, 1):
+                    self.fill_ghosts(self.u)
+                    redblack_sweep(self.u, colour, self.parity, work=self.r, f=self.f)
+
+    def residual(self):
+        self.fill_ghosts(self.u)
+        residual(self.u, self.r, self.f)
+
+
+class Agglomeration:
+    """Solves the coarse problem of a level on rank 0 only.
+
+    The ranks are split with `MPI.Comm.Split` into a communicator holding
+    rank 0, which builds a `Multigrid` of the coarser levels on it, and
+    `MPI.COMM_NULL` for the others.
+    """
+
+    def __init__(self, level: Level, smoother: str, pre: int, post: int):
+        dec = level.dec
+        comm = dec.comm
+        self.level = level
+        self.comm = comm
+        self.root = comm.Get_rank() == 0
+        # blocks of all ranks, for gathering/scattering the interiors
+        self.blocks = comm.gather((dec.x0, dec.lnx, dec.y0, dec.lny))
+        self.sendbuf = np.empty(dec.lnx * dec.lny)
+
+        self.subcomm = comm.Split(0 if self.root else MPI.UNDEFINED)
+        self.coarse = None
+        if self.root:
+            counts = [lnx * lny for _, lnx, _, lny in self.blocks]
+            self.counts = (counts, np.cumsum([0] + counts[:-1]))
+            self.recvbuf = np.empty(sum(counts))
+            # the whole grid of `level`, and its coarse grid
+            self.whole = np.zeros((dec.nx + 2, dec.ny + 2))
+            subdec = coarsen(decompose(self.subcomm, dec.nx, dec.ny))
+            self.coarse = Multigrid(subdec, np.zeros(subdec.shape), "blocking", "auto",
+                                    smoother, pre, post, 2 * level.spacing,
+                                    coarsen_bounds(dec, level.spacing, level.bounds))
+
+    def correct(self):
+        """Add the coarse grid correction of the residual to ``level.u``"""
+        level = self.level
+        self.sendbuf[:] = level.r[1:-1, 1:-1].ravel()
+        recv = [self.recvbuf, self.counts, MPI.DOUBLE] if self.root else None
+        self.comm.Gatherv(self.sendbuf, recv, root=0)
+
+        if self.root:
+            whole = self.whole
+            for (x0, lnx, y0, lny), offset in zip(self.blocks, self.counts[1]):
+                whole[1 + x0:1 + x0 + lnx, 1 + y0:1 + y0 + lny] = \
+                    self.recvbuf[offset:offset + lnx * lny].reshape(lnx, lny)
+            top = self.coarse.levels[0]
+            restrict(whole, top.f)
+            top.u[...] = 0.0
+            self.coarse.cycle()
+            top.fill_ghosts(top.u)
+            top.fill_corners(top.u)
+            whole[...] = 0.0
+            prolongate(top.u, whole)
+            for (x0, lnx, y0, lny), offset in zip(self.blocks, self.counts[1]):
+                self.recvbuf[offset:offset + lnx * lny] = \
+                    whole[1 + x0:1 + x0 + lnx, 1 + y0:1 + y0 + lny].ravel()
+
+        self.comm.Scatterv(recv, self.sendbuf, root=0)
+        level.u[1:-1, 1:-1] += self.sendbuf.reshape(level.dec.lnx, level.dec.lny)
+
+    def free(self):
+        if self.coarse is not None:
+            self.coarse.free()
+            self.coarse.levels[0].dec.comm.Free()
+        if self.subcomm != MPI.COMM_NULL:
+            self.subcomm.Free()
+
+
+class Multigrid:
+    """V-cycle on the hierarchy below `dec`, solving for `u`.
+
+    `u` is the solution (with the boundary values in its ghost cells) on
+    the finest level, `spacing` and `bounds` describe the grid of `dec`
+    in finest grid points. `pre`/`post` smoothing sweeps are done on every
+    level.
+    """
+
+    def __init__(self, dec: Decomposition, u: np.ndarray, halo: str = "blocking",
+                 columns: str = "auto", smoother: str = "redblack", pre: int = 2, post: int = 2, spacing: int = 1,
+                 bounds: Bounds = (1.0, 1.0, 1.0, 1.0)):
+        if smoother not in SMOOTHERS:
+            raise ValueError(f"Unknown smoother: {smoother}")
+        self.smoother = smoother
+        self.pre = pre
+        self.post = post
+        self.agglomeration = None
+
+        comm = dec.comm
+        self.levels = [Level(dec, spacing, bounds, HALO_EXCHANGES[halo](dec, columns), u)]
+        while min(dec.nx, dec.ny) >= MIN_COARSEN:
+            if comm.Get_size() > 1:
+                # all ranks have to agree
+                ok = (dec.x0 % 2 == 0 and dec.y0 % 2 == 0
+                      and min(dec.lnx, dec.lny) >= 2 * MIN_LOCAL)
+                if not comm.allreduce(ok, op=MPI.LAND):
+                    self.agglomeration = Agglomeration(self.levels[-1], smoother, pre, post)
+                    break
+            bounds = coarsen_bounds(dec, spacing, bounds)
+            dec = coarsen(dec)
+            spacing *= 2
+            self.levels.append(Level(dec, spacing, bounds, HALO_EXCHANGES[halo](dec, columns),
+                                     np.zeros(dec.shape)))
+
+    @property
+    def u(self) -> np.ndarray:
+        """The solution on the finest level"""
+        return self.levels[0].u
+
+    def cycle(self, index: int = 0):
+        """One V-cycle from level `index` down"""
+        level = self.levels[index]
+        last = index == len(self.levels) - 1
+        if last and self.agglomeration is None:
+            level.smooth(self.smoother, COARSEST_SWEEPS)
+            return
+
+        level.smooth(self.smoother, self.pre)
+        level.residual()
+        if last:
+            self.agglomeration.correct()
+        else:
+            coarse = self.levels[index + 1]
+            restrict(level.r, coarse.f)
+            coarse.u[...] = 0.0
+            self.cycle(index + 1)
+            coarse.fill_ghosts(coarse.u)
+            coarse.fill_corners(coarse.u)
+            prolongate(coarse.u, level.u)
+        level.smooth(self.smoother, self.post)
+
+    def free(self):
+        for level in self.levels:
+            level.exchange.free()
+        if self.agglomeration is not None:
+            self.agglomeration.free()
+
+
+def solve_multigrid(dec: Decomposition, max_iter: int = MAX_ITERATIONS,
+                    report_period: int = REPORT_NORM_PERIOD, halo: str = "blocking",
+                    columns: str = "auto", smoother: str = "redblack", pre: int = 2, post: int = 2,
+                    hierarchical: bool = False, verbose: bool = True) -> Result:
+    """V-cycles until the same convergence criterion as `solve`.
+
+    Use a decomposition with the `alignment` of the rank count, otherwise
+    the grid is agglomerated on rank 0 right away. With `hierarchical`,
+    the residual is summed node by node, as in `solve`.
+    """
+    comm = dec.comm
+    report = verbose and comm.Get_rank() == 0
+
+    mg = Multigrid(dec, initialise(dec), halo, columns, smoother, pre, post)
+    finest = mg.levels[0]
+    work = finest.r
+
+    reducer = HierarchicalComm(comm) if hierarchical else comm
+
+    def allreduce(value: float) -> float:
+        return reducer.allreduce(value, op=MPI.SUM)
+
+    bnorm = sqrt(allreduce(residual_sq(mg.u, work)))
+
+    norm = 1.0
+    start_time = MPI.Wtime()
+    for k in range(max_iter):
+        finest.exchange.exchange(mg.u)
+        norm = sqrt(allreduce(residual_sq(mg.u, work))) / bnorm
+        if norm < CONVERGENCE_ACCURACY:
+            break
+        mg.cycle()
+
+        if k % report_period == 0 and report:
+            print(f"Iteration= {k} Relative Norm={norm:e}")
+    else:
+        k = max_iter
+
+    elapsed = MPI.Wtime() - start_time
+    mg.free()
+    if hierarchical:
+        reducer.free()
+    return Result(k, norm, elapsed)
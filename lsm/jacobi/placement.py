@@ -0,0 +1,175 @@
+"""Placement of the blocks of the decomposition on the nodes and sockets.
+
+`decompose` numbers the blocks by rank, wherever ``mpirun`` put the ranks
+(``--map-by``), so neighbouring slabs may be on different sockets or
+nodes, as ``jacobi_twonodes_{compact,spread}.sub`` show. `locate` finds
+the node (``Split_type(COMM_TYPE_SHARED)``, named by
+``Get_processor_name``) and the socket (``COMM_TYPE_HW_GUIDED`` package,
+the whole node if the MPI library can't tell) of every rank, and the
+placements (`PLACEMENTS`) order the ranks before `decompose`:
+
+``rank``
+    the blocks in rank order, as the C code.
+``cart``
+    ``Create_cart(reorder=True)``, MPI may renumber the ranks (``--reorder``).
+``node``
+    the ranks sorted by node, socket and rank: consecutive blocks (in
+    row-major order of the process grid) share a socket, and a 1D layout
+    has a single boundary between two nodes.
+``graph``
+    ``Create_dist_graph_adjacent`` of the Cartesian neighbours, weighted by
+    the halo bytes, with ``reorder=True``: the MPI library maps the graph.
+
+`halo_bytes` splits the halo bytes of an iteration into intra-socket,
+intra-node and inter-node ones, `compare` prints them for all placements::
+
+    mpirun -np 8 --map-by ppr:2:package python -m lsm.jacobi 8000 8000 --compare-placement
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+from mpi4py import MPI
+
+from .decomp import Decomposition, decompose, layout_dims, split
+
+PLACEMENTS = ("rank", "cart", "node", "graph")
+
+# Where the halo messages go, see `halo_bytes`: within a socket, between
+# the sockets of a node, between nodes
+LINKS = ("socket", "node", "network")
+
+
+@dataclass
+class Locations:
+    """The node and socket of every rank of a communicator, by rank."""
+    names: list[str]
+    node: list[int]
+    socket: list[int]
+
+    def link(self, a: int, b: int) -> str:
+        """Which of `LINKS` the messages between ranks `a` and `b` go over"""
+        if self.node[a] != self.node[b]:
+            return "network"
+        if self.socket[a] != self.socket[b]:
+            return "node"
+        return "socket"
+
+
+def _split_socket(node: MPI.Intracomm) -> MPI.Intracomm:
+    """The ranks of the socket within `node`, all of `node` if unknown"""
+    info = MPI.Info.Create({"mpi_hw_resource_type": "Package"})
+    try:
+        socket = node.Split_type(MPI.COMM_TYPE_HW_GUIDED, key=node.Get_rank(), info=info)
+    except MPI.Exception:
+        socket = MPI.COMM_NULL
+    finally:
+        info.Free()
+    if socket == MPI.COMM_NULL:
+        socket = node.Dup()
+    return socket
+
+
+def locate(comm: MPI.Intracomm) -> Locations:
+    """The nodes and sockets of the ranks of `comm` (collective)"""
+    rank = comm.Get_rank()
+    node = comm.Split_type(MPI.COMM_TYPE_SHARED, key=rank)
+    socket = _split_socket(node)
+    # a node and a socket are identified by their lowest rank
+    ids = comm.allgather((MPI.Get_processor_name(),
+                          node.allreduce(rank, op=MPI.MIN),
+                          socket.allreduce(rank, op=MPI.MIN)))
+    socket.Free()
+    node.Free()
+
+    nodes: dict[int, int] = {}
+    sockets: dict[int, int] = {}
+    for _, n, s in ids:
+        nodes.setdefault(n, len(nodes))
+        sockets.setdefault(s, len(sockets))
+    return Locations([name for name, _, _ in ids],
+                     [nodes[n] for _, n, _ in ids],
+                     [sockets[s] for _, _, s in ids])
+
+
+def _neighbours(dims, index: int, nx: int, ny: int, align: int) -> dict[int, int]:
+    """Halo bytes of block `index` (row-major) to each of its neighbours"""
+    cx, cy = divmod(index, dims[1])
+    lnx = split(nx, dims[0], cx, align)[1]
+    lny = split(ny, dims[1], cy, align)[1]
+    itemsize = MPI.DOUBLE.Get_size()
+    weights = {}
+    for dx, dy, count in ((-1, 0, lny), (1, 0, lny), (0, -1, lnx), (0, 1, lnx)):
+        x, y = cx + dx, cy + dy
+        if 0 <= x < dims[0] and 0 <= y < dims[1]:
+            weights[x * dims[1] + y] = count * itemsize
+    return weights
+
+
+def order(comm: MPI.Intracomm, placement: str, nx: int, ny: int, layout: str = "1d",
+          align: int = 1, dims: tuple[int, int] | None = None) -> int:
+    """The position of this rank in the block order of `placement`"""
+    rank = comm.Get_rank()
+    if placement in ("rank", "cart"):
+        return rank
+    if placement == "node":
+        where = locate(comm)
+        ranks = sorted(range(comm.Get_size()), key=lambda r: (where.node[r], where.socket[r], r))
+        return ranks.index(rank)
+    if placement == "graph":
+        dims = list(dims) if dims is not None else layout_dims(comm.Get_size(), layout)
+        weights = _neighbours(dims, rank, nx, ny, align)
+        peers = list(weights)
+        counts = [weights[peer] for peer in peers]
+        graph = comm.Create_dist_graph_adjacent(peers, peers, counts, counts, reorder=True)
+        position = graph.Get_rank()
+        graph.Free()
+        return position
+    raise ValueError(f"Unknown placement: {placement}")
+
+
+def decompose_placed(comm: MPI.Intracomm, nx: int, ny: int, layout: str = "1d",
+                     placement: str = "rank", align: int = 1,
+                     dims: tuple[int, int] | None = None) -> Decomposition:
+    """`decompose` with the ranks of `comm` ordered by `placement`"""
+    key = order(comm, placement, nx, ny, layout, align, dims)
+    ordered = comm.Split(0, key)
+    dec = decompose(ordered, nx, ny, layout, reorder=placement == "cart", align=align,
+                    dims=dims)
+    ordered.Free()
+    return dec
+
+
+def halo_bytes(dec: Decomposition, where: Locations | None = None) -> dict[str, int]:
+    """Bytes sent by all ranks in one halo exchange, by `LINKS` (collective)"""
+    if where is None:
+        where = locate(dec.comm)
+    itemsize = MPI.DOUBLE.Get_size()
+    sent = dict.fromkeys(LINKS, 0)
+    for side, count in (("north", dec.lny), ("south", dec.lny),
+                        ("west", dec.lnx), ("east", dec.lnx)):
+        peer = getattr(dec, side)
+        if peer != MPI.PROC_NULL:
+            sent[where.link(dec.rank, peer)] += count * itemsize
+    return {link: dec.comm.allreduce(sent[link], op=MPI.SUM) for link in LINKS}
+
+
+def compare(comm: MPI.Intracomm, nx: int, ny: int, layout: str = "1d", align: int = 1,
+            verbose: bool = True) -> dict[str, dict[str, int]]:
+    """`halo_bytes` of all `PLACEMENTS`"""
+    results = {}
+    for placement in PLACEMENTS:
+        dec = decompose_placed(comm, nx, ny, layout, placement, align)
+        results[placement] = halo_bytes(dec)
+        dec.comm.Free()
+
+    where = locate(comm)
+    if verbose and comm.Get_rank() == 0:
+        print(f"# {comm.Get_size()} ranks on {max(where.node) + 1} nodes "
+              f"({', '.join(dict.fromkeys(where.names))}), {max(where.socket) + 1} sockets")
+        print(f"#{'placement':>9s}{'intra-socket':>14s}{'intra-node':>14s}{'inter-node':>14s}"
+              "  [bytes/iteration]")
+        for placement, sent in results.items():
+            print(f"{placement:>10s}" + "".join(f"{sent[link]:14d}" for link in LINKS))
+    return results
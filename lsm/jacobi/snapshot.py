@@ -0,0 +1,201 @@
+"""Downsampled snapshots of the distributed grid.
+
+Gathering the whole grid on rank 0 doesn't scale (an 80000² grid is 51 GB
+of doubles), so a snapshot is a coarse image of the interior: every
+`factor`-th point (``stride``) or the means of ``factor x factor`` blocks
+(``mean``), ``ceil(nx / factor) x ceil(ny / factor)`` points. Every rank
+reduces its own block with NumPy (`coarsen`), then the image is either
+
+``gatherv``
+    assembled on rank 0 with ``Gatherv`` (blocks straddling two ranks are
+    summed there) and saved by rank 0, or
+``mpiio``
+    written by all ranks into one file with `checkpoint.write_array`. The
+    ``mean`` blocks must then not straddle ranks: decompose with
+    ``align=factor``.
+
+Either way, the file is a ``.npy`` file of doubles that NumPy maps without
+reading it: ``np.load(path, mmap_mode="r")``.
+"""
+
+from __future__ import annotations
+
+import io
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from mpi4py import MPI
+
+from .checkpoint import BlockWrite, temporary, write_array
+from .decomp import Decomposition
+from .writer import AsyncWriter
+
+MODES = ("stride", "mean")
+WRITERS = ("gatherv", "mpiio")
+
+
+def coarse_size(n: int, factor: int) -> int:
+    """Number of coarse points of `n` points"""
+    return -(-n // factor)
+
+
+def _axis(start: int, count: int, factor: int, mode: str):
+    """``(coarse start, index)`` of the local points ``start .. start + count``
+    of an axis: the sampled local points for ``stride``, the first local
+    point of each block for ``mean`` (``np.add.reduceat``)"""
+    first = (-start) % factor
+    if mode == "stride":
+        return (start + first) // factor, np.arange(first, count, factor)
+    cuts = np.arange(first, count, factor)
+    if first:
+        cuts = np.concatenate(([0], cuts))
+    return start // factor, cuts
+
+
+def coarsen(dec: Decomposition, u: np.ndarray, factor: int, mode: str = "mean"):
+    """``(start, block)`` of the coarse image from the local grid `u`.
+
+    For ``mean``, `block` holds the sums of the local points of each
+    coarse block, which may be partial at the edges of the local block,
+    see `block_sizes`.
+    """
+    x, rows = _axis(dec.x0, dec.lnx, factor, mode)
+    y, cols = _axis(dec.y0, dec.lny, factor, mode)
+    interior = u[1:-1, 1:-1]
+    if mode == "stride":
+        block = interior[np.ix_(rows, cols)]
+    elif mode == "mean":
+        block = np.empty((len(rows), len(cols)))
+        if block.size:
+            block = np.add.reduceat(np.add.reduceat(interior, rows, axis=0), cols, axis=1)
+    else:
+        raise ValueError(f"Unknown snapshot mode: {mode}")
+    return (x, y), block
+
+
+def block_sizes(n: int, factor: int) -> np.ndarray:
+    """Number of points of each coarse block of an axis of `n` points"""
+    return np.minimum(factor, n - factor * np.arange(coarse_size(n, factor)))
+
+
+def npy_header(shape, dtype=np.float64) -> bytes:
+    """The ``.npy`` header of a C-ordered array, its size a multiple of 64"""
+    f = io.BytesIO()
+    np.lib.format.write_array_header_1_0(
+        f, {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+            "fortran_order": False, "shape": tuple(shape)})
+    return f.getvalue()
+
+
+def gather_snapshot(dec: Decomposition, u: np.ndarray, factor: int,
+                    mode: str = "mean") -> np.ndarray | None:
+    """The coarse image on rank 0 (``Gatherv``), None elsewhere"""
+    comm = dec.comm
+    start, block = coarsen(dec, u, factor, mode)
+    block = np.ascontiguousarray(block)
+    layout = comm.gather((start, block.shape), root=0)
+    recv = None
+    if comm.Get_rank() == 0:
+        counts = [shape[0] * shape[1] for _, shape in layout]
+        recv = (np.empty(sum(counts)), counts)
+    comm.Gatherv(block, recv, root=0)
+    if comm.Get_rank() != 0:
+        return None
+
+    image = np.zeros((coarse_size(dec.nx, factor), coarse_size(dec.ny, factor)))
+    offset = 0
+    for ((x, y), (n, m)), count in zip(layout, recv[1]):
+        image[x:x + n, y:y + m] += recv[0][offset:offset + count].reshape(n, m)
+        offset += count
+    if mode == "mean":
+        image /= np.outer(block_sizes(dec.nx, factor), block_sizes(dec.ny, factor))
+    return image
+
+
+def write_snapshot(path, dec: Decomposition, u: np.ndarray, factor: int,
+                   mode: str = "mean", writer: str = "gatherv"):
+    """Write the coarse image of the grid to the ``.npy`` file `path` (collective)"""
+    if writer == "gatherv":
+        image = gather_snapshot(dec, u, factor, mode)
+        if image is not None:
+            tmp = temporary(path)
+            with open(tmp, "wb") as f:
+                np.lib.format.write_array(f, image)
+            os.replace(tmp, path)
+        return
+    if writer != "mpiio":
+        raise ValueError(f"Unknown snapshot writer: {writer}")
+    w = snapshot_block(dec, u, factor, mode)
+    write_array(path, dec.comm, w.shape, w.start, w.block, w.header, w.offset)
+
+
+def snapshot_block(dec: Decomposition, u: np.ndarray, factor: int,
+                   mode: str = "mean") -> BlockWrite:
+    """The part of this rank of the ``mpiio`` snapshot of the local grid `u`"""
+    if mode == "mean":
+        aligned = (dec.x0 % factor == 0 and dec.y0 % factor == 0
+                   and (dec.x0 + dec.lnx == dec.nx or dec.lnx % factor == 0)
+                   and (dec.y0 + dec.lny == dec.ny or dec.lny % factor == 0))
+        if not dec.comm.allreduce(aligned, op=MPI.LAND):
+            raise ValueError("mean snapshots through MPI-IO need blocks aligned "
+                             f"to the factor {factor}")
+    start, block = coarsen(dec, u, factor, mode)
+    if mode == "mean" and block.size:
+        x, y = start
+        n, m = block.shape
+        block /= np.outer(block_sizes(dec.nx, factor)[x:x + n],
+                          block_sizes(dec.ny, factor)[y:y + m])
+    shape = (coarse_size(dec.nx, factor), coarse_size(dec.ny, factor))
+    header = npy_header(shape)
+    return BlockWrite(shape, start, block, header, len(header))
+
+
+@dataclass
+class Snapshots:
+    """Snapshots of `solve`, every `every` iterations, to `pattern`.
+
+    `pattern` is formatted with the iteration (``"snap_{iteration:06d}.npy"``),
+    without a ``{}`` field the iteration is appended to the file name.
+    """
+    pattern: str
+    every: int = 1000
+    factor: int = 8
+    mode: str = "mean"
+    writer: str = "gatherv"
+    verbose: bool = True
+
+    def __post_init__(self):
+        if self.every < 1 or self.factor < 1:
+            raise ValueError("the snapshot period and factor must be at least 1")
+        if self.mode not in MODES:
+            raise ValueError(f"Unknown snapshot mode: {self.mode}")
+        if self.writer not in WRITERS:
+            raise ValueError(f"Unknown snapshot writer: {self.writer}")
+
+    def path(self, iteration: int) -> str:
+        if "{" in self.pattern:
+            return self.pattern.format(iteration=iteration)
+        path = Path(self.pattern)
+        return str(path.with_name(f"{path.stem}_{iteration:06d}{path.suffix or '.npy'}"))
+
+    def block_size(self, dec: Decomposition) -> int:
+        """Points of the coarse block of the local grid of `dec`"""
+        rows = _axis(dec.x0, dec.lnx, self.factor, self.mode)[1]
+        cols = _axis(dec.y0, dec.lny, self.factor, self.mode)[1]
+        return len(rows) * len(cols)
+
+    def write(self, dec: Decomposition, u: np.ndarray, iteration: int,
+              writer: AsyncWriter | None = None):
+        """Write the snapshot of `iteration` (collective), ``mpiio`` ones
+        through `writer` if given"""
+        t0 = MPI.Wtime()
+        path = self.path(iteration)
+        if writer is not None and self.writer == "mpiio":
+            writer.submit(path, snapshot_block(dec, u, self.factor, self.mode))
+        else:
+            write_snapshot(path, dec, u, self.factor, self.mode, self.writer)
+        if self.verbose and dec.comm.Get_rank() == 0:
+            print(f"# snapshot {path} ({self.mode}/{self.factor}, {self.writer}) "
+                  f"in {MPI.Wtime() - t0:.3e} s")
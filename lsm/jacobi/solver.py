@@ -0,0 +1,326 @@
+"""Jacobi iteration for the Laplace problem of ``w02/labs/Jacobi``.
+
+Same boundary conditions, convergence criterion and output as
+``jacobi-mpi-block.c``: iterate until the residual norm, relative to the
+norm of the initial residual (``bnorm``), drops below
+`CONVERGENCE_ACCURACY`.
+"""
+
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from math import pi, sin, sqrt
+
+import numpy as np
+from mpi4py import MPI
+
+from ..hierarchical import HierarchicalComm
+from .checkpoint import checkpoint_block, read_checkpoint, write_checkpoint
+from .decomp import Decomposition
+from .halo import HALO_EXCHANGES
+from .kernels import (interior, jacobi_sweep, jacobi_sweep_residual, redblack_sweep,
+                      residual_sq, split_boxes, tile_boxes)
+from .snapshot import Snapshots
+from .writer import AsyncWriter
+
+# Boundary values
+TOP = 1.0
+BOTTOM = 10.0
+LEFT = 1.0
+RIGHT = 1.0
+
+# The maximum number of iterations
+MAX_ITERATIONS = 5000000
+# The convergence to terminate at
+CONVERGENCE_ACCURACY = 1e-4
+# How often to report the norm
+REPORT_NORM_PERIOD = 1000
+
+
+@dataclass
+class Result:
+    iterations: int
+    norm: float
+    time: float
+    # bytes moved through memory/network per iteration (see `traffic`)
+    traffic: dict[str, float] | None = None
+
+
+def initialise(dec: Decomposition) -> np.ndarray:
+    """Local grid with the boundary conditions on the global boundary,
+    all other points (and ghost cells) are zero."""
+    u = np.zeros(dec.shape)
+    if dec.west == MPI.PROC_NULL:
+        u[:, 0] = LEFT
+    if dec.east == MPI.PROC_NULL:
+        u[:, -1] = RIGHT
+    if dec.north == MPI.PROC_NULL:
+        u[0, :] = TOP
+    if dec.south == MPI.PROC_NULL:
+        u[-1, :] = BOTTOM
+    return u
+
+
+def solve(dec: Decomposition, max_iter: int = MAX_ITERATIONS,
+          report_period: int = REPORT_NORM_PERIOD, halo: str = "blocking",
+          columns: str = "auto", overlap: bool = False, copy: bool = False, fused: bool = False,
+          check_every: int | None = None, tile: tuple[int, int] | None = None,
+          hierarchical: bool = False, checkpoint: str | None = None,
+          checkpoint_every: int = 0, restart: bool = False,
+          snapshots: Snapshots | None = None, writer: AsyncWriter | None = None,
+          verbose: bool = True) -> Result:
+    """Run the Jacobi iteration on the local block of `dec`.
+
+    With `overlap`, the halo exchange is started, the points which don't
+    depend on ghost cells are updated, and only then the exchange is
+    completed and the edges are updated. Use it with a non-blocking
+    `halo` exchange. The update is then done before the convergence check,
+    the last one is simply discarded. `columns` is the strategy of the
+    column messages of 2D layouts (`lsm.jacobi.columns`).
+
+    With `fused`, the residual is computed in the same sweep as the update
+    (`jacobi_sweep_residual`), again discarding the last update.
+
+    `check_every` (implies `fused`) checks the convergence only every
+    `check_every` iterations, with an `Iallreduce` of the residual which is
+    completed `check_every` iterations later, overlapped with the sweeps
+    in between. The iteration stops up to `check_every` iterations after
+    convergence, and the returned norm is the one of the last check.
+
+    `tile` ``(rows, cols)`` runs the kernels tile by tile on blocked views
+    of the grid, see `tile_boxes`.
+
+    With `hierarchical`, the residual is summed on each node first, then
+    by the node leaders (`lsm.hierarchical.HierarchicalComm`). The
+    `Iallreduce` of `check_every` is always flat.
+
+    With `checkpoint` (a file name), the grid is written every
+    `checkpoint_every` iterations and when `max_iter` is reached without
+    converging (`lsm.jacobi.checkpoint`). With `restart`, the iteration
+    continues from that file if it exists, on any number of ranks.
+    `snapshots` writes downsampled images of the grid every
+    `Snapshots.every` iterations and at the end (`lsm.jacobi.snapshot`).
+    With a `writer`, the checkpoints and the ``mpiio`` snapshots are
+    copied to its staging buffers and written in the background
+    (`lsm.jacobi.writer`); all are complete when `solve` returns.
+
+    The two grids are swapped after each iteration; both hold the boundary
+    values and the ghost cells are refreshed by the exchange. `copy` copies
+    the new grid back instead, as the original C code does.
+    """
+    if check_every is not None and check_every < 1:
+        raise ValueError("check_every must be at least 1")
+    comm = dec.comm
+    report = verbose and comm.Get_rank() == 0
+    fused = fused or check_every is not None
+
+    exchange = HALO_EXCHANGES[halo](dec, columns)
+    u = exchange.allocate(initialise(dec))
+    unew = exchange.allocate(u.copy())
+    work = np.empty((dec.lnx, dec.lny))
+    inner, edges = split_boxes(u.shape)
+    if overlap:
+        # the inner points first, the edges once the ghost cells are there
+        tiles = tile_boxes(inner, tile) if inner is not None else []
+        edges = [t for box in edges for t in tile_boxes(box, tile)]
+    else:
+        tiles = tile_boxes(interior(u.shape), tile)
+
+    reducer = HierarchicalComm(comm) if hierarchical else comm
+
+    def allreduce(value: float) -> float:
+        return reducer.allreduce(value, op=MPI.SUM)
+
+    def update(u, unew, box, check):
+        """Sweep `box`, returns the residual if `check`"""
+        if not check:
+            jacobi_sweep(u, unew, box)
+            return 0.0
+        if fused:
+            return jacobi_sweep_residual(u, unew, work, box)
+        rsq = residual_sq(u, work, box)
+        jacobi_sweep(u, unew, box)
+        return rsq
+
+    bnorm = sqrt(allreduce(residual_sq(u, work)))
+
+    first = 0
+    norm = 1.0
+    if restart and checkpoint and comm.bcast(os.path.exists(checkpoint), root=0):
+        saved = read_checkpoint(checkpoint, dec, u)
+        unew[...] = u
+        first, norm = saved.iteration, saved.norm
+        if report:
+            print(f"Restarting from iteration {first} Relative Norm={norm:e}")
+
+    # in flight Iallreduce of the residual of iteration `checked`
+    rsq_send, rsq_recv = np.zeros(1), np.zeros(1)
+    pending = MPI.REQUEST_NULL
+    checked = 0
+    # iteration of the last snapshot
+    snapped = None
+
+    def save(k: int):
+        if writer is None:
+            write_checkpoint(checkpoint, dec, u, k, norm, bnorm)
+        else:
+            writer.submit(checkpoint, checkpoint_block(dec, u, k, norm, bnorm))
+
+    start_time = MPI.Wtime()
+    for k in range(first, max_iter):
+        if writer is not None:
+            writer.poll()
+        if checkpoint and checkpoint_every and k > first and k % checkpoint_every == 0:
+            save(k)
+        if snapshots is not None and k % snapshots.every == 0:
+            snapshots.write(dec, u, k, writer)
+            snapped = k
+        check = check_every is None or k % check_every == 0
+        if overlap:
+            exchange.start(u)
+            rsq = 0.0
+            for box in tiles:
+                rsq += update(u, unew, box, check)
+            exchange.finish(u)
+            for box in edges:
+                rsq += update(u, unew, box, check)
+        elif fused:
+            exchange.exchange(u)
+            rsq = sum(update(u, unew, box, check) for box in tiles)
+        else:
+            exchange.exchange(u)
+            rsq = sum(residual_sq(u, work, box) for box in tiles)
+
+        if check_every is None:
+            norm = sqrt(allreduce(rsq)) / bnorm
+            if norm < CONVERGENCE_ACCURACY:
+                break
+            if k % report_period == 0 and report:
+                print(f"Iteration= {k} Relative Norm={norm:e}")
+        elif check:
+            if pending:
+                pending.Wait()
+                norm = sqrt(rsq_recv[0]) / bnorm
+                if norm < CONVERGENCE_ACCURACY:
+                    break
+                if checked % report_period < check_every and report:
+                    print(f"Iteration= {checked} Relative Norm={norm:e}")
+            rsq_send[0] = rsq
+            pending = comm.Iallreduce(rsq_send, rsq_recv, op=MPI.SUM)
+            checked = k
+
+        if not (overlap or fused):
+            for box in tiles:
+                jacobi_sweep(u, unew, box)
+        if copy:
+            u[...] = unew
+        else:
+            u, unew = unew, u
+    else:
+        k = max_iter
+        if pending:
+            pending.Wait()
+            norm = sqrt(rsq_recv[0]) / bnorm
+        if checkpoint and k > first:
+            save(k)
+    if snapshots is not None and snapped != k:
+        snapshots.write(dec, u, k, writer)
+    if writer is not None:
+        writer.flush()
+
+    elapsed = MPI.Wtime() - start_time
+    exchange.free()
+    if hierarchical:
+        reducer.free()
+    return Result(k, norm, elapsed, traffic(dec, copy, fused))
+
+
+def optimal_omega(nx: int, ny: int) -> float:
+    """SOR relaxation factor of the model problem on an ``nx x ny`` grid,
+    ``2 / (1 + sin(pi h))`` with the spacing of the larger dimension."""
+    return 2.0 / (1.0 + sin(pi / (max(nx, ny) + 1)))
+
+
+def solve_redblack(dec: Decomposition, max_iter: int = MAX_ITERATIONS,
+                   report_period: int = REPORT_NORM_PERIOD, halo: str = "blocking",
+                   columns: str = "auto", omega: float = 1.0, tile: tuple[int, int] | None = None,
+                   hierarchical: bool = False, verbose: bool = True) -> Result:
+    """Red-black Gauss-Seidel (``omega=1``) or SOR iteration on `dec`.
+
+    Same convergence check and output as `solve`: the ghost cells are
+    exchanged and the residual is checked, then the red points are
+    updated in place, the ghost cells exchanged again, and the black
+    points are updated. There is one halo exchange per colour.
+    `hierarchical` as for `solve`.
+    """
+    comm = dec.comm
+    report = verbose and comm.Get_rank() == 0
+
+    exchange = HALO_EXCHANGES[halo](dec, columns)
+    u = exchange.allocate(initialise(dec))
+    work = np.empty((dec.lnx, dec.lny))
+    tiles = tile_boxes(interior(u.shape), tile)
+    # colour of the points by their global index
+    parity = (dec.x0 + dec.y0) % 2
+
+    reducer = HierarchicalComm(comm) if hierarchical else comm
+
+    def allreduce(value: float) -> float:
+        return reducer.allreduce(value, op=MPI.SUM)
+
+    bnorm = sqrt(allreduce(residual_sq(u, work)))
+
+    norm = 1.0
+    start_time = MPI.Wtime()
+    for k in range(max_iter):
+        exchange.exchange(u)
+        rsq = sum(residual_sq(u, work, box) for box in tiles)
+        norm = sqrt(allreduce(rsq)) / bnorm
+        if norm < CONVERGENCE_ACCURACY:
+            break
+
+        for colour in (0, 1):
+            if colour:
+                exchange.exchange(u)
+            for box in tiles:
+                redblack_sweep(u, colour, parity, omega, work, box)
+
+        if k % report_period == 0 and report:
+            print(f"Iteration= {k} Relative Norm={norm:e}")
+    else:
+        k = max_iter
+
+    elapsed = MPI.Wtime() - start_time
+    exchange.free()
+    if hierarchical:
+        reducer.free()
+    # the residual, then a read and write of the grid and an exchange per colour
+    t = traffic(dec)
+    t["sweep"] *= 5.0 / 3.0
+    t["halo"] *= 2.0
+    t["total"] = t["sweep"] + t["copy"] + t["halo"]
+    return Result(k, norm, elapsed, t)
+
+
+def traffic(dec: Decomposition, copy: bool = False,
+            fused: bool = False) -> dict[str, float]:
+    """Bytes moved per iteration by this rank.
+
+    The same model as ``report_traffic`` in the C code: the residual sweep
+    reads the grid (unless `fused` with the update), the update reads it
+    and writes the new one, copying
+    back reads and writes the whole local grid once more. ``halo`` is the
+    number of bytes sent to the neighbours.
+    """
+    itemsize = np.dtype(np.float64).itemsize
+    grid = itemsize * dec.lnx * dec.lny
+    rows = sum(n != MPI.PROC_NULL for n in (dec.north, dec.south))
+    cols = sum(n != MPI.PROC_NULL for n in (dec.west, dec.east))
+    ret = {
+        "sweep": (2.0 if fused else 3.0) * grid,
+        "copy": 2.0 * itemsize * dec.shape[0] * dec.shape[1] if copy else 0.0,
+        "halo": float(itemsize * (rows * dec.lny + cols * dec.lnx)),
+    }
+    ret["total"] = sum(ret.values())
+    return ret
@@ -0,0 +1,255 @@
+"""Asynchronous writes of checkpoints and snapshots.
+
+`write_array` blocks every rank until the file system returns. An
+`AsyncWriter` copies the block of a write (`checkpoint.BlockWrite`) into a
+staging buffer of a preallocated pool and returns; the write is drained
+while the next iterations run:
+
+``thread``
+    a writer thread per rank runs `write_array` on a duplicate of the
+    communicator (needs ``MPI.THREAD_MULTIPLE``, the default of mpi4py,
+    see ``mpi4py.rc.thread_level``).
+``request``
+    the file is opened and the write started with ``File.Iwrite_at_all``;
+    `AsyncWriter.poll` (every iteration) tests the requests so that MPI
+    progresses them, and a write is completed (``Wait`` and the collective
+    ``Close``) when its buffer is needed again, or at `flush`.
+``sync``
+    `write_array` right away, to compare with.
+
+There are `depth` staging buffers, so at most `depth` writes are in
+flight: `submit` waits for the oldest one when all are busy
+(back-pressure). The writer reports the time the writes took in the
+background (hidden) and the time the solver was held up copying, starting
+and waiting for them (exposed)::
+
+    writer = AsyncWriter(comm, depth=2, mode="thread")
+    writer.submit(path, checkpoint_block(dec, u, k, norm, bnorm))
+    ...
+    writer.close()
+    print(writer.report())
+"""
+
+from __future__ import annotations
+
+import queue
+import threading
+from collections import deque
+from dataclasses import dataclass, replace
+
+import numpy as np
+from mpi4py import MPI
+
+from ..datatypes import buffer_spec
+from .checkpoint import BlockWrite, open_view, replace as replace_file, temporary, write_array
+
+MODES = ("thread", "request", "sync")
+
+
+
+@dataclass
+class _Pending:
+    """A write started with ``Iwrite_at_all``"""
+    path: str
+    fh: MPI.File
+    filetype: MPI.Datatype
+    request: MPI.Request
+    buffer: np.ndarray
+    started: float
+    done: float | None = None
+
+
+class AsyncWriter:
+    """Writes of `BlockWrite`s drained in the background, see the module
+    documentation. Creating it is collective over `comm`, and all ranks
+    must submit the same sequence of writes.
+
+    Parameters
+    ----------
+    comm :
+        the communicator of the writes, duplicated.
+    depth :
+        number of staging buffers, i.e. writes in flight.
+    capacity :
+        doubles per staging buffer, the largest block that will be
+        written; a larger block reallocates the buffer.
+    mode :
+        one of `MODES`.
+    """
+
+    def __init__(self, comm: MPI.Intracomm, depth: int = 2, capacity: int = 0,
+                 mode: str = "thread"):
+        if mode not in MODES:
+            raise ValueError(f"Unknown writer mode: {mode}")
+        if depth < 1:
+            raise ValueError("the writer needs at least one staging buffer")
+        if mode == "thread" and MPI.Query_thread() < MPI.THREAD_MULTIPLE:
+            raise RuntimeError("the writer thread needs MPI.THREAD_MULTIPLE, "
+                               "set mpi4py.rc.thread_level = 'multiple'")
+        self.parent = comm
+        self.comm = comm.Dup()
+        self.depth = depth
+        self.mode = mode
+        # free staging buffers, touched so that their page faults aren't
+        # timed as copies
+        self.free: queue.Queue[np.ndarray] = queue.Queue()
+        for _ in range(depth):
+            buffer = np.empty(capacity)
+            buffer.fill(0.0)
+            self.free.put(buffer)
+        # statistics (seconds): writes submitted, copying into the staging
+        # buffers, starting writes, waiting for buffers or completions,
+        # writes in progress
+        self.writes = 0
+        self.copy = 0.0
+        self.start = 0.0
+        self.blocked = 0.0
+        self.busy = 0.0
+
+        self.pending: deque[_Pending] = deque()
+        self.error: BaseException | None = None
+        if mode == "thread":
+            self.jobs: queue.Queue = queue.Queue(maxsize=depth)
+            self.thread = threading.Thread(target=self._run, name="lsm-writer", daemon=True)
+            self.thread.start()
+
+    # -------------------------------------------------------------------------
+
+    def _buffer(self) -> np.ndarray:
+        """A free staging buffer, waiting for one if all are in flight"""
+        if self.mode == "request" and self.free.empty():
+            t0 = MPI.Wtime()
+            self._complete()
+            self.blocked += MPI.Wtime() - t0
+        try:
+            return self.free.get_nowait()
+        except queue.Empty:
+            t0 = MPI.Wtime()
+            buffer = self.free.get()
+            self.blocked += MPI.Wtime() - t0
+            return buffer
+
+    def _stage(self, write: BlockWrite) -> tuple[BlockWrite, np.ndarray]:
+        """`write` with its block copied into a staging buffer"""
+        buffer = self._buffer()
+        t0 = MPI.Wtime()
+        if buffer.size < write.block.size:
+            # more than the capacity: allocated and faulted in here, timed
+            buffer = np.empty(write.block.size)
+        staged = buffer[:write.block.size].reshape(write.block.shape)
+        staged[...] = write.block
+        self.copy += MPI.Wtime() - t0
+        return replace(write, block=staged), buffer
+
+    def submit(self, path, write: BlockWrite):
+        """Write `write` to `path` in the background (collective).
+
+        The block is copied, it may change as soon as this returns.
+        """
+        self._check()
+        self.writes += 1
+        if self.mode == "sync":
+            t0 = MPI.Wtime()
+            write_array(path, self.comm, write.shape, write.start, write.block,
+                        write.header, write.offset)
+            self.blocked += MPI.Wtime() - t0
+            return
+        if self.mode == "request":
+            # the temporary file of an earlier write of `path` must be renamed first
+            t0 = MPI.Wtime()
+            while any(p.path == str(path) for p in self.pending):
+                self._complete()
+            self.blocked += MPI.Wtime() - t0
+
+        staged, buffer = self._stage(write)
+        if self.mode == "thread":
+            t0 = MPI.Wtime()
+            self.jobs.put((str(path), staged, buffer))
+            self.blocked += MPI.Wtime() - t0
+        else:
+            t0 = MPI.Wtime()
+            fh, filetype = open_view(self.comm, temporary(path), staged)
+            request = fh.Iwrite_at_all(0, buffer_spec(staged.block))
+            self.pending.append(_Pending(str(path), fh, filetype, request, buffer, t0))
+            self.start += MPI.Wtime() - t0
+
+    def poll(self):
+        """Let MPI progress the writes in flight (``request`` mode), cheap"""
+        for p in self.pending:
+            if p.done is None and p.request.Test():
+                p.done = MPI.Wtime()
+
+    def flush(self):
+        """Wait until all submitted writes are complete (collective)"""
+        t0 = MPI.Wtime()
+        if self.mode == "thread":
+            self.jobs.join()
+        while self.pending:
+            self._complete()
+        self.blocked += MPI.Wtime() - t0
+        self._check()
+
+    def close(self):
+        """`flush`, stop the thread and free the communicator"""
+        self.flush()
+        if self.mode == "thread":
+            self.jobs.put(None)
+            self.thread.join()
+        self.comm.Free()
+
+    # -------------------------------------------------------------------------
+
+    def _complete(self):
+        """Complete the oldest ``Iwrite_at_all`` (collective)"""
+        p = self.pending.popleft()
+        p.request.Wait()
+        done = p.done if p.done is not None else MPI.Wtime()
+        p.fh.Close()
+        p.filetype.Free()
+        replace_file(self.comm, p.path)
+        self.busy += done - p.started
+        self.free.put(p.buffer)
+
+    def _run(self):
+        """The writer thread: `write_array` of the jobs, in order"""
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                return
+            path, write, buffer = job
+            t0 = MPI.Wtime()
+            try:
+                if self.error is None:
+                    write_array(path, self.comm, write.shape, write.start, write.block,
+                                write.header, write.offset)
+            except BaseException as e:  # reported by the solver thread
+                self.error = e
+            self.busy += MPI.Wtime() - t0
+            self.free.put(buffer)
+            self.jobs.task_done()
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError("background write failed") from self.error
+
+    # -------------------------------------------------------------------------
+
+    @property
+    def exposed(self) -> float:
+        """Time the caller spent on the writes"""
+        return self.copy + self.start + self.blocked
+
+    @property
+    def hidden(self) -> float:
+        """Time of the writes in the background, not waited for"""
+        return max(self.busy - self.blocked, 0.0)
+
+    def report(self) -> str:
+        """One line with the times of the slowest rank (collective)"""
+        times = np.array([self.copy, self.start, self.blocked, self.exposed, self.hidden])
+        self.parent.Allreduce(MPI.IN_PLACE, times, op=MPI.MAX)
+        copy, start, blocked, exposed, hidden = times
+        return (f"#io mode={self.mode} depth={self.depth} writes={self.writes} "
+                f"copy={copy:.3e} start={start:.3e} blocked={blocked:.3e} "
+                f"exposed={exposed:.3e} hidden={hidden:.3e} s")
@@ -0,0 +1,13 @@
+"""multiprocessing based communication (week 3 style)."""
+
+from .communicator import Communicator, create_mesh, launch
+from .transport import ShmConnection, create_shm_connections, shm_pipe
+
+__all__ = [
+    "Communicator",
+    "ShmConnection",
+    "create_mesh",
+    "create_shm_connections",
+    "launch",
+    "shm_pipe",
+]
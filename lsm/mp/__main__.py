@@ -0,0 +1,28 @@
+"""Self-check of the `Communicator` collectives: ``python -m lsm.mp [NP]``"""
+import sys
+
+import numpy as np
+
+from .communicator import Communicator, launch
+
+
+def check(comm: Communicator):
+    rank, size = comm.rank, comm.size
+    expected = size * (size - 1) // 2
+    assert comm.bcast(rank + 10 if rank == 2 % size else None, root=2 % size) == 2 % size + 10
+    assert comm.scatter(list(range(size)) if rank == 0 else None) == rank
+    gathered = comm.gather(rank, root=size - 1)
+    assert gathered is None or gathered == list(range(size))
+    reduced = comm.reduce(np.full(4, rank), root=1 % size)
+    assert reduced is None or np.all(reduced == expected)
+    assert comm.allreduce(rank) == expected
+    comm.barrier()
+    return rank
+
+
+if __name__ == "__main__":
+    NP = 5
+    if len(sys.argv) > 1:
+        NP = int(sys.argv[1])
+
+    print(launch(NP, check))
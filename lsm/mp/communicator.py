@@ -0,0 +1,301 @@
+"""MPI-like communicator on top of a mesh of `multiprocessing` pipes.
+
+Instead of wiring ``connections[rank][to_rank]`` by hand in every script,
+`launch` creates the all-to-all mesh, starts the processes and hands a
+`Communicator` to each of them:
+
+>>> def work(comm):
+...     value = comm.allreduce(comm.rank)
+...     return comm.gather(value, root=0)
+>>> launch(4, work)[0]
+[6, 6, 6, 6]
+
+The collectives never loop over all ranks on the root. ``bcast``,
+``scatter``, ``gather`` and ``reduce`` use binomial trees
+(``log2(P)`` rounds), ``allreduce`` uses recursive doubling and
+``barrier`` the dissemination algorithm.
+
+As with MPI, all ranks must call the collectives in the same order.
+Each pair of ranks shares one pipe, which delivers messages in order,
+hence no tags are required.
+"""
+
+from __future__ import annotations
+
+import multiprocessing as mp
+import operator
+import traceback
+from typing import Any, Callable
+
+from .transport import shm_pipe
+
+
+def create_mesh(NP: int, transport: str = "shm", **kwargs):
+    """Create the all-to-all mesh of duplex connections.
+
+    ``mesh[rank][to_rank]`` is the end of the pipe `rank` uses to talk to
+    `to_rank`, ``mesh[rank][rank]`` is None.
+
+    Parameters
+    ----------
+    transport :
+        ``"shm"`` moves numpy arrays through shared memory,
+        ``"pipe"`` pickles everything through `multiprocessing.Pipe`.
+    """
+    if transport == "shm":
+        make_pipe = lambda: shm_pipe(True, **kwargs)
+    elif transport == "pipe":
+        make_pipe = lambda: mp.Pipe(True)
+    else:
+        raise ValueError(f"Unknown transport: {transport}")
+
+    mesh = [[None] * NP for _ in range(NP)]
+    for rank in range(NP):
+        for to_rank in range(rank + 1, NP):
+            c1, c2 = make_pipe()
+            mesh[rank][to_rank] = c1
+            mesh[to_rank][rank] = c2
+    return mesh
+
+
+class Communicator:
+    """Point-to-point and collective communication between `size` ranks.
+
+    Parameters
+    ----------
+    rank :
+        rank of this process.
+    conns :
+        connections to all other ranks, ``conns[rank]`` is unused.
+    """
+
+    def __init__(self, rank: int, conns):
+        self.rank = rank
+        self.size = len(conns)
+        self.conns = conns
+
+    def Get_rank(self) -> int:
+        return self.rank
+
+    def Get_size(self) -> int:
+        return self.size
+
+    # ------------------------------------------------------------------
+    # Point-to-point
+    # ------------------------------------------------------------------
+
+    def send(self, obj, dest: int):
+        self.conns[dest].send(obj)
+
+    def recv(self, source: int):
+        return self.conns[source].recv()
+
+    def sendrecv(self, obj, partner: int):
+        """Exchange `obj` with `partner`.
+
+        The lower rank sends first, so two large messages can't block each
+        other in the pipe.
+        """
+        if self.rank < partner:
+            self.send(obj, partner)
+            return self.recv(partner)
+        ret = self.recv(partner)
+        self.send(obj, partner)
+        return ret
+
+    # ------------------------------------------------------------------
+    # Collectives
+    # ------------------------------------------------------------------
+
+    def _real(self, vrank: int, root: int) -> int:
+        """Convert a rank relative to `root` into a real rank"""
+        return (vrank + root) % self.size
+
+    def bcast(self, obj=None, root: int = 0):
+        """Broadcast `obj` from `root` along a binomial tree."""
+        size = self.size
+        vrank = (self.rank - root) % size
+
+        # receive from the parent (the rank with our lowest set bit cleared)
+        mask = 1
+        while mask < size:
+            if vrank & mask:
+                obj = self.recv(self._real(vrank - mask, root))
+                break
+            mask <<= 1
+
+        # forward to the children, largest sub-tree first
+        mask >>= 1
+        while mask > 0:
+            if vrank + mask < size:
+                self.send(obj, self._real(vrank + mask, root))
+            mask >>= 1
+        return obj
+
+    def scatter(self, objs=None, root: int = 0):
+        """Scatter ``objs[i]`` from `root` to rank ``i`` along a binomial tree."""
+        size = self.size
+        vrank = (self.rank - root) % size
+
+        mask = 1
+        if vrank == 0:
+            if len(objs) != size:
+                raise ValueError(f"scatter requires {size} objects, got {len(objs)}")
+            # order by relative rank, so every sub-tree is a contiguous chunk
+            chunk = [objs[self._real(v, root)] for v in range(size)]
+            while mask < size:
+                mask <<= 1
+        else:
+            while mask < size:
+                if vrank & mask:
+                    chunk = self.recv(self._real(vrank - mask, root))
+                    break
+                mask <<= 1
+
+        mask >>= 1
+        while mask > 0:
+            if vrank + mask < size:
+                self.send(chunk[mask:], self._real(vrank + mask, root))
+                chunk = chunk[:mask]
+            mask >>= 1
+        return chunk[0]
+
+    def gather(self, obj, root: int = 0):
+        """Gather `obj` from all ranks on `root` along a binomial tree.
+
+        Returns the list of objects (in rank order) on `root`, None elsewhere.
+        """
+        size = self.size
+        vrank = (self.rank - root) % size
+
+        # objects of the sub-tree rooted at this rank (relative rank order)
+        chunk = [obj]
+        mask = 1
+        while mask < size:
+            if vrank & mask:
+                self.send(chunk, self._real(vrank - mask, root))
+                return None
+            if vrank + mask < size:
+                chunk.extend(self.recv(self._real(vrank + mask, root)))
+            mask <<= 1
+
+        return [chunk[(rank - root) % size] for rank in range(size)]
+
+    def reduce(self, obj, op: Callable[[Any, Any], Any] = operator.add, root: int = 0):
+        """Reduce `obj` on `root` along a binomial tree.
+
+        `op` must be associative and commutative.
+        Returns the reduced value on `root`, None elsewhere.
+        """
+        size = self.size
+        vrank = (self.rank - root) % size
+
+        mask = 1
+        while mask < size:
+            if vrank & mask:
+                self.send(obj, self._real(vrank - mask, root))
+                return None
+            if vrank + mask < size:
+                obj = op(obj, self.recv(self._real(vrank + mask, root)))
+            mask <<= 1
+        return obj
+
+    def allreduce(self, obj, op: Callable[[Any, Any], Any] = operator.add):
+        """Reduce `obj` on all ranks using recursive doubling.
+
+        For a non power-of-two number of ranks, the first ``2*rem`` ranks pair
+        up so that a power-of-two number of ranks does the doubling.
+        `op` must be associative and commutative.
+        """
+        size, rank = self.size, self.rank
+        pof2 = 1 << (size.bit_length() - 1)
+        rem = size - pof2
+
+        if rank < 2 * rem:
+            if rank % 2 == 0:
+                # hand over the value to the next rank, and wait for the result
+                self.send(obj, rank + 1)
+                return self.recv(rank + 1)
+            obj = op(self.recv(rank - 1), obj)
+            newrank = rank // 2
+        else:
+            newrank = rank - rem
+
+        mask = 1
+        while mask < pof2:
+            newpartner = newrank ^ mask
+            partner = newpartner * 2 + 1 if newpartner < rem else newpartner + rem
+            other = self.sendrecv(obj, partner)
+            # keep the order of the operands equal on both sides
+            obj = op(obj, other) if rank < partner else op(other, obj)
+            mask <<= 1
+
+        if rank < 2 * rem:
+            self.send(obj, rank - 1)
+        return obj
+
+    def barrier(self):
+        """Dissemination barrier, ``ceil(log2(P))`` rounds."""
+        size, rank = self.size, self.rank
+        dist = 1
+        while dist < size:
+            self.send(None, (rank + dist) % size)
+            self.recv((rank - dist) % size)
+            dist <<= 1
+
+    def Bcast(self, buf, root: int = 0, algorithm: str | None = None):
+        """Broadcast the numpy array `buf` in place, see `lsm.bcast.bcast`."""
+        from ..bcast import bcast
+        bcast(self, buf, root, algorithm)
+
+    def close(self):
+        for conn in self.conns:
+            if conn is not None:
+                conn.close()
+
+
+def _worker(rank, conns, queue, target, args):
+    comm = Communicator(rank, conns)
+    try:
+        queue.put((rank, target(comm, *args), None))
+    except BaseException as exc:
+        traceback.print_exc()
+        queue.put((rank, None, f"{type(exc).__name__}: {exc}"))
+    finally:
+        comm.close()
+
+
+def launch(NP: int, target: Callable, *args, transport: str = "shm") -> list:
+    """Run ``target(comm, *args)`` on `NP` processes.
+
+    Returns the list of return values, by rank.
+    If any rank raises, all processes are terminated and a `RuntimeError`
+    is raised.
+    """
+    mesh = create_mesh(NP, transport)
+    queue = mp.Queue()
+    processes = [
+        mp.Process(target=_worker, args=(rank, mesh[rank], queue, target, args))
+        for rank in range(NP)
+    ]
+    for p in processes:
+        p.start()
+
+    results = [None] * NP
+    failed = None
+    for _ in range(NP):
+        rank, ret, error = queue.get()
+        if error is not None:
+            failed = f"rank {rank} failed: {error}"
+            break
+        results[rank] = ret
+
+    for p in processes:
+        if failed:
+            # the other ranks may wait forever for the failed one
+            p.terminate()
+        p.join()
+    if failed:
+        raise RuntimeError(failed)
+    return results
+
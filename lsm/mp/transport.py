@@ -0,0 +1,275 @@
+"""Shared-memory transport for `multiprocessing.Pipe` connections.
+
+Sending a numpy array through a `multiprocessing.Pipe` pickles it, copies
+the bytes through the pipe and unpickles it on the other end.
+Here the array payload is instead copied into a
+`multiprocessing.shared_memory` segment (an *arena*) owned by the sending
+end, and only a small `ShmHeader` (segment name, shape, dtype, offset)
+travels through the pipe.
+
+The arena is used as a ring buffer. The first bytes of the segment hold a
+control block which the receiver updates when it is done with a message,
+so the sender knows when it may overwrite that part of the arena.
+
+`ShmConnection` has the same ``send``/``recv``/``poll``/``close`` methods as
+a `multiprocessing.connection.Connection`, hence it can be passed to the
+existing ``message(rank, recv_conn, send_conn)`` style functions:
+
+>>> recvs, sends = create_shm_connections(NP)
+>>> sends = list(sends[1:]) + [sends[0]]
+>>> processes = [mp.Process(target=ring, args=(rank, recvs[rank], sends[rank]))
+...              for rank in range(NP)]
+
+Anything which isn't a (large enough) numpy array is sent through the pipe
+as usual.
+"""
+
+from __future__ import annotations
+
+import time
+from multiprocessing import Pipe, resource_tracker, shared_memory
+from typing import NamedTuple
+
+import numpy as np
+
+# Size of the control block in front of the data region (one cache line)
+CONTROL_BYTES = 64
+# Control block slots (int64)
+_CONSUMED = 0  # logical end position of the last released message
+_ATTACHED = 1  # set by the receiver once it has attached (and unlinked)
+
+# Default size of an arena, it grows when a message doesn't fit
+DEFAULT_CAPACITY = 16 * 1024 ** 2
+# Arrays smaller than this are cheaper to pickle through the pipe
+DEFAULT_MIN_NBYTES = 8 * 1024
+
+
+class ShmHeader(NamedTuple):
+    """Message sent through the pipe in place of an array payload."""
+    name: str
+    shape: tuple[int, ...]
+    dtype: str
+    offset: int
+    end: int
+
+
+class _Arena:
+    """Sending side of a shared-memory ring buffer."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(create=True, size=CONTROL_BYTES + capacity)
+        self.control = np.ndarray(2, dtype=np.int64, buffer=self.shm.buf)
+        self.control[:] = 0
+        # logical position of the next write
+        self.produced = 0
+
+    def reserve(self, nbytes: int) -> tuple[int, int]:
+        """Return ``(offset, end)`` of a region of `nbytes`, waiting for the
+        receiver to release enough of the arena."""
+        start = self.produced
+        # never let a message wrap around the end of the arena
+        if start % self.capacity + nbytes > self.capacity:
+            start += self.capacity - start % self.capacity
+        end = start + nbytes
+        while end - self.control[_CONSUMED] > self.capacity:
+            time.sleep(0)
+        self.produced = end
+        return start % self.capacity, end
+
+    def drained(self) -> bool:
+        return self.control[_CONSUMED] == self.produced
+
+    def close(self):
+        # The receiver unlinks the segment once attached.
+        # If it never attached, and nothing is pending, we have to do it.
+        unlink = not self.control[_ATTACHED] and self.produced == 0
+        del self.control
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class ShmConnection:
+    """A `multiprocessing` connection moving array payloads through shared memory.
+
+    Parameters
+    ----------
+    conn :
+        the underlying connection (from `multiprocessing.Pipe`).
+    capacity :
+        initial size (bytes) of the arena used for outgoing arrays.
+    min_nbytes :
+        arrays smaller than this are pickled through the pipe.
+    """
+
+    def __init__(self, conn, capacity: int = DEFAULT_CAPACITY,
+                 min_nbytes: int = DEFAULT_MIN_NBYTES):
+        self.conn = conn
+        self.capacity = capacity
+        self.min_nbytes = min_nbytes
+        # created lazily by the *sending* process
+        self._arena: _Arena | None = None
+        # segments attached for receiving, by name
+        self._attached: dict[str, shared_memory.SharedMemory] = {}
+        self._controls: dict[str, np.ndarray] = {}
+        # segments we couldn't close yet (views still alive)
+        self._retired: list[shared_memory.SharedMemory] = []
+        # (name, end) of a message whose view has been handed out
+        self._pending: tuple[str, int] | None = None
+
+    # ------------------------------------------------------------------
+    # Sending
+    # ------------------------------------------------------------------
+
+    def _use_shm(self, obj) -> bool:
+        return (isinstance(obj, np.ndarray)
+                and not obj.dtype.hasobject
+                and obj.nbytes >= self.min_nbytes)
+
+    def _arena_for(self, nbytes: int) -> _Arena:
+        arena = self._arena
+        if arena is not None and nbytes <= arena.capacity:
+            return arena
+
+        capacity = max(self.capacity, nbytes)
+        if arena is not None:
+            # wait until the receiver is done with the old arena
+            while not arena.drained():
+                time.sleep(0)
+            arena.close()
+            capacity = max(capacity, 2 * arena.capacity)
+        self._arena = _Arena(capacity)
+        return self._arena
+
+    def send(self, obj):
+        """Send `obj`, numpy arrays are copied through shared memory."""
+        if not self._use_shm(obj):
+            self.conn.send(obj)
+            return
+
+        arena = self._arena_for(obj.nbytes)
+        offset, end = arena.reserve(obj.nbytes)
+        dst = np.ndarray(obj.shape, dtype=obj.dtype, buffer=arena.shm.buf,
+                         offset=CONTROL_BYTES + offset)
+        dst[...] = obj
+        del dst
+        self.conn.send(ShmHeader(arena.shm.name, obj.shape, obj.dtype.str, offset, end))
+
+    # ------------------------------------------------------------------
+    # Receiving
+    # ------------------------------------------------------------------
+
+    def _attach(self, name: str) -> shared_memory.SharedMemory:
+        shm = self._attached.get(name)
+        if shm is not None:
+            return shm
+
+        # The sender only ever creates a new arena when the old one
+        # is drained, so all previously attached segments are done.
+        self._detach()
+        shm = shared_memory.SharedMemory(name=name)
+        # Only this process will ever attach, so the name is no longer needed.
+        # This also unregisters it from the resource tracker.
+        shm.unlink()
+        control = np.ndarray(2, dtype=np.int64, buffer=shm.buf)
+        control[_ATTACHED] = 1
+        self._attached[name] = shm
+        self._controls[name] = control
+        return shm
+
+    def _detach(self):
+        self._controls.clear()
+        self._retired.extend(self._attached.values())
+        self._attached.clear()
+        retired, self._retired = self._retired, []
+        for shm in retired:
+            try:
+                shm.close()
+            except BufferError:
+                # a user still holds a view into this segment
+                self._retired.append(shm)
+
+    def release(self):
+        """Release the view handed out by the last ``recv(copy=False)``."""
+        if self._pending is not None:
+            name, end = self._pending
+            self._controls[name][_CONSUMED] = end
+            self._pending = None
+
+    def recv(self, copy: bool = True, out: np.ndarray | None = None):
+        """Receive the next object.
+
+        Parameters
+        ----------
+        copy :
+            if false, arrays are returned as read-only views into the
+            shared-memory segment. The view is valid until the next
+            call of `recv` (or `release`).
+        out :
+            copy a received array into this (preallocated) array instead
+            of allocating a new one.
+        """
+        self.release()
+        msg = self.conn.recv()
+        if not isinstance(msg, ShmHeader):
+            return msg
+
+        shm = self._attach(msg.name)
+        src = np.ndarray(msg.shape, dtype=np.dtype(msg.dtype), buffer=shm.buf,
+                         offset=CONTROL_BYTES + msg.offset)
+        if not copy and out is None:
+            src.flags.writeable = False
+            self._pending = (msg.name, msg.end)
+            return src
+
+        if out is None:
+            out = src.copy()
+        else:
+            out[...] = src
+        del src
+        self._controls[msg.name][_CONSUMED] = msg.end
+        return out
+
+    # ------------------------------------------------------------------
+    # Connection interface
+    # ------------------------------------------------------------------
+
+    def poll(self, timeout: float | None = 0.0) -> bool:
+        return self.conn.poll(timeout)
+
+    def close(self):
+        """Close the connection and release the shared-memory segments."""
+        self.release()
+        if self._arena is not None:
+            self._arena.close()
+            self._arena = None
+        self._detach()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def shm_pipe(duplex: bool = True, **kwargs) -> tuple[ShmConnection, ShmConnection]:
+    """Shared-memory equivalent of `multiprocessing.Pipe`.
+
+    Keyword arguments are passed to `ShmConnection`.
+    """
+    # Start the resource tracker in the parent so all forked children share
+    # it, otherwise a segment could be cleaned up when its sender exits.
+    resource_tracker.ensure_running()
+    c1, c2 = Pipe(duplex)
+    return ShmConnection(c1, **kwargs), ShmConnection(c2, **kwargs)
+
+
+def create_shm_connections(NP: int, duplex: bool = False, **kwargs):
+    """Create a tuple of ``receive, sends`` of `NP` objects from a
+    `shm_pipe` call.
+
+    Drop-in replacement of the ``create_connections`` helper in the w03 labs.
+    """
+    return zip(*[shm_pipe(duplex, **kwargs) for _ in range(NP)])
@@ -9,6 +9,7 @@
 #include <math.h>
 #include <string.h>
 #include <assert.h>
+#include <unistd.h>
 #include "mpi.h"
 
 // Boundary values 
@@ -23,12 +24,41 @@
 #define CONVERGENCE_ACCURACY 1e-4
 // How often to report the norm
 #define REPORT_NORM_PERIOD 1000
+//
+// Compile with -DCOPY_GRID to copy grid_new into grid after every iteration
+// (the original version), instead of swapping the two buffers.
+// Set JACOBI_BENCH=1 in the environment to report the bytes moved per
+// iteration on stderr (next to the /bin/time output of the sub scripts).
+// The residual is computed in the same sweep as the update. Compile with
+// -DCHECK_EVERY=N to check the convergence only every N iterations, with an
+// MPI_Iallreduce which completes N iterations later (overlapped with the
+// sweeps in between), instead of an MPI_Allreduce in every iteration.
+//
+// Options (before the sizes):
+//   -t [ROWSx]COLS  update the grid in tiles of ROWS x COLS points, so the
+//                   rows i-1, i, i+1 of a tile stay in cache (0 = no tiling)
+//   -d DEPTH        temporal blocking: DEPTH sweeps per halo exchange, with
+//                   DEPTH ghost rows (the convergence is checked once per
+//                   exchange)
+//   -x MODE         halo exchange: p2p (MPI_Send/MPI_Recv, the default), or
+//                   one-sided MPI_Put into the ghost rows of the neighbours
+//                   within fence or pscw (post/start/complete/wait) epochs
 
 int nx, ny, ny2;
 int max_iter = MAX_ITERATIONS;
 int report_period = REPORT_NORM_PERIOD;
+int tile_i = 0, tile_j = 0;
+int depth = 1;
+
+#define EXCHANGE_P2P 0
+#define EXCHANGE_FENCE 1
+#define EXCHANGE_PSCW 2
+int exchange = EXCHANGE_P2P;
 
 void initialise(double**, double**, int, int, int);
+double sweep(double**, double**, int, int, int, int, int);
+void report_traffic(int local_nx, int iterations, double time, int myrank, int size);
+int rows_of(int rank, int size);
 double* allocate_matrix_as_array(int nrows, int ncols);
 double** allocate_matrix(int nrows, int ncols, double* arr_A);
 
@@ -40,6 +70,35 @@ int main(int argc, char * argv[]) {
 	MPI_Comm_rank(MPI_COMM_WORLD, &myrank);
 	MPI_Comm_size(MPI_COMM_WORLD, &size);
 
+	int opt;
+	while ((opt = getopt(argc, argv, "t:d:x:")) != -1) {
+		switch (opt) {
+		case 't':
+			if (sscanf(optarg, "%dx%d", &tile_i, &tile_j) == 1) {
+				tile_j = tile_i;
+				tile_i = 0;
+			}
+			break;
+		case 'd':
+			depth = atoi(optarg);
+			break;
+		case 'x':
+			if (strcmp(optarg, "p2p") == 0) exchange = EXCHANGE_P2P;
+			else if (strcmp(optarg, "fence") == 0) exchange = EXCHANGE_FENCE;
+			else if (strcmp(optarg, "pscw") == 0) exchange = EXCHANGE_PSCW;
+			else {
+				if (myrank==0) fprintf(stderr, "Unknown exchange mode %s (p2p, fence, pscw)\n", optarg);
+				return -1;
+			}
+			break;
+		default:
+			if (myrank==0) fprintf(stderr, "Usage: %s [-t [ROWSx]COLS] [-d DEPTH] [-x p2p|fence|pscw] nx ny [max_iter]\n", argv[0]);
+			return -1;
+		}
+	}
+	argc -= optind - 1;
+	argv += optind - 1;
+
 	if (argc < 3) {
 		if (myrank==0) fprintf(stderr, "You must provide the size in X and size in Y as arguments to this code\n");
 		return -1;
@@ -51,31 +110,65 @@ int main(int argc, char * argv[]) {
 	    max_iter = atoi(argv[3]);
 	    report_period = max_iter + 1;
 	}
+	if (depth < 1) depth = 1;
 
 	if (myrank==0) printf("Solving to accuracy of %.0e, global system size is x=%d y=%d (at most %d iterations)\n", CONVERGENCE_ACCURACY, nx, ny, max_iter);
-	int local_nx=nx/size;
-	if (local_nx * size < nx) {
-		if (myrank < nx - local_nx * size) local_nx++;
+	int local_nx=rows_of(myrank, size);
+	if (local_nx < depth) {
+		fprintf(stderr, "Rank %d has %d rows, less than the depth %d\n", myrank, local_nx, depth);
+		MPI_Abort(MPI_COMM_WORLD, 1);
 	}
+	// rows of the local grid, with depth ghost rows on each side; the own
+	// rows are depth .. local_nx+depth-1
+	int nrows = local_nx + 2*depth;
+	int first = depth, last = local_nx + depth - 1;
 
-	double * grid1d =  allocate_matrix_as_array(local_nx+2,ny+2);
-	double * grid_new1d = allocate_matrix_as_array(local_nx+2,ny+2);
+	double * grid1d =  allocate_matrix_as_array(nrows,ny+2);
+	double * grid_new1d = allocate_matrix_as_array(nrows,ny+2);
 
-        double **grid = allocate_matrix(local_nx+2,ny+2,grid1d);
-        double **grid_new = allocate_matrix(local_nx+2,ny+2,grid_new1d);
+        double **grid = allocate_matrix(nrows,ny+2,grid1d);
+        double **grid_new = allocate_matrix(nrows,ny+2,grid_new1d);
 	double start_time;
 
-        MPI_Win win;
-        MPI_Aint disp;
+	// One-sided exchange: both grids are exposed in windows (swapped with
+	// the grids), and each rank puts its first/last rows into the ghost
+	// rows of its neighbours. A single rank has nothing to exchange.
+	MPI_Win win = MPI_WIN_NULL, win_new = MPI_WIN_NULL;
+	MPI_Group neighbours = MPI_GROUP_NULL;
+	// displacement of the lower ghost rows of rank myrank-1, the upper
+	// ones of rank myrank+1 start at 1 (row 0, column 1)
+	MPI_Aint disp = 0;
+	if (size == 1) exchange = EXCHANGE_P2P;
+	if (exchange != EXCHANGE_P2P) {
+		MPI_Aint bytes = sizeof(double) * (MPI_Aint)nrows * ny2;
+		MPI_Win_create(grid1d, bytes, sizeof(double), MPI_INFO_NULL, MPI_COMM_WORLD, &win);
+		MPI_Win_create(grid_new1d, bytes, sizeof(double), MPI_INFO_NULL, MPI_COMM_WORLD, &win_new);
+		if (myrank > 0) disp = (MPI_Aint)(rows_of(myrank-1, size) + depth) * ny2 + 1;
+		if (exchange == EXCHANGE_PSCW) {
+			int ranks[2], n = 0;
+			if (myrank > 0) ranks[n++] = myrank-1;
+			if (myrank < size-1) ranks[n++] = myrank+1;
+			MPI_Group world;
+			MPI_Comm_group(MPI_COMM_WORLD, &world);
+			MPI_Group_incl(world, n, ranks, &neighbours);
+			MPI_Group_free(&world);
+		}
+	}
 
 	initialise(grid, grid_new, local_nx, myrank, size);
 
-	double rnorm=0.0, bnorm=0.0, norm, tmpnorm=0.0;
+	double rnorm=0.0, bnorm=0.0, norm=1.0, tmpnorm=0.0;
 	MPI_Request requests[]={MPI_REQUEST_NULL, MPI_REQUEST_NULL, MPI_REQUEST_NULL, MPI_REQUEST_NULL};
+#ifdef CHECK_EVERY
+	// in flight reduction of the residual of iteration `checked`
+	MPI_Request norm_request = MPI_REQUEST_NULL;
+	double sendnorm = 0.0;
+	int checked = 0;
+#endif
 
         // Initial nor factor
 	int i,j,k;
-	for (i=1;i<=local_nx;i++) {
+	for (i=first;i<=last;i++) {
 		for (j=1;j<ny+1;j++) {		
 			//tmpnorm=tmpnorm+pow(grid[i][j]*4-grid[i][j-1]-grid[i][j+1]-grid[i-1][j]-grid[i+1][j],2);
 			double tmp = grid[i][j]*4-grid[i][j-1]
@@ -91,39 +184,101 @@ int main(int argc, char * argv[]) {
 	for (k=0;k<max_iter;k++) {
  
 		//printf("Iteration %d starting.\n", k);
-		if (myrank > 0) {
-			MPI_Recv(&grid[0][1], ny, MPI_DOUBLE, myrank-1, 0, MPI_COMM_WORLD, MPI_STATUS_IGNORE);
-			MPI_Send(&grid[1][1], ny, MPI_DOUBLE, myrank-1, 0, MPI_COMM_WORLD);
-		}
-		if (myrank < size-1) {
-			MPI_Send(&grid[local_nx][1], ny, MPI_DOUBLE, myrank+1, 0, MPI_COMM_WORLD);
-			MPI_Recv(&grid[local_nx+1][1], ny, MPI_DOUBLE, myrank+1, 0, MPI_COMM_WORLD, MPI_STATUS_IGNORE);
+		// sweep s of the temporal block, the ghost rows are exchanged
+		// before the first one
+		int s = k % depth;
+		if (s == 0) {
+			// depth rows, from column 1 of the first row to column ny of the last
+			int count = depth*ny2 - 2;
+			if (exchange == EXCHANGE_P2P) {
+				if (myrank > 0) {
+					MPI_Recv(&grid[0][1], count, MPI_DOUBLE, myrank-1, 0, MPI_COMM_WORLD, MPI_STATUS_IGNORE);
+					MPI_Send(&grid[first][1], count, MPI_DOUBLE, myrank-1, 0, MPI_COMM_WORLD);
+				}
+				if (myrank < size-1) {
+					MPI_Send(&grid[last-depth+1][1], count, MPI_DOUBLE, myrank+1, 0, MPI_COMM_WORLD);
+					MPI_Recv(&grid[last+1][1], count, MPI_DOUBLE, myrank+1, 0, MPI_COMM_WORLD, MPI_STATUS_IGNORE);
+				}
+			} else {
+				if (exchange == EXCHANGE_FENCE) {
+					MPI_Win_fence(MPI_MODE_NOPRECEDE, win);
+				} else {
+					MPI_Win_post(neighbours, 0, win);
+					MPI_Win_start(neighbours, 0, win);
+				}
+				if (myrank > 0)
+					MPI_Put(&grid[first][1], count, MPI_DOUBLE, myrank-1, disp, count, MPI_DOUBLE, win);
+				if (myrank < size-1)
+					MPI_Put(&grid[last-depth+1][1], count, MPI_DOUBLE, myrank+1, 1, count, MPI_DOUBLE, win);
+				if (exchange == EXCHANGE_FENCE) {
+					MPI_Win_fence(MPI_MODE_NOSUCCEED, win);
+				} else {
+					MPI_Win_complete(win);
+					MPI_Win_wait(win);
+				}
+			}
 		}
+		// each sweep updates one ghost row less on each side
+		int lo = myrank > 0 ? s+1 : first;
+		int hi = myrank < size-1 ? nrows-2-s : last;
 		
-		tmpnorm=0.0;
+#ifdef CHECK_EVERY
+		int check = s == 0 && k % CHECK_EVERY == 0;
+#else
+		int check = s == 0;
+#endif
 		//printf("Updating grid...\n");
-		for (i=1;i<=local_nx;i++) {
-			for (j=1;j<ny+1;j++) {
-				//tmpnorm=tmpnorm+pow(grid[i][j]*4-grid[i][j-1]-grid[i][j+1]-grid[i-1][j]-grid[i+1][j],2);
-			    double tmp = grid[i][j]*4-grid[i][j-1]
-			             -grid[i][j+1]-grid[i-1][j]-grid[i+1][j];
-			    tmpnorm=tmpnorm+(tmp*tmp);
+		// fused residual and update, the residual is the one of grid
+		tmpnorm = sweep(grid, grid_new, lo, hi, first, last, check);
+#ifdef CHECK_EVERY
+		if (check) {
+			if (norm_request != MPI_REQUEST_NULL) {
+				MPI_Wait(&norm_request, MPI_STATUS_IGNORE);
+				norm=sqrt(rnorm)/bnorm;
+				if (norm < CONVERGENCE_ACCURACY) break;
+				if (checked % report_period < CHECK_EVERY && myrank==0) printf("Iteration= %d Relative Norm=%e\n", checked, norm);
 			}
+			sendnorm = tmpnorm;
+			MPI_Iallreduce(&sendnorm, &rnorm, 1, MPI_DOUBLE, MPI_SUM, MPI_COMM_WORLD, &norm_request);
+			checked = k;
 		}
-		MPI_Allreduce(&tmpnorm, &rnorm, 1, MPI_DOUBLE, MPI_SUM, MPI_COMM_WORLD);
-		norm=sqrt(rnorm)/bnorm;
-		if (norm < CONVERGENCE_ACCURACY) break;		
-		for (i=1;i<=local_nx;i++) {
-			for (j=1;j<ny+1;j++) {
-				grid_new[i][j]=0.25*(grid[i][j-1]+grid[i][j+1]+grid[i-1][j]+grid[i+1][j]);
-			}
+#else
+		if (check) {
+			MPI_Allreduce(&tmpnorm, &rnorm, 1, MPI_DOUBLE, MPI_SUM, MPI_COMM_WORLD);
+			norm=sqrt(rnorm)/bnorm;
+			// the update of the last iteration is discarded
+			if (norm < CONVERGENCE_ACCURACY) break;
 		}
-		memcpy(grid1d, grid_new1d, sizeof(double) * (local_nx + 2) * ny2);
+#endif
+#ifdef COPY_GRID
+		memcpy(grid1d, grid_new1d, sizeof(double) * nrows * ny2);
+#else
+		// The boundary values are set in both buffers, and the ghost rows
+		// are refreshed by the halo exchange, so swapping is enough.
+		double *tmp1d = grid1d; grid1d = grid_new1d; grid_new1d = tmp1d;
+		double **tmp = grid; grid = grid_new; grid_new = tmp;
+		MPI_Win tmpwin = win; win = win_new; win_new = tmpwin;
+#endif
 
-		if (k % report_period == 0 && myrank==0) printf("Iteration= %d Relative Norm=%e\n", k, norm);
+#ifndef CHECK_EVERY
+		if (check && k % report_period < depth && myrank==0) printf("Iteration= %d Relative Norm=%e\n", k, norm);
+#endif
 	}
+#ifdef CHECK_EVERY
+	if (norm_request != MPI_REQUEST_NULL) {
+		MPI_Wait(&norm_request, MPI_STATUS_IGNORE);
+		norm=sqrt(rnorm)/bnorm;
+	}
+#endif
+	double total_time = MPI_Wtime() - start_time;
 	if (myrank==0) printf("\nTerminated on %d iterations, Relative Norm=%e, Total time=%e seconds\n", k, norm,
-			MPI_Wtime() - start_time);
+			total_time);
+	if (myrank==0 && getenv("JACOBI_BENCH") != NULL) report_traffic(local_nx, k, total_time, myrank, size);
+	if (win != MPI_WIN_NULL) {
+		MPI_Win_free(&win);
+		MPI_Win_free(&win_new);
+	}
+	if (neighbours != MPI_GROUP_NULL) MPI_Group_free(&neighbours);
 	free(grid1d);
 	free(grid_new1d);
 	free(grid);
@@ -137,28 +292,101 @@ int main(int argc, char * argv[]) {
  * points are zero. grid_new is set to equal grid
  */
 void initialise(double ** grid, double ** grid_new, int local_nx, int myrank, int size) {
-	int i, j;
+	int i, j, g;
+	int nrows = local_nx + 2*depth;
 
-        for (j=0;j<=local_nx+1;j++) {
+        for (j=0;j<nrows;j++) {
                 grid_new[j][0]=grid[j][0]=LEFT;
         }
-        for (j=0;j<=local_nx+1;j++) {
+        for (j=0;j<nrows;j++) {
                 grid_new[j][ny2-1]=grid[j][ny2-1]=RIGHT;
         }
 
-	for (j=0;j<=ny+1;j++) {
-		grid_new[0][j]=grid[0][j]=myrank==0 ? TOP: 0;
-	}
-	for (j=0;j<=ny+1;j++) {
-		grid_new[local_nx+1][j]=grid[local_nx+1][j]= myrank==size-1 ? BOTTOM: 0;		
+	// depth ghost rows on each side, keep LEFT/RIGHT, the ghost rows
+	// next to other ranks are updated with -d
+	for (g=0;g<depth;g++) {
+		for (j=1;j<ny+1;j++) {
+			grid_new[g][j]=grid[g][j]=myrank==0 ? TOP: 0;
+		}
+		for (j=1;j<ny+1;j++) {
+			grid_new[local_nx+depth+g][j]=grid[local_nx+depth+g][j]= myrank==size-1 ? BOTTOM: 0;		
+		}
 	}
-	for (i=1;i<=local_nx;i++) {
+	for (i=depth;i<local_nx+depth;i++) {
 		for (j=1;j<ny+1;j++) {
 			grid_new[i][j]=grid[i][j]=0;
 		}
 	}	
 }
 
+/**
+ * Jacobi update of the rows lo..hi of grid into grid_new, tile by tile
+ * (tile_i rows by tile_j columns, 0 is the whole range). Walking a tile of
+ * tile_j columns down the rows keeps rows i-1, i, i+1 of the tile in cache.
+ * If check, returns the sum of the squared residuals of grid on the rows
+ * rlo..rhi, computed in the same sweep.
+ */
+double sweep(double ** grid, double ** grid_new, int lo, int hi, int rlo, int rhi, int check) {
+	int i, j, ii, jj;
+	int ti = tile_i > 0 ? tile_i : hi - lo + 1;
+	int tj = tile_j > 0 ? tile_j : ny;
+	double tmpnorm = 0.0;
+
+	for (ii=lo;ii<=hi;ii+=ti) {
+		int imax = ii + ti - 1 < hi ? ii + ti - 1 : hi;
+		for (jj=1;jj<ny+1;jj+=tj) {
+			int jmax = jj + tj - 1 < ny ? jj + tj - 1 : ny;
+			for (i=ii;i<=imax;i++) {
+				if (check && i >= rlo && i <= rhi) {
+					for (j=jj;j<=jmax;j++) {
+					    double tmp = grid[i][j]*4-grid[i][j-1]
+					             -grid[i][j+1]-grid[i-1][j]-grid[i+1][j];
+					    tmpnorm=tmpnorm+(tmp*tmp);
+					    grid_new[i][j]=0.25*(grid[i][j-1]+grid[i][j+1]+grid[i-1][j]+grid[i+1][j]);
+					}
+				} else {
+					for (j=jj;j<=jmax;j++) {
+						grid_new[i][j]=0.25*(grid[i][j-1]+grid[i][j+1]+grid[i-1][j]+grid[i+1][j]);
+					}
+				}
+			}
+		}
+	}
+	return tmpnorm;
+}
+
+
+/**
+ * Number of rows of rank, the first nx % size ranks get one more.
+ */
+int rows_of(int rank, int size) {
+	int rows = nx/size;
+	if (rank < nx - rows*size) rows++;
+	return rows;
+}
+
+/**
+ * Print (on stderr) the number of bytes moved through memory per iteration of
+ * this rank, and the resulting memory bandwidth.
+ * The fused residual and update sweep reads grid and writes grid_new,
+ * copying grid_new back reads and writes a full local grid once more.
+ * halo is the number of bytes sent to the neighbours.
+ */
+void report_traffic(int local_nx, int iterations, double time, int myrank, int size) {
+	double grid_bytes = sizeof(double) * (double)local_nx * ny;
+	double sweep = 2 * grid_bytes;
+#ifdef COPY_GRID
+	double copy = 2 * sizeof(double) * (double)(local_nx + 2) * ny2;
+#else
+	double copy = 0;
+#endif
+	// depth rows every depth iterations
+	double halo = ((myrank > 0) + (myrank < size-1)) * sizeof(double) * (double)(depth*ny2 - 2) / depth;
+	double total = sweep + copy + halo;
+	fprintf(stderr, "#bytes/iter sweep=%.3e copy=%.3e halo=%.3e total=%.3e bandwidth=%.3e B/s\n",
+		sweep, copy, halo, total, iterations > 0 ? total * iterations / time : 0.0);
+}
+
 
 /* Allocate a double matrix with one malloc */
 double* allocate_matrix_as_array(int nrows, int ncols) {
@@ -5,6 +5,9 @@ import matplotlib.pyplot as plt
 import scienceplots
 plt.style.use('science')
 
+# Run from the repository root: python -m w03.labs.exercise_6
+from lsm.mp import shm_pipe
+
 def bandwidth_test(rank, conn, array_sizes, results_queue):
     if rank == 0:
         # Sender process
@@ -41,12 +44,13 @@ def bandwidth_test(rank, conn, array_sizes, results_queue):
             # Send acknowledgment
             conn.send("ack")
 
-if __name__ == "__main__":
-    # Create array sizes using logspace (from 10^3 to 10^7 elements)
-    array_sizes = np.logspace(3, 7, 15, dtype=int)
+    # Also releases the shared memory of the "shm" transport
+    conn.close()
 
+def measure(make_pipe, array_sizes):
+    """Run `bandwidth_test` over a pipe created by `make_pipe`"""
     # Create pipe for communication
-    recv_conn, send_conn = mp.Pipe()
+    recv_conn, send_conn = make_pipe()
 
     # Create queue for results
     results_queue = mp.Queue()
@@ -59,20 +63,37 @@ if __name__ == "__main__":
     sender.start()
     receiver.start()
 
+    # Get results from queue (before joining, the queue may hold the sender)
+    results = results_queue.get()
+
     # Wait for completion
     sender.join()
     receiver.join()
+    return results
 
-    # Get results from queue
-    bandwidth_results = results_queue.get()
+if __name__ == "__main__":
+    # Create array sizes using logspace (from 10^3 to 10^7 elements)
+    array_sizes = np.logspace(3, 7, 15, dtype=int)
+
+    # "pickle": arrays are pickled through the pipe
+    # "shm": arrays are copied through shared memory, only a header is pickled
+    transports = {
+        "pickle": mp.Pipe,
+        "shm": shm_pipe,
+    }
+    bandwidth_results = {}
+    for label, make_pipe in transports.items():
+        print(f"Transport: {label}")
+        bandwidth_results[label] = measure(make_pipe, array_sizes)
 
     # Plotting the results
-    sizes_mb, bandwidths = zip(*bandwidth_results)
     plt.figure(figsize=(10, 6))
-    plt.loglog(sizes_mb, bandwidths, marker='o')
+    for label, results in bandwidth_results.items():
+        sizes_mb, bandwidths = zip(*results)
+        plt.loglog(sizes_mb, bandwidths, marker='o', label=label)
     plt.xlabel('Array Size (MB)')
     plt.ylabel('Bandwidth (MB/s)')
     plt.title('Bandwidth vs Array Size')
     plt.grid(True, which="both", ls="--")
+    plt.legend()
     plt.show()
-
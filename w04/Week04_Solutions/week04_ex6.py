@@ -9,49 +9,48 @@ rank = comm.Get_rank()
 NP = comm.Get_size()
 assert NP == 2, "Only 2 processors allowed"
 
+# Largest amount of receive slots of a window (bytes)
+MAX_WINDOW_BYTES = 2 ** 30
+
 def bandwidth_window(rank, N, window: int=12):
     kbs = np.logspace(0, 6, num=N)
     # Max elements
     max_n = int(kbs[-1] * 1024 / 8)
     buffer = np.zeros(max_n, dtype=np.float64)
-    mb = []
+    size_mb = []
+    moved_mb = []
     s = []
     reqs = [None] * window
-
     if rank == 0:
-        status = MPI.Status()
-        for kb in kbs:
-            # elements
-            n = int(kb * 1024 / 8)
+        # the messages of a window are in flight at the same time, each
+        # needs its own receive slot; touched here so that no page fault
+        # is timed
+        slots = np.zeros((window, min(max_n, MAX_WINDOW_BYTES // (8 * window))),
+                         dtype=np.float64)
+
+    for kb in kbs:
+        # elements
+        n = int(kb * 1024 / 8)
+        if window * n * 8 > MAX_WINDOW_BYTES:
+            break
+        if rank == 0:
+            statuses = [MPI.Status() for _ in range(window)]
             t0 = time()
             for i in range(window):
-                req = comm.Irecv((buffer, n, MPI.DOUBLE), 1, tag=window)
-                reqs[i] = req
-            MPI.Request.Waitall(reqs)
+                reqs[i] = comm.Irecv(slots[i, :n], 1, tag=window)
+            MPI.Request.Waitall(reqs, statuses)
             s.append(time() - t0)
-            try:
-                for req in reqs:
-                    req.Free()
-            except: pass
-            mb.append(status.Get_count() / 1024 ** 2) # MB
-    else:
-
-        for kb in kbs:
-            # elements
-            n = int(kb * 1024 / 8)
+            # all the messages of the window count
+            moved_mb.append(sum(st.Get_count(MPI.BYTE) for st in statuses) / 1024 ** 2)
+        else:
             t0 = time()
             for i in range(window):
-                req = comm.Isend((buffer, n, MPI.DOUBLE), 0, tag=window)
-                reqs[i] = req
+                reqs[i] = comm.Isend((buffer, n, MPI.DOUBLE), 0, tag=window)
             MPI.Request.Waitall(reqs)
             s.append(time() - t0)
-            try:
-                for req in reqs:
-                    req.Free()
-            except: pass
-            mb.append(n * 8 / 1024 ** 2) # MB
-    mb = np.asarray(mb)
-    return mb, mb/s
+            moved_mb.append(window * n * 8 / 1024 ** 2)
+        size_mb.append(n * 8 / 1024 ** 2) # MB
+    return np.asarray(size_mb), np.asarray(moved_mb) / s
 
 
 def bandwidth(rank, N):